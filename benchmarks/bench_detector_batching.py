@@ -0,0 +1,81 @@
+"""
+Throughput benchmark for the batched tile detection (src/detector.py) on CPU.
+
+Runs the same set of 640x640 tiles through the detector with different batch sizes and prints tiles/s.
+The tiles are cut from a real drawing if --image is given, otherwise synthetic drawing-like tiles are used.
+
+usage (from the project root):
+    python benchmarks/bench_detector_batching.py --weights store/ai/model_weights/weights/best.pt --image store/ai/test6.jpg
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cv2  # noqa: E402
+import torch  # noqa: E402
+
+from src.detector import Detector  # noqa: E402
+
+
+def make_tiles(image_path, num_tiles, tile_size):
+    if image_path:
+        img = cv2.imread(image_path)
+        tiles = []
+        for y in range(0, img.shape[0] - tile_size + 1, tile_size):
+            for x in range(0, img.shape[1] - tile_size + 1, tile_size):
+                tiles.append(np.ascontiguousarray(img[y:y + tile_size, x:x + tile_size]))
+        if not tiles:
+            raise ValueError(f"image {image_path} is smaller than one tile")
+        return [tiles[i % len(tiles)] for i in range(num_tiles)]
+
+    # white paper with some dark strokes, similar to a floor plan
+    rng = np.random.default_rng(0)
+    tiles = []
+    for _ in range(num_tiles):
+        tile = np.full((tile_size, tile_size, 3), 255, dtype=np.uint8)
+        for _ in range(40):
+            x, y = rng.integers(0, tile_size - 60, size=2)
+            cv2.rectangle(tile, (int(x), int(y)), (int(x) + 50, int(y) + 12), (0, 0, 0), 1)
+        tiles.append(tile)
+    return tiles
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--weights', required=True, help='yolov7 weights, e.g. store/ai/model_weights/weights/best.pt')
+    parser.add_argument('--image', default=None, help='drawing to cut the tiles from')
+    parser.add_argument('--num-tiles', type=int, default=48)
+    parser.add_argument('--tile-size', type=int, default=640)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 4, 8, 16])
+    parser.add_argument('--threads', type=int, default=None, help='torch cpu threads')
+    parser.add_argument('--no-augment', action='store_true', help='disable test time augmentation')
+    opt = parser.parse_args()
+
+    if opt.threads:
+        torch.set_num_threads(opt.threads)
+
+    detector = Detector(opt.weights, img_size=opt.tile_size, augment=not opt.no_augment)
+    tiles = make_tiles(opt.image, opt.num_tiles, opt.tile_size)
+
+    # warm up
+    detector.detect(tiles[:1], batch_size=1)
+
+    print(f"{len(tiles)} tiles, {torch.get_num_threads()} threads, augment={detector.augment}")
+    baseline = None
+    for batch_size in opt.batch_sizes:
+        start = time.perf_counter()
+        detector.detect(tiles, batch_size=batch_size)
+        elapsed = time.perf_counter() - start
+
+        throughput = len(tiles) / elapsed
+        baseline = baseline or throughput
+        print(f"batch size {batch_size:>3}: {elapsed:7.2f}s  {throughput:6.2f} tiles/s  x{throughput / baseline:.2f}")
+
+
+if __name__ == '__main__':
+    main()
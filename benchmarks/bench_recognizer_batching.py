@@ -0,0 +1,83 @@
+"""
+Throughput benchmark for the batched text recognition (src/recognizer.py) on CPU.
+
+Recognizes the same set of snippets with different batch sizes, with and without aspect ratio bucketing,
+and prints snippets/s. The snippets are cut from a detection result (results.json + original/) if --detection is
+given, otherwise synthetic room stamp like snippets are rendered.
+
+usage (from the project root):
+    python benchmarks/bench_recognizer_batching.py --detection media/outputs/project_1/p1_1/text_detection/final
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cv2  # noqa: E402
+import torch  # noqa: E402
+
+from src.recognizer import Recognizer  # noqa: E402
+
+
+def make_snippets(detection_path, num_snippets, cache_path, recognizer):
+    if detection_path:
+        data = recognizer.make_snippets_from_images_and_coords(detection_path, cache_path)
+        snippets = [element["snippet"] for image in data.values() for element in image["elements"]]
+        if not snippets:
+            raise ValueError(f"no text elements found in {detection_path}")
+        return [snippets[i % len(snippets)] for i in range(num_snippets)]
+
+    # black text of different lengths on white paper
+    rng = np.random.default_rng(0)
+    words = ["WC", "Bad", "Flur", "Küche", "Wohnen", "Schlafen", "Abstellraum", "F: 12,34 m²", "U: 14,50 m"]
+    snippets = []
+    for _ in range(num_snippets):
+        text = words[rng.integers(len(words))].encode("ascii", "replace").decode()
+        (w, h), baseline = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, 0.8, 2)
+        snippet = np.full((h + baseline + 8, w + 8, 3), 255, dtype=np.uint8)
+        cv2.putText(snippet, text, (4, h + 4), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 0), 2)
+        snippets.append(snippet)
+    return snippets
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--detection', default=None, help='text_detection/final dir with results.json and original/')
+    parser.add_argument('--num-snippets', type=int, default=256)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 8, 32, 64])
+    parser.add_argument('--threads', type=int, default=None, help='torch cpu threads')
+    opt = parser.parse_args()
+
+    if opt.threads:
+        torch.set_num_threads(opt.threads)
+
+    cache_path = tempfile.mkdtemp()
+    config = {"paths": {"text_recognition": {"cache_path": cache_path, "final_path": cache_path}}}
+    recognizer = Recognizer(config)
+    snippets = make_snippets(opt.detection, opt.num_snippets, cache_path, recognizer)
+
+    # warm up
+    recognizer.recognize(snippets[:1], batch_size=1)
+
+    print(f"{len(snippets)} snippets, {torch.get_num_threads()} threads")
+    baseline = None
+    for bucket in (False, True):
+        recognizer.bucket_by_aspect_ratio = bucket
+        for batch_size in opt.batch_sizes:
+            start = time.perf_counter()
+            recognizer.recognize(snippets, batch_size=batch_size)
+            elapsed = time.perf_counter() - start
+
+            throughput = len(snippets) / elapsed
+            baseline = baseline or throughput
+            print(f"bucketing {str(bucket):>5}, batch size {batch_size:>3}: {elapsed:7.2f}s  "
+                  f"{throughput:7.2f} snippets/s  x{throughput / baseline:.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Benchmark of the clustering of the text elements into text fields (TextFieldFinder in src/interpreter.py).
+
+Compares the grid + union-find clustering (src/clustering.py) with the former DBSCAN path (sklearn DBSCAN per image
+plus one np.where per cluster label) on synthetic drawings with 1k, 10k and 100k text elements: room stamps of 2 to
+4 lines spread over the drawing, plus single elements (dimensions, axis labels) which are noise. Checks that both
+paths find the same clusters and prints the time of both.
+
+usage (from the project root):
+    python benchmarks/bench_text_field_clustering.py --sizes 1000 10000 100000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.clustering import clusters_from_labels, grid_cluster  # noqa: E402
+
+
+def make_elements(num_elements, seed=0, text_height=20):
+    """
+    :return: (N, 4) array of the bounding boxes (x1, y1, x2, y2), in the order of a detection result (top to bottom)
+    """
+    rng = np.random.default_rng(seed)
+    # the drawing grows with the number of elements, so that the density stays that of a real drawing
+    size = int(np.sqrt(num_elements) * 150)
+    boxes = []
+    while len(boxes) < num_elements:
+        x, y = rng.integers(0, size, 2)
+        lines = rng.choice([1, 2, 3, 4], p=[0.25, 0.15, 0.3, 0.3])
+        for line in range(lines):
+            height = text_height + rng.integers(-4, 5)
+            width = rng.integers(30, 160)
+            top = y + line * int(text_height * 1.3)
+            boxes.append((x, top, x + width, top + height))
+    boxes = np.array(boxes[:num_elements], dtype=np.float64)
+    return boxes[np.argsort(boxes[:, 1], kind="stable")]
+
+
+def dbscan_clusters(boxes, height_factor=2):
+    # the former path of TextFieldFinder.get_cluster_labels + get_clusters
+    from sklearn.cluster import DBSCAN
+
+    points_list = []
+    text_heights = []
+    for x1, y1, x2, y2 in boxes.tolist():
+        points_list.append((x1, y1))
+        text_heights.append(abs(y2 - y1))
+    epsilon = np.mean(text_heights) * height_factor
+    labels = DBSCAN(eps=epsilon, min_samples=2).fit(np.array(points_list)).labels_
+
+    clusters = []
+    for label in set(labels):
+        if label == -1:
+            continue
+        clusters.append(np.where(labels == label)[0])
+    return clusters
+
+
+def grid_clusters(boxes, height_factor=2):
+    epsilon = np.mean(np.abs(boxes[:, 3] - boxes[:, 1])) * height_factor
+    return clusters_from_labels(grid_cluster(boxes[:, :2], epsilon))
+
+
+def measure(function, boxes, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function(boxes)
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--no-dbscan', action='store_true', help='only the grid clustering (sklearn not installed)')
+    opt = parser.parse_args()
+
+    for size in opt.sizes:
+        boxes = make_elements(size)
+        grid_seconds, grid_result = measure(grid_clusters, boxes, opt.repeats)
+        line = f"{size:>7} elements, {len(grid_result):>6} clusters: grid {grid_seconds * 1000:9.1f} ms"
+
+        if not opt.no_dbscan:
+            dbscan_seconds, dbscan_result = measure(dbscan_clusters, boxes, opt.repeats)
+            same = len(grid_result) == len(dbscan_result) and all(
+                np.array_equal(a, b) for a, b in zip(grid_result, dbscan_result)
+            )
+            line += (f", dbscan {dbscan_seconds * 1000:9.1f} ms, x{dbscan_seconds / grid_seconds:.1f}, "
+                     f"same clusters: {same}")
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Import time and memory benchmark for the startup of a django web process.
+
+Every run is a fresh python process which calls django.setup() and resolves the urls of store.urls (this imports
+the views, serializers and tasks), like gunicorn / runserver do on the first request. It prints the time, the peak
+RSS and which heavy ml libraries were imported. The web tier must not import any of them, the ml stack is only
+imported in the celery workers (see store/utility/ai_utils.py). With --with-ml the pipeline modules are imported
+as well, for comparison.
+
+With --max-seconds / --max-rss-mb the script exits with 1 if the median exceeds the limit (regression check).
+
+usage (from the project root):
+    python benchmarks/bench_web_startup.py --runs 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ["torch", "torchvision", "cv2", "tiler", "pandas", "matplotlib", "sklearn", "timm", "pytorch_lightning"]
+
+STARTUP_SCRIPT = """
+import json, resource, sys, time
+start = time.perf_counter()
+import django
+django.setup()
+from django.urls import get_resolver, resolve
+get_resolver().url_patterns
+resolve('/store/projects/')
+if {with_ml}:
+    import src.localizer, src.recognizer, src.interpreter
+elapsed = time.perf_counter() - start
+# ru_maxrss is in kilobytes on linux, in bytes on macos
+maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+rss_mb = maxrss / 1024 ** 2 if sys.platform == 'darwin' else maxrss / 1024
+print(json.dumps({{
+    "seconds": elapsed,
+    "rss_mb": rss_mb,
+    "heavy_modules": sorted(name for name in {heavy} if name in sys.modules),
+}}))
+"""
+
+
+def measure_startup(with_ml=False):
+    script = STARTUP_SCRIPT.format(with_ml=with_ml, heavy=HEAVY_MODULES)
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get("DJANGO_SETTINGS_MODULE", "project.settings"))
+    output = subprocess.run(
+        [sys.executable, "-c", script], cwd=ROOT, env=env, check=True, capture_output=True, text=True
+    ).stdout
+    # the last line is the measurement, everything before are prints of the project
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--with-ml', action='store_true', help='import the ml pipeline as well, for comparison')
+    parser.add_argument('--max-seconds', type=float, default=None)
+    parser.add_argument('--max-rss-mb', type=float, default=None)
+    opt = parser.parse_args()
+
+    runs = [measure_startup(opt.with_ml) for _ in range(opt.runs)]
+    seconds = statistics.median(run["seconds"] for run in runs)
+    rss_mb = statistics.median(run["rss_mb"] for run in runs)
+    heavy_modules = runs[-1]["heavy_modules"]
+
+    print(f"{opt.runs} runs, with ml: {opt.with_ml}")
+    print(f"django.setup() + store.urls: {seconds:.3f}s (median), peak rss {rss_mb:.1f} MB (median)")
+    print(f"heavy ml modules imported: {', '.join(heavy_modules) if heavy_modules else 'none'}")
+
+    failed = False
+    if opt.max_seconds is not None and seconds > opt.max_seconds:
+        print(f"FAILED: startup takes {seconds:.3f}s, limit {opt.max_seconds}s")
+        failed = True
+    if opt.max_rss_mb is not None and rss_mb > opt.max_rss_mb:
+        print(f"FAILED: peak rss {rss_mb:.1f} MB, limit {opt.max_rss_mb} MB")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
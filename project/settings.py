@@ -56,6 +56,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # first, so that the request latency covers the other middlewares as well
+    'store.middleware.MetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -222,4 +224,130 @@ add the configuration for the Celery broker URL, configures the message broker t
 redis://: This is the scheme of the URL, and it indicates the protocol to be used. Here, 
 redis specifies that the Redis protocol should be used for communication with the message broker.
 """
-CELERY_BROKER_URL = "redis://localhost:6379/1"
\ No newline at end of file
+CELERY_BROKER_URL = "redis://localhost:6379/1"
+# the stage pipeline finalizes the project status in a chord callback, chords need a result backend
+CELERY_RESULT_BACKEND = "redis://localhost:6379/1"
+
+# the tasks of the stage pipeline (AI_EXECUTION_MODE "pipeline") have a queue per stage, so that the worker pools can
+# be sized per stage, e.g. celery -A project worker -Q detection -c 1 / -Q recognition -c 2 / -Q interpretation,persistence
+CELERY_TASK_ROUTES = {
+    "store.tasks.detect_text": {"queue": "detection"},
+    "store.tasks.recognize_text": {"queue": "recognition"},
+    "store.tasks.interpret_text": {"queue": "interpretation"},
+    "store.tasks.persist_results": {"queue": "persistence"},
+    "store.tasks.update_project_status": {"queue": "persistence"},
+}
+
+# shared cache of the web and the celery worker processes (e.g. the hit/miss counters of the ai result cache)
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": "redis://localhost:6379/2",
+    }
+}
+
+"""
+AI_EXECUTION_MODE: "project": the images of a project are processed in process_project tasks of AI_PROJECT_CHUNK_SIZE
+                   images each (shared detector and recognizer batches, one transaction for the result sets),
+                   "image": one process_image task per image,
+                   "pipeline": one chain of stage tasks per image, on the queues of CELERY_TASK_ROUTES
+AI_PROJECT_MAX_BATCHED_IMAGES: larger projects fall back to one task per image, spread over all workers
+"""
+AI_EXECUTION_MODE = "project"
+AI_PROJECT_CHUNK_SIZE = 8
+AI_PROJECT_MAX_BATCHED_IMAGES = 500
+# a run of a project which is not finished after this many seconds does no longer block a new start of the project
+AI_RUN_TIMEOUT = 6 * 60 * 60
+
+"""
+progress of the running projects (/store/projects/{id}/progress/stream/, server-sent events):
+AI_PROGRESS_STREAM_INTERVAL: seconds between two progress events
+AI_PROGRESS_STREAM_TIMEOUT: the stream is closed after this many seconds (it holds a worker thread of the web
+                            server), the client reconnects after AI_PROGRESS_STREAM_INTERVAL
+"""
+AI_PROGRESS_STREAM_INTERVAL = 2
+AI_PROGRESS_STREAM_TIMEOUT = 6
+
+"""
+metrics settings (prometheus text format, see store/utility/metrics.py):
+METRICS_WORKER_PORT: every celery worker process serves its metrics on the first free port from this one on
+                     (port, port + 1, ... for the processes of the prefork pool), None = off
+METRICS_WORKER_ADDRESS: interface of these listeners (no authentication), the loopback interface by default
+METRICS_ALLOWED_IPS: addresses (REMOTE_ADDR as seen by django) which may scrape /metrics without a login, e.g. the
+                     prometheus server; everyone else needs a staff account
+METRICS_CELERY_QUEUES: queues whose depth is read from the broker on every scrape of /metrics
+"""
+METRICS_WORKER_PORT = 9808
+METRICS_WORKER_ADDRESS = "127.0.0.1"
+METRICS_ALLOWED_IPS = []
+METRICS_CELERY_QUEUES = ["celery", "detection", "recognition", "interpretation", "persistence"]
+
+"""
+ai settings:
+AI_WARM_UP_MODELS: load the detectors and the recognizer once per celery worker process (on worker init),
+so that every task reuses the resident models instead of loading them again
+"""
+AI_WARM_UP_MODELS = True
+
+# the sqlite files of the node-local caches (tile cache, snippet memo, stage checkpoints), outside of the source tree:
+# $AI_CACHE_DIR, by default the cache dir of the user ($XDG_CACHE_HOME or ~/.cache)
+AI_CACHE_DIR = Path(
+    os.environ.get("AI_CACHE_DIR") or Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache") / "ba_server"
+)
+
+# parameters of the ai pipeline, written into the cfg.yaml of every image
+# batch_size: number of 640x640 tiles stacked into one yolov7 forward pass
+# debug_tiles: write the raw and the processed tiles to text_detection/cache (slow, only for debugging)
+# debug_outputs: the stages still write their results.json / floor.json and copies of the original image
+# blank_tile_*: tiles with less than min_ink_ratio pixels darker than ink_threshold are skipped (0 disables it)
+# tile_overlap: pixels shared by neighbouring tiles (0 = no overlap), text crossing a seam is complete in one tile
+# merge_*: global merge of the tile detections per image (only with tile_overlap, only the boxes reaching into a band
+#          shared by two tiles), nms iou and the share of a box that has to lie inside a higher scored box of the
+#          same class to be fused into it
+# tile_cache_*: sqlite file (shared by the workers of a node) with the detections per tile and its size bound, the
+#               least recently used tiles are evicted (no path = no tile cache)
+# recognition_*: text snippets per parseq forward pass, sorted by aspect ratio (similar text lengths per batch)
+# snippet_memo_*: recognized texts of known snippets (same normalized crop), lru size per worker process (0 = off)
+#                 and the optional sqlite file shared by the workers of a node
+# checkpoint_*: sqlite file (shared by the workers of a node) with the result of every stage per drawing and its size
+#               bound, a re-run only runs the stages whose inputs or settings changed (no path = no checkpoints)
+# inference_server: address (unix socket path or host:port) of the inference server of the node, which serves the
+#                   detector and the recognizer to all workers in shared batches (python -m src.inference_server),
+#                   it must be started with the --weights of the ai models, None = every worker process runs its
+#                   own models
+AI_INFERENCE = {
+    "batch_size": 8,
+    "debug_tiles": False,
+    "debug_outputs": False,
+    "blank_tile_ink_threshold": 200,
+    "blank_tile_min_ink_ratio": 0.0001,
+    "tile_overlap": 64,
+    "merge_iou_thres": 0.45,
+    "merge_fuse_thres": 0.7,
+    "tile_cache_path": str(AI_CACHE_DIR / "tile_detections.sqlite3"),
+    "tile_cache_max_bytes": 256 * 1024 ** 2,
+    "recognition_batch_size": 32,
+    "recognition_bucket_by_aspect_ratio": True,
+    "snippet_memo_max_entries": 20000,
+    "snippet_memo_path": str(AI_CACHE_DIR / "snippets.sqlite3"),
+    "snippet_memo_max_bytes": 64 * 1024 ** 2,
+    "checkpoint_path": str(AI_CACHE_DIR / "checkpoints.sqlite3"),
+    "checkpoint_max_bytes": 2 * 1024 ** 3,
+    "inference_server": None,
+}
+
+# named speed / accuracy trade-offs, selected per project (Project.inference_profile)
+# an InferenceProfile row of the project's ai model with the same name takes precedence
+# augment: test time augmentation (3 scales per tile), conf_thres / iou_thres are applied inside the nms
+# tile_size: tiles larger than the 640 network input are scaled down, so fewer forward passes are needed
+AI_INFERENCE_PROFILES = {
+    "fast": {"augment": False, "tile_size": 960, "conf_thres": 0.5, "iou_thres": 0.45, "batch_size": 16},
+    "balanced": {"augment": False, "tile_size": 640, "conf_thres": 0.5, "iou_thres": 0.45, "batch_size": 8},
+    "accurate": {"augment": True, "tile_size": 640, "conf_thres": 0.5, "iou_thres": 0.45, "batch_size": 8},
+}
+AI_DEFAULT_INFERENCE_PROFILE = "accurate"
+
+# room stamp rules per customer: customer id -> yaml file with a list of rules (see DEFAULT_RULES in
+# src/room_stamp_parser.py), customers without an entry get the default rules
+# the path is part of the result cache key, rename the file (or bump RESULT_CACHE_VERSION) if its rules change
+AI_ROOM_STAMP_RULES = {}
@@ -3,6 +3,8 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 
+from store.views import MetricsView
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     # for "djoser", using for token
@@ -11,6 +13,9 @@ urlpatterns = [
 
     # for store app
     path('store/', include('store.urls')),
+
+    # prometheus scrape endpoint of the web process (admins and settings.METRICS_ALLOWED_IPS)
+    path('metrics', MetricsView.as_view(), name='metrics'),
 ]
 
 # only for developing process
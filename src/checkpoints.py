@@ -0,0 +1,194 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import cv2
+
+from .disk_cache import open_cache
+from .pipeline_state import PipelineState, image_paths
+
+
+STAGES = ("text_detection", "text_recognition", "text_interpretation")
+
+# bump the version of a stage, if a change of its code changes its results, the checkpoints of the stage and of all
+# later stages are invalidated with it (the weights of the detector and of the recognizer are part of the keys)
+STAGE_VERSIONS = {
+    "text_detection": 2,
+    "text_recognition": 1,
+    "text_interpretation": 1,
+}
+
+# the inference settings which change the results of a stage
+STAGE_SETTINGS = {
+    "text_detection": (
+        "tile_size", "conf_thres", "iou_thres", "augment", "tile_overlap",
+        "blank_tile_ink_threshold", "blank_tile_min_ink_ratio", "merge_iou_thres", "merge_fuse_thres",
+    ),
+    # the memo hands out the texts recognized for earlier snippets (see snippet_memo.py), like the result cache key
+    "text_recognition": ("snippet_memo_max_entries",),
+    "text_interpretation": ("room_stamp_rules",),
+}
+
+# the result of these stages is the data handed over to the next stage, the interpreter works on a copy
+DATA_STAGES = ("text_detection", "text_recognition")
+
+
+def file_digest(path):
+    """
+    :rtype: str
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 ** 2), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def weights_identity(path):
+    # like Detector.settings_key: path, size and modification time, the weights are too large to hash on every run
+    try:
+        stat = os.stat(path)
+        return f"{path}:{stat.st_size}:{stat.st_mtime_ns}"
+    except OSError:
+        return str(path)
+
+
+def recognizer_identity():
+    # imported here, the keys of the other stages need no torch
+    from .model_registry import recognizer_identity
+
+    return recognizer_identity()
+
+
+def stage_keys(config, filename):
+    """
+    Checkpoint key of every stage for a drawing: a hash of the key of the previous stage (the content of the drawing
+    for the detection), the version and the settings of the stage. A changed setting invalidates its stage and all
+    later stages, the earlier stages keep their checkpoints.
+
+    :rtype: dict
+    """
+    inference = config.get("inference", {})
+    previous = file_digest(filename)
+    keys = {}
+    for stage in STAGES:
+        params = {
+            "previous": previous,
+            "version": STAGE_VERSIONS[stage],
+            "settings": {name: inference.get(name) for name in STAGE_SETTINGS[stage]},
+        }
+        if stage == "text_detection":
+            params["weights"] = weights_identity(config["input"]["model"])
+        if stage == "text_recognition":
+            params["recognizer"] = recognizer_identity()
+        if stage == "text_interpretation" and inference.get("room_stamp_rules"):
+            # the rules file can change under the same name
+            params["room_stamp_rules"] = file_digest(inference["room_stamp_rules"])
+        keys[stage] = hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+        previous = keys[stage]
+    return keys
+
+
+class StageCheckpoints:
+    """
+    The result and the visual result of every stage per drawing, stored in a sqlite file shared by the workers of a
+    node (see disk_cache.py, the least recently used checkpoints are evicted). A stage only runs for the drawings
+    without a checkpoint, the others are restored: their visual result is written again and their result is handed
+    over to the next stage. A changed setting of the interpretation only runs the interpretation, a changed
+    recognizer only the recognition and the interpretation, the models of the skipped stages are not even loaded.
+
+    Without a checkpoint file (no "checkpoint_path" in the inference settings) every stage runs for all drawings.
+    """
+
+    def __init__(self, config, filenames, cache=None):
+        self.config = config
+        self.cache = cache
+        self.paths = {Path(filename).name: str(filename) for filename in filenames}
+        self.keys = {name: stage_keys(config, path) for name, path in self.paths.items()} if cache is not None else {}
+
+    @classmethod
+    def open(cls, config, filenames):
+        """
+        :rtype: StageCheckpoints
+        """
+        inference = config.get("inference", {})
+        path = inference.get("checkpoint_path")
+        cache = open_cache(path, inference.get("checkpoint_max_bytes", 2 * 1024 ** 3)) if path else None
+        return cls(config, filenames, cache)
+
+    def visual_path(self, stage, name):
+        return Path(image_paths(self.config, name)[stage]["final_visual_path"], name)
+
+    def image(self, state, name):
+        # the drawings are only decoded for the stages which run
+        if name not in state.images:
+            state.images[name] = cv2.imread(self.paths[name])
+        return state.images[name]
+
+    def run(self, stage, state, run_stage):
+        """
+        Runs the stage for the drawings of the state without a checkpoint (run_stage(sub_state, filenames) on a state
+        with only these drawings) and restores the others. state.data is the input of the stage, afterwards the
+        results of the stage are in state.results, restored results are marked with meta.checkpoint.
+
+        :return: the names of the restored drawings
+        :rtype: list
+        """
+        lookup_timer = state.timer(f"{stage}.checkpoint").start()
+        found = {}
+        restored = []
+        if self.cache is not None:
+            found = self.cache.get_many(
+                [self.keys[name][stage] + suffix for name in self.paths for suffix in (":result", ":visual")]
+            )
+            restored = [
+                name for name in self.paths
+                if self.keys[name][stage] + ":result" in found and self.keys[name][stage] + ":visual" in found
+            ]
+        todo = [name for name in self.paths if name not in restored]
+        lookup_timer.stop()
+
+        results = {}
+        data = {}
+        if todo:
+            sub_state = PipelineState(debug=state.debug)
+            sub_state.timings = state.timings
+            if stage != "text_detection":
+                # the localizer decodes the drawings itself
+                with state.timer(f"{stage}.decode"):
+                    sub_state.images = {name: self.image(state, name) for name in todo}
+            sub_state.data = {name: state.data[name] for name in todo if name in state.data}
+
+            run_stage(sub_state, [self.paths[name] for name in todo])
+
+            state.images.update(sub_state.images)
+            results.update(sub_state.results[stage])
+            data.update(sub_state.data)
+
+            if self.cache is not None:
+                with state.timer(f"{stage}.checkpoint"):
+                    items = {}
+                    for name in todo:
+                        visual_path = self.visual_path(stage, name)
+                        if name not in results or not visual_path.is_file():
+                            continue
+                        items[self.keys[name][stage] + ":result"] = json.dumps(results[name]).encode()
+                        items[self.keys[name][stage] + ":visual"] = visual_path.read_bytes()
+                    self.cache.set_many(items)
+
+        with state.timer(f"{stage}.checkpoint"):
+            for name in restored:
+                key = self.keys[name][stage]
+                visual_path = self.visual_path(stage, name)
+                os.makedirs(visual_path.parent, exist_ok=True)
+                visual_path.write_bytes(found[key + ":visual"])
+
+                results[name] = json.loads(found[key + ":result"])
+                if isinstance(results[name], dict):
+                    results[name].setdefault("meta", {})["checkpoint"] = True
+                data[name] = json.loads(found[key + ":result"]) if stage in DATA_STAGES else state.data[name]
+
+        state.results[stage] = {name: results[name] for name in self.paths}
+        state.data = {name: data[name] for name in self.paths}
+        return restored
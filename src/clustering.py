@@ -0,0 +1,117 @@
+import numpy as np
+
+
+# the 3x3 neighbourhood of a grid cell, only the "forward" half, so that every pair of cells is visited once
+FORWARD_CELL_OFFSETS = [(0, 0), (0, 1), (1, -1), (1, 0), (1, 1)]
+
+
+def neighbour_pairs(points, eps):
+    """
+    All pairs (i < j) of points with a euclidean distance <= eps. The points are put into a grid of cells of size
+    eps, so that only the points of neighbouring cells have to be compared.
+
+    :param points: (N, 2) array
+    :return: two arrays with the indices i and j of the pairs
+    :rtype: tuple
+    """
+    # with eps 0 only identical points are pairs, they share any cell
+    cells = np.floor(points / (eps if eps > 0 else 1.0)).astype(np.int64)
+    # one key per cell, sorted, the points of a cell are consecutive in order
+    cells -= cells.min(axis=0)
+    width = int(cells[:, 1].max()) + 3
+    keys = cells[:, 0] * width + cells[:, 1] + 1
+    order = np.argsort(keys, kind="stable")
+    unique_keys, starts, counts = np.unique(keys[order], return_index=True, return_counts=True)
+
+    pairs_i = []
+    pairs_j = []
+    for dy, dx in FORWARD_CELL_OFFSETS:
+        # the neighbouring cell of every cell (if it has points)
+        neighbour_keys = unique_keys + dy * width + dx
+        neighbours = np.searchsorted(unique_keys, neighbour_keys)
+        neighbours = np.minimum(neighbours, len(unique_keys) - 1)
+        found = unique_keys[neighbours] == neighbour_keys
+        cells_a = np.nonzero(found)[0]
+        cells_b = neighbours[found]
+
+        # all combinations of the points of the two cells
+        sizes = counts[cells_a] * counts[cells_b]
+        if not sizes.sum():
+            continue
+        pair_cells = np.repeat(np.arange(len(cells_a)), sizes)
+        within = np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+        i = order[starts[cells_a][pair_cells] + within // counts[cells_b][pair_cells]]
+        j = order[starts[cells_b][pair_cells] + within % counts[cells_b][pair_cells]]
+
+        keep = np.sum((points[i] - points[j]) ** 2, axis=1) <= eps ** 2
+        if dy == 0 and dx == 0:
+            keep &= i < j
+        pairs_i.append(i[keep])
+        pairs_j.append(j[keep])
+
+    return np.concatenate(pairs_i), np.concatenate(pairs_j)
+
+
+def connected_components(num_points, pairs_i, pairs_j):
+    """
+    Union-find over the pairs (hooking every root to the smallest connected root, then pointer jumping), vectorized.
+
+    :return: label of every point, the smallest index of its component
+    :rtype: np.ndarray
+    """
+    labels = np.arange(num_points)
+    while True:
+        roots_i = labels[pairs_i]
+        roots_j = labels[pairs_j]
+        smaller = np.minimum(roots_i, roots_j)
+        hooked = labels.copy()
+        np.minimum.at(hooked, roots_i, smaller)
+        np.minimum.at(hooked, roots_j, smaller)
+        # pointer jumping until every point points to its root
+        while True:
+            jumped = hooked[hooked]
+            if np.array_equal(jumped, hooked):
+                break
+            hooked = jumped
+        if np.array_equal(hooked, labels):
+            return labels
+        labels = hooked
+
+
+def grid_cluster(points, eps):
+    """
+    Clusters the points like DBSCAN(eps=eps, min_samples=2): points are connected if their distance is <= eps, every
+    connected group of at least 2 points is a cluster, single points are noise.
+
+    :param points: (N, 2) array
+    :return: the label of every point, -1 for noise, the clusters are numbered in the order of their first point
+    :rtype: np.ndarray
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if not len(points):
+        return np.zeros(0, dtype=np.int64)
+
+    pairs_i, pairs_j = neighbour_pairs(points, eps)
+    roots = connected_components(len(points), pairs_i, pairs_j)
+
+    # points without a neighbour are noise
+    clustered = np.zeros(len(points), dtype=bool)
+    clustered[pairs_i] = True
+    clustered[pairs_j] = True
+
+    # the roots are the first points of the clusters, so numbering the roots in order numbers the clusters in order
+    labels = np.full(len(points), -1, dtype=np.int64)
+    _, labels[clustered] = np.unique(roots[clustered], return_inverse=True)
+    return labels
+
+
+def clusters_from_labels(labels):
+    """
+    :return: the indices (ascending) of the points of every cluster, in the order of the labels, without noise
+    :rtype: list
+    """
+    labels = np.asarray(labels)
+    indices = np.nonzero(labels >= 0)[0]
+    indices = indices[np.argsort(labels[indices], kind="stable")]
+    boundaries = np.nonzero(np.diff(labels[indices]))[0] + 1
+    return np.split(indices, boundaries) if len(indices) else []
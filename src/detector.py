@@ -0,0 +1,186 @@
+import hashlib
+import os
+import sys
+
+import numpy as np
+import torch
+import torchvision
+
+from .model_registry import YOLOV7_PATH, registry
+from .stage_timer import StageTimer
+
+# yolov7 uses absolute imports ("from utils.general import ..."), so its root has to be importable
+if YOLOV7_PATH not in sys.path:
+    sys.path.insert(0, YOLOV7_PATH)
+
+from utils.datasets import letterbox  # noqa: E402
+from utils.general import check_img_size, non_max_suppression, scale_coords  # noqa: E402
+
+
+def box_ioa(box1, box2):
+    """
+    Like utils.general.box_iou, but the intersection is divided by the area of the smaller box (intersection over
+    area). Close to 1 if one box lies (almost) completely inside the other one, e.g. the half of a word which was cut
+    at a tile seam inside the box of the complete word.
+
+    :return: (N, M) tensor
+    """
+    def box_area(box):
+        return (box[2] - box[0]).clamp(0) * (box[3] - box[1]).clamp(0)
+
+    area1 = box_area(box1.T)
+    area2 = box_area(box2.T)
+
+    inter = (torch.min(box1[:, None, 2:], box2[:, 2:]) - torch.max(box1[:, None, :2], box2[:, :2])).clamp(0).prod(2)
+    return inter / torch.min(area1[:, None], area2[None, :]).clamp(min=1e-6)
+
+
+def touches_bands(detections, bands):
+    """
+    :param bands: x bands and y bands (see tiling.overlap_bands)
+    :return: (n,) bool numpy array, True for the detections which reach into one of the bands
+    """
+    x_bands, y_bands = (np.asarray(axis_bands, dtype=np.float32).reshape(-1, 2) for axis_bands in bands)
+    in_x = (detections[:, None, 0] <= x_bands[None, :, 1]) & (detections[:, None, 2] >= x_bands[None, :, 0])
+    in_y = (detections[:, None, 1] <= y_bands[None, :, 1]) & (detections[:, None, 3] >= y_bands[None, :, 0])
+    return in_x.any(1) | in_y.any(1)
+
+
+def merge_detections(detections, iou_thres=0.45, fuse_thres=0.7, bands=None):
+    """
+    Global, class-aware de-duplication of the detections of all (overlapping) tiles of one image.
+
+    1. NMS over all boxes of the image, like non_max_suppression (torchvision nms, classes separated by an offset)
+    2. box fusion: a kept box lying mostly inside a higher scored box of the same class (ioa > fuse_thres) is fused
+       into it, the fused box is the union of both boxes, its confidence the one of the higher scored box
+
+    :param detections: (n, 6) numpy array [x1, y1, x2, y2, confidence, class_id] in global (image) coordinates
+    :param bands: the bands shared by neighbouring tiles (see tiling.overlap_bands), only the detections reaching
+                  into a band are merged, the others (e.g. a label inside a stamp box within a tile) are kept as they
+                  are; None merges all detections
+    :return: (m, 6) numpy array sorted by confidence
+    """
+    if bands is not None:
+        at_band = touches_bands(detections, bands)
+        merged = np.concatenate([
+            merge_detections(detections[at_band], iou_thres, fuse_thres),
+            np.asarray(detections[~at_band], dtype=np.float32),
+        ])
+        return merged[np.argsort(-merged[:, 4], kind="stable")]
+
+    if len(detections) < 2:
+        return detections
+
+    x = torch.from_numpy(np.ascontiguousarray(detections, dtype=np.float32))
+
+    # 1. class-aware nms, the offset is larger than any coordinate of the image
+    offset = x[:, 5:6] * (x[:, :4].max() + 1)
+    keep = torchvision.ops.nms(x[:, :4] + offset, x[:, 4], iou_thres)  # sorted by decreasing confidence
+    x = x[keep]
+
+    if not fuse_thres or len(x) < 2:
+        return x.numpy()
+
+    # 2. box fusion: box j can only be absorbed by a box i with a higher score (i < j)
+    n = len(x)
+    absorb = (box_ioa(x[:, :4], x[:, :4]) > fuse_thres) & (x[:, None, 5] == x[None, :, 5])
+    absorb &= torch.ones((n, n), dtype=torch.bool).triu(1)
+    parent = torch.where(absorb.any(0), absorb.int().argmax(0), torch.arange(n))
+
+    # follow chains of absorbed boxes up to their root
+    while True:
+        root = parent[parent]
+        if torch.equal(root, parent):
+            break
+        parent = root
+
+    roots, group = torch.unique(parent, return_inverse=True)
+    fused = x[roots].clone()
+    for col, reduce in ((0, 'amin'), (1, 'amin'), (2, 'amax'), (3, 'amax')):
+        fused[:, col] = fused[:, col].scatter_reduce(0, group, x[:, col], reduce=reduce, include_self=True)
+    return fused.numpy()
+
+
+class Detector:
+    """
+    In-process YOLOv7 text detector.
+
+    Replaces the detect.py subprocess: the model is taken from the model registry (loaded once per process),
+    the tiles are passed in as numpy arrays (BGR, as returned by cv2, views are fine) and the detections are returned
+    directly. Tiles may be smaller than img_size (image edges).
+
+    Every detection array has the shape (n, 6) with the columns [x1, y1, x2, y2, confidence, class_id],
+    the coordinates are absolute pixels of the passed tile.
+
+    The tiles are stacked into batches of batch_size and every batch runs through a single forward pass and a single
+    non_max_suppression call. The tiles of a batch may come from different drawings.
+    """
+
+    def __init__(self, weights, model=None, img_size=640, conf_thres=0.25, iou_thres=0.45, augment=True,
+                 batch_size=1):
+        self.weights = weights
+        self.model = model if model is not None else registry.get_detector(weights)
+        self.device = next(self.model.parameters()).device
+
+        self.stride = int(self.model.stride.max())
+        self.img_size = check_img_size(img_size, s=self.stride)
+        self.names = self.model.module.names if hasattr(self.model, 'module') else self.model.names
+
+        self.conf_thres = conf_thres
+        self.iou_thres = iou_thres
+        self.augment = augment
+        self.batch_size = max(1, int(batch_size))
+
+    def settings_key(self):
+        """
+        Identifies the weights and every setting which changes the detections of a tile (for caching).
+
+        :rtype: str
+        """
+        try:
+            stat = os.stat(self.weights)
+            weights = f"{self.weights}:{stat.st_size}:{stat.st_mtime_ns}"
+        except OSError:
+            weights = str(self.weights)
+        key = f"{weights}|{self.img_size}|{self.conf_thres}|{self.iou_thres}|{self.augment}"
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    def preprocess(self, tile):
+        # padded resize to a fixed img_size x img_size (auto=False, so that tiles can be stacked), BGR to RGB, HWC to CHW
+        # smaller (edge) tiles are only padded, not scaled up, like the padded tiles of the tiler before
+        img, ratio, pad = letterbox(tile, self.img_size, auto=False, scaleup=False, stride=self.stride)
+        img = img[:, :, ::-1].transpose(2, 0, 1)
+        return np.ascontiguousarray(img), (ratio, pad)
+
+    @torch.no_grad()
+    def detect(self, tiles, batch_size=None, timings=None):
+        """
+        :param timings: dict for the time spent in preprocessing, forward passes and nms (see stage_timer.py)
+        :return: detections (x1, y1, x2, y2, conf, cls) per tile
+        :rtype: list
+        """
+        batch_size = self.batch_size if batch_size is None else max(1, int(batch_size))
+        timings = {} if timings is None else timings
+
+        results = []
+        for start in range(0, len(tiles), batch_size):
+            batch_tiles = tiles[start:start + batch_size]
+
+            with StageTimer(timings, "text_detection.preprocess"):
+                preprocessed = [self.preprocess(tile) for tile in batch_tiles]
+                img = torch.from_numpy(np.stack([item[0] for item in preprocessed])).to(self.device).float()
+                img /= 255.0  # 0 - 255 to 0.0 - 1.0
+
+            # one forward pass and one nms call per batch
+            # (on a gpu the forward pass runs asynchronously, the nms waits for it and includes part of its time)
+            with StageTimer(timings, "text_detection.forward"):
+                pred = self.model(img, augment=self.augment)[0]
+            with StageTimer(timings, "text_detection.nms"):
+                dets = non_max_suppression(pred, self.conf_thres, self.iou_thres)
+
+                # scatter back and rescale boxes from img_size to tile size
+                for tile, (_, ratio_pad), det in zip(batch_tiles, preprocessed, dets):
+                    if len(det):
+                        det[:, :4] = scale_coords(img.shape[2:], det[:, :4], tile.shape, ratio_pad=ratio_pad).round()
+                    results.append(det.cpu().numpy())
+        return results
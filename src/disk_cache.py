@@ -0,0 +1,119 @@
+import os
+import sqlite3
+import threading
+import time
+
+
+class DiskCache:
+    """
+    Small key-value cache (str -> bytes) in a sqlite file on local disk.
+
+    All worker processes of a node which open the same file share the cache (sqlite in WAL mode, one connection per
+    process and thread). The cache is bounded by max_bytes, when it grows beyond the bound the least recently used
+    entries are evicted (down to 90% of the bound).
+    """
+
+    def __init__(self, path, max_bytes=512 * 1024 ** 2, timeout=30.0):
+        self.path = str(path)
+        self.max_bytes = int(max_bytes)
+        self.timeout = timeout
+        self._local = threading.local()
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _connection(self):
+        # sqlite connections must not be shared between threads, nor survive a fork
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS entries "
+                "(key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, accessed REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def get_many(self, keys):
+        """
+        :return: dict of the found keys and their values
+        :rtype: dict
+        """
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        connection = self._connection()
+        # sqlite limits the number of variables of a statement
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = connection.execute(
+                f"SELECT key, value FROM entries WHERE key IN ({placeholders})", chunk
+            ).fetchall()
+            found.update(rows)
+            if rows:
+                hit_keys = [key for key, _ in rows]
+                connection.execute(
+                    f"UPDATE entries SET accessed = ? WHERE key IN ({','.join('?' * len(hit_keys))})",
+                    [time.time()] + hit_keys
+                )
+        return found
+
+    def get(self, key, default=None):
+        return self.get_many([key]).get(key, default)
+
+    def set_many(self, items):
+        if not items:
+            return
+        now = time.time()
+        connection = self._connection()
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.executemany(
+                "INSERT OR REPLACE INTO entries (key, value, size, accessed) VALUES (?, ?, ?, ?)",
+                [(key, sqlite3.Binary(value), len(value), now) for key, value in items.items()]
+            )
+            self._evict(connection)
+
+    def set(self, key, value):
+        self.set_many({key: value})
+
+    def _evict(self, connection):
+        total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        # least recently used first, down to 90% of the bound
+        target = self.max_bytes * 0.9
+        evict = []
+        for key, size in connection.execute("SELECT key, size FROM entries ORDER BY accessed"):
+            if total <= target:
+                break
+            evict.append((key,))
+            total -= size
+        connection.executemany("DELETE FROM entries WHERE key = ?", evict)
+
+    def stats(self):
+        entries, size = self._connection().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return {"entries": entries, "bytes": size, "max_bytes": self.max_bytes}
+
+    def clear(self):
+        self._connection().execute("DELETE FROM entries")
+
+
+# one cache object per file and process
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def open_cache(path, max_bytes=512 * 1024 ** 2):
+    with _caches_lock:
+        key = str(path)
+        if key not in _caches:
+            _caches[key] = DiskCache(path, max_bytes=max_bytes)
+        _caches[key].max_bytes = int(max_bytes)
+        return _caches[key]
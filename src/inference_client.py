@@ -0,0 +1,163 @@
+import json
+import socket
+import struct
+
+import numpy as np
+
+from .stage_timer import StageTimer
+
+
+# a message is a fixed size prefix (length of the json header, length of the body), the json header and the body:
+# the raw bytes of the arrays listed in the header ({"dtype", "shape"} each), one after the other
+PREFIX = struct.Struct("!II")
+
+
+class InferenceServerError(RuntimeError):
+    pass
+
+
+def parse_address(address):
+    """
+    "host:port" is a tcp address (localhost), everything else the path of a unix socket.
+
+    :rtype: tuple
+    """
+    host, _, port = str(address).rpartition(":")
+    if host and port.isdigit() and "/" not in host:
+        return socket.AF_INET, (host, int(port))
+    return socket.AF_UNIX, str(address)
+
+
+def recv_exactly(sock, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:], size - received)
+        if not n:
+            raise ConnectionError("connection closed by the peer")
+        received += n
+    return buffer
+
+
+def send_message(sock, header, arrays=()):
+    arrays = [np.ascontiguousarray(array) for array in arrays]
+    header = dict(header, arrays=[{"dtype": array.dtype.str, "shape": list(array.shape)} for array in arrays])
+    header_bytes = json.dumps(header).encode()
+    body_size = sum(array.nbytes for array in arrays)
+    sock.sendall(PREFIX.pack(len(header_bytes), body_size) + header_bytes)
+    for array in arrays:
+        if array.nbytes:
+            sock.sendall(memoryview(array).cast("B"))
+
+
+def recv_message(sock):
+    """
+    :return: the header and the arrays of the message, None at the end of the connection
+    :rtype: tuple
+    """
+    try:
+        prefix = recv_exactly(sock, PREFIX.size)
+    except ConnectionError:
+        return None
+    header_size, body_size = PREFIX.unpack(prefix)
+    header = json.loads(recv_exactly(sock, header_size).decode())
+    body = recv_exactly(sock, body_size)
+
+    arrays = []
+    offset = 0
+    for spec in header.pop("arrays", []):
+        dtype = np.dtype(spec["dtype"])
+        count = int(np.prod(spec["shape"], dtype=np.int64))
+        arrays.append(np.frombuffer(body, dtype=dtype, count=count, offset=offset).reshape(spec["shape"]))
+        offset += count * dtype.itemsize
+    return header, arrays
+
+
+class InferenceClient:
+    """
+    Client of the inference server of the node (see inference_server.py): the tiles and snippets of a task are sent
+    to the server, which runs them through its resident models in batches shared with the requests of the other
+    workers. One connection per request, the worker processes can be forked at any time.
+    """
+
+    def __init__(self, address, timeout=600.0):
+        self.address = address
+        self.timeout = timeout
+
+    def request(self, header, arrays=()):
+        family, address = parse_address(self.address)
+        with socket.socket(family, socket.SOCK_STREAM) as sock:
+            sock.settimeout(self.timeout)
+            sock.connect(address)
+            send_message(sock, header, arrays)
+            response = recv_message(sock)
+        if response is None:
+            raise InferenceServerError(f"no response of the inference server {self.address}")
+        if "error" in response[0]:
+            raise InferenceServerError(response[0]["error"])
+        return response
+
+    def detector_info(self, detector):
+        """
+        :param detector: the settings of the detector (weights, img_size, conf_thres, iou_thres, augment)
+        :return: names and settings_key of the detector
+        :rtype: dict
+        """
+        header, _ = self.request({"op": "detector_info", "detector": detector})
+        return header
+
+    def detect(self, tiles, detector):
+        """
+        :return: detections (x1, y1, x2, y2, conf, cls) per tile, like Detector.detect
+        :rtype: list
+        """
+        if not len(tiles):
+            return []
+        _, detections = self.request({"op": "detect", "detector": detector}, tiles)
+        return detections
+
+    def recognizer_info(self):
+        """
+        :return: img_size, decode_ar and refine_iters of the recognizer
+        :rtype: dict
+        """
+        header, _ = self.request({"op": "recognizer_info"})
+        return header
+
+    def recognize(self, snippets):
+        """
+        :return: list of (text, confidence) in the order of the snippets, like Recognizer.recognize
+        :rtype: list
+        """
+        if not len(snippets):
+            return []
+        header, _ = self.request({"op": "recognize"}, snippets)
+        return [(text, confidence) for text, confidence in header["results"]]
+
+
+class RemoteDetector:
+    """
+    Stands in for the Detector of the localizer, the tiles are detected by the inference server. The batch size is
+    the one of the server (its batches are shared by all workers), the batch_size argument is ignored.
+    """
+
+    def __init__(self, client, weights, img_size=640, conf_thres=0.25, iou_thres=0.45, augment=True):
+        self.client = client
+        self.settings = {
+            "weights": str(weights),
+            "img_size": img_size,
+            "conf_thres": conf_thres,
+            "iou_thres": iou_thres,
+            "augment": augment,
+        }
+        info = client.detector_info(self.settings)
+        self.names = info["names"]
+        self._settings_key = info["settings_key"]
+
+    def settings_key(self):
+        return self._settings_key
+
+    def detect(self, tiles, batch_size=None, timings=None):
+        with StageTimer({} if timings is None else timings, "text_detection.server"):
+            return self.client.detect(tiles, self.settings)
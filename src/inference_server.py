@@ -0,0 +1,238 @@
+"""
+Inference server of a node: loads the detectors and the recognizer once and serves the tiles and snippets of all
+celery worker processes of the node, over a unix socket or a localhost port. The requests of the workers arriving at
+the same time are collected into shared batches (dynamic batching): a batch runs as soon as it is full or the oldest
+of its items has waited max_latency seconds. Runs offline on the cpu, like the workers.
+
+    python -m src.inference_server --address /tmp/inference.sock --weights store/ai/model_weights/weights/best.pt
+
+The pipeline uses it if the "inference_server" setting of the inference settings is its address. Only the detector
+weights given with --weights are served, the requests of other weights are rejected.
+"""
+import argparse
+import logging
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+
+import numpy as np
+
+from .inference_client import parse_address, recv_message, send_message
+
+
+class DynamicBatcher:
+    """
+    Runs run_batch(items) on batches of the items submitted by several threads: a batch takes up to max_batch_size
+    items (from one or several requests, in the order of their arrival) and waits at most max_latency seconds for
+    further items after its first one. submit blocks until all items of the request are done.
+    """
+
+    def __init__(self, run_batch, max_batch_size=16, max_latency=0.01):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_latency = max_latency
+        self.queue = queue.Queue()
+        self.batches = 0
+        self.items = 0
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def submit(self, items):
+        """
+        :return: the results of run_batch for the items, in their order
+        :rtype: list
+        """
+        if not items:
+            return []
+        request = {"results": [None] * len(items), "remaining": len(items), "error": None, "done": threading.Event()}
+        for i, item in enumerate(items):
+            self.queue.put((request, i, item))
+        request["done"].wait()
+        if request["error"] is not None:
+            raise request["error"]
+        return request["results"]
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def _collect(self, first):
+        # the items already waiting are taken at once, the window only applies while the queue is empty
+        batch = [first]
+        deadline = time.monotonic() + self.max_latency
+        while len(batch) < self.max_batch_size:
+            try:
+                entry = self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if entry is None:
+                self.queue.put(None)
+                break
+            batch.append(entry)
+        return batch
+
+    def _loop(self):
+        while True:
+            first = self.queue.get()
+            if first is None:
+                return
+            batch = self._collect(first)
+            try:
+                results = self.run_batch([item for _, _, item in batch])
+                error = None
+            except Exception as e:
+                logging.exception("inference batch failed")
+                results, error = [None] * len(batch), e
+            self.batches += 1
+            self.items += len(batch)
+
+            for (request, i, _), result in zip(batch, results):
+                request["results"][i] = result
+                if error is not None:
+                    request["error"] = error
+                request["remaining"] -= 1
+                if request["remaining"] == 0:
+                    request["done"].set()
+
+
+class InferenceServer:
+    """
+    The models and batchers of the server: one batcher per detector settings (weights and thresholds, the tiles of
+    different settings cannot share a forward pass) and one for the recognizer. A detector is only loaded from one of
+    the weights the server was started with.
+    """
+
+    def __init__(self, detection_batch_size=16, recognition_batch_size=64, max_latency=0.01, weights=()):
+        self.weights = {os.path.realpath(path) for path in weights}
+        self.detection_batch_size = detection_batch_size
+        self.recognition_batch_size = recognition_batch_size
+        self.max_latency = max_latency
+        self.detectors = {}
+        self.detection_batchers = {}
+        self.recognizer = None
+        self.recognition_batcher = None
+        self._lock = threading.Lock()
+
+    def check_weights(self, weights):
+        # the path comes from the request, no other file is ever loaded (torch.load runs pickles)
+        if os.path.realpath(str(weights)) not in self.weights:
+            raise ValueError(f"the weights {weights} are not served by this inference server")
+
+    def get_detector(self, settings):
+        self.check_weights(settings["weights"])
+        from .detector import Detector
+
+        key = tuple(sorted(settings.items()))
+        with self._lock:
+            if key not in self.detectors:
+                detector = Detector(settings["weights"], img_size=settings["img_size"],
+                                    conf_thres=settings["conf_thres"], iou_thres=settings["iou_thres"],
+                                    augment=settings["augment"], batch_size=self.detection_batch_size)
+                self.detectors[key] = detector
+                self.detection_batchers[key] = DynamicBatcher(
+                    detector.detect, self.detection_batch_size, self.max_latency
+                )
+            return self.detectors[key], self.detection_batchers[key]
+
+    def get_recognizer(self):
+        from .recognizer import Recognizer
+
+        with self._lock:
+            if self.recognizer is None:
+                # the recognizer only recognizes snippets here, it writes no results
+                self.recognizer = Recognizer({
+                    "paths": {"text_recognition": {"cache_path": None, "final_path": None}},
+                    "inference": {"recognition_batch_size": self.recognition_batch_size, "snippet_memo_max_entries": 0},
+                })
+                self.recognition_batcher = DynamicBatcher(
+                    self.recognizer.recognize, self.recognition_batch_size, self.max_latency
+                )
+            return self.recognizer, self.recognition_batcher
+
+    def handle(self, header, arrays):
+        """
+        :return: the header and the arrays of the response
+        :rtype: tuple
+        """
+        op = header.get("op")
+        if op == "detector_info":
+            detector, _ = self.get_detector(header["detector"])
+            return {"names": list(detector.names), "settings_key": detector.settings_key()}, []
+        if op == "detect":
+            _, batcher = self.get_detector(header["detector"])
+            return {}, [np.asarray(detections, dtype=np.float32) for detections in batcher.submit(arrays)]
+        if op == "recognizer_info":
+            recognizer, _ = self.get_recognizer()
+            hparams = recognizer.parseq.hparams
+            return {"img_size": list(hparams.img_size), "decode_ar": hparams.decode_ar,
+                    "refine_iters": hparams.refine_iters}, []
+        if op == "recognize":
+            _, batcher = self.get_recognizer()
+            return {"results": [[text, confidence] for text, confidence in batcher.submit(arrays)]}, []
+        if op == "stats":
+            batchers = dict(self.detection_batchers, recognizer=self.recognition_batcher)
+            return {"batches": {str(key): {"batches": batcher.batches, "items": batcher.items}
+                                for key, batcher in batchers.items() if batcher is not None}}, []
+        raise ValueError(f"unknown op {op}")
+
+    def serve(self, address):
+        """
+        Serves the requests until the process is stopped, every connection in a thread of its own.
+        """
+        family, address = parse_address(address)
+        server = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                while True:
+                    message = recv_message(self.request)
+                    if message is None:
+                        return
+                    try:
+                        response = server.handle(*message)
+                    except Exception as e:
+                        response = {"error": f"{type(e).__name__}: {e}"}, []
+                    send_message(self.request, *response)
+
+        if family == socket.AF_UNIX:
+            if os.path.exists(address):
+                os.remove(address)
+            socket_server = socketserver.ThreadingUnixStreamServer(address, Handler)
+        else:
+            socketserver.ThreadingTCPServer.allow_reuse_address = True
+            socket_server = socketserver.ThreadingTCPServer(address, Handler)
+        socket_server.daemon_threads = True
+        logging.info("Inference server listening on {}".format(address))
+        with socket_server:
+            socket_server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="inference server of the detectors and the recognizer of a node")
+    parser.add_argument("--address", required=True, help="path of a unix socket or host:port")
+    parser.add_argument("--weights", nargs="*", default=[], help="the detector weights served (loaded at the start)")
+    parser.add_argument("--img-size", type=int, default=640)
+    parser.add_argument("--conf-thres", type=float, default=0.5)
+    parser.add_argument("--iou-thres", type=float, default=0.45)
+    parser.add_argument("--detection-batch-size", type=int, default=16)
+    parser.add_argument("--recognition-batch-size", type=int, default=64)
+    parser.add_argument("--max-latency-ms", type=float, default=10)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    server = InferenceServer(args.detection_batch_size, args.recognition_batch_size, args.max_latency_ms / 1000,
+                             weights=args.weights)
+    # warm up: the models are loaded before the first request (the other settings are loaded on their first request)
+    for weights in args.weights:
+        for augment in (True, False):
+            server.get_detector({"weights": weights, "img_size": args.img_size, "conf_thres": args.conf_thres,
+                                 "iou_thres": args.iou_thres, "augment": augment})
+    server.get_recognizer()
+    server.serve(args.address)
+
+
+if __name__ == "__main__":
+    main()
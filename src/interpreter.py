@@ -1,9 +1,9 @@
 import os
-import re
 
 os.environ["CUDA_DEVICE_ORDER"] = "PCI_BUS_ID"   # see issue #152
 os.environ["CUDA_VISIBLE_DEVICES"] = "0"
 
+import copy
 import json
 import logging
 import os
@@ -11,12 +11,17 @@ import zipfile
 from pathlib import Path
 from zipfile import ZipFile
 
+import csv
+
+import cv2
 import numpy as np
-import pandas as pd
 
 from matplotlib import pyplot as plt
 from PIL import Image, ImageDraw
-from sklearn.cluster import DBSCAN
+
+from .clustering import clusters_from_labels, grid_cluster
+from .pipeline_state import PipelineState, image_paths
+from .room_stamp_parser import get_parser
 
 
 class Floor:
@@ -162,56 +167,44 @@ class TextFieldFinder:
 
     def get_cluster_labels(self, list_of_elements, height_factor=2, min_samples=2):
         """
-        Clusters a list of elements based on their bounding box coordinates using
-        DBSCAN algorithm.
+        Clusters a list of elements based on their bounding box coordinates, with the same result as the DBSCAN
+        algorithm (min_samples=2): elements whose upper left corners are at most epsilon apart are connected, connected
+        groups are clusters. Uses a grid of epsilon sized cells and union-find (see clustering.py) instead of sklearn.
 
         :param list_of_elements: A list of dictionary elements, each containing a
             bounding box coordinates.
         :type list_of_elements: list
 
         :param height_factor: A factor to determine the epsilon distance for
-            DBSCAN clustering. Default is 2.
+            the clustering (mean text height * height_factor). Default is 2.
         :type height_factor: int or float
 
         :param min_samples: The minimum number of samples required to form a 
-            luster. Default is 2.
+            luster. Only 2 is supported.
         :type min_samples: int
 
         :return: A tuple of the positions (upper left corner) of the elements and
             their corresponding labels.
         :rtype: tuple
         """
+        if min_samples != 2:
+            raise ValueError("the grid clustering supports min_samples=2 only")
 
-        points_list = []
-        text_heights = []
-        for element in list_of_elements:
-            x1, y1, x2, y2 = element["bbox_xyxy_abs"]
-            points_list.append((x1, y1))
-            text_heights.append(abs(y2 - y1))
+        boxes = np.array([element["bbox_xyxy_abs"] for element in list_of_elements], dtype=np.float64).reshape(-1, 4)
+        points_list = boxes[:, :2]
+        if not len(boxes):
+            return points_list, np.zeros(0, dtype=np.int64)
 
-        mean_text_height = np.mean(text_heights)
+        mean_text_height = np.mean(np.abs(boxes[:, 3] - boxes[:, 1]))
         epsilon = mean_text_height * height_factor
 
-        points_list = np.array(points_list)
-        clustering = DBSCAN(eps=epsilon, min_samples=min_samples).fit(points_list)
-        labels = clustering.labels_
-        
+        labels = grid_cluster(points_list, epsilon)
+
         return points_list, labels
 
     def get_clusters(self, cluster_labels):
-        clusters = []
-        unique_labels = set(cluster_labels)
-        
-        for label in unique_labels:
-            if label == -1:
-                # Points that were not assigned to a cluster
-                continue
-
-            else:
-                # Points that belong to the current cluster
-                cluster_ids = np.where(cluster_labels == label)
-                clusters.append(cluster_ids[0])
-        return clusters
+        # the indices of the elements of every cluster (noise dropped), all clusters in one pass
+        return clusters_from_labels(cluster_labels)
 
 
     def add_text_fields_to_data(self, clusters, image_filename):
@@ -261,55 +254,30 @@ class Interpreter:
         # dirs
         self.final_path = self.config["paths"]["text_interpretation"]["final_path"]
 
-    def to_dataframe(self, text_fields):
-        snippets = []
-        field_ids = []
-        field_positions = []
-
-        for i, text_field in enumerate(text_fields):
-
-            first_of_field = True
-
-            for snippet in text_field["text_snippets"]:
+        # the room stamp rules of the customer (compiled once per worker process), the default rules without a file
+        self.parser = get_parser(self.config.get("inference", {}).get("room_stamp_rules"))
 
-                snippets.append(snippet)
-
-                if first_of_field:
-                    field_ids.append("Raumstempel " + str(i))
-                    first_of_field = False
-
-                    field_positions.append(text_field["position"])
-
-                else:
-                    field_ids.append(None)
-                    field_positions.append(None)
-        
-        # make dataframe
-        zipped = list(zip(field_ids, snippets, field_positions))
-        df = pd.DataFrame(zipped, columns=["Raumstempel", "Wort", "Position"])
-
-        return df
-
-    def clean_detections(self, rooms, text_field_dataframe):
-
-        cleaned_rooms = []
+    def parse_rooms(self, text_fields):
+        """
+        One pass over the text fields of a drawing, every field with a name and a code is a room (positioned at the
+        field), the other fields are discarded.
 
-        for i, room in enumerate(rooms):
+        :rtype: list
+        """
+        rooms = []
+        for text_field in text_fields:
+            lines = [snippet for snippet in text_field["text_snippets"] if snippet]
+            if not lines:
+                continue
 
+            room = self.parse_room_info(lines)
             if room.name is None or room.code is None:
                 continue
 
-            # get position from original input table
-            stamp_string = "Raumstempel " + str(i)
-            idx = text_field_dataframe.index[text_field_dataframe['Raumstempel'] == stamp_string]
-            position = list(text_field_dataframe.loc[idx]['Position'])[0]
-
-            room.position_on_drawing = position
-
-            cleaned_rooms.append(room)
-        
-        return cleaned_rooms
+            room.position_on_drawing = text_field["position"]
+            rooms.append(room)
 
+        return rooms
 
     def preprocess(self, fields):
 
@@ -390,108 +358,78 @@ class Interpreter:
         return image
 
 
-    def inference(self, input_path):
-        
-        input_file = "results.json"
-        with open(str(Path(input_path, input_file))) as in_file:
-            data = json.load(in_file)
-        
-        finder = TextFieldFinder(data)
-        data = finder.find_text_fields()
+    def inference(self, input_path=None, state=None):
+        """
+        Groups the recognized text elements of the pipeline state (or of the results written to input_path by the
+        recognizer in debug mode) into room stamps. Only the visual result is written, floor.json, floor.csv and the
+        original drawing only in debug mode.
+
+        :rtype: PipelineState
+        """
+        state = state if state is not None else PipelineState.load(input_path)
+
+        # the text field finder modifies the elements, the recognition results in the state stay untouched
+        data = copy.deepcopy(state.data)
+
+        with state.timer("text_interpretation.clustering"):
+            finder = TextFieldFinder(data)
+            data = finder.find_text_fields()
 
         floors = {}
         for image in data:
 
-            # save original file
+            # the decoded drawing of the state, BGR to RGB for PIL
             print(image)
-            original = Image.open(str(Path(input_path, "original", image)))
-            original.save(str(Path(self.final_path, "original", image)))
+            final_path = image_paths(self.config, image)["text_interpretation"]["final_path"]
+            original = Image.fromarray(cv2.cvtColor(state.images[image], cv2.COLOR_BGR2RGB))
+            if state.debug:
+                original.save(str(Path(final_path, "original", image)))
 
+            parse_timer = state.timer("text_interpretation.parsing").start()
             image_data = self.preprocess(data[image]["fields"])
-            text_field_dataframe = self.to_dataframe(image_data)
-
-            preds = self.parse_room_info_df(text_field_dataframe)
-            print(preds)
 
             # discard all rooms without name
-            rooms = self.clean_detections(preds, text_field_dataframe)
+            rooms = self.parse_rooms(image_data)
 
             # create floor object
             floor = Floor(rooms)
             floors[image] = floor.to_list()
+            parse_timer.stop()
 
             # save visualization file
-            visual = self.visualize(original, floors[image])
-            visual.save(str(Path(self.final_path, "visual", image)))
+            with state.timer("text_interpretation.draw_and_write"):
+                visual = self.visualize(original, floors[image])
+                visual.save(str(Path(final_path, "visual", image)))
 
-        # export floors
-        result_path = str(Path(self.final_path, "floor.json"))
-        with open(result_path, 'w') as out_file:
-            json.dump(floors, out_file, indent=4)
-        out_file.close()
-
-        with open(result_path, encoding='utf-8') as inputfile:
-            df = pd.read_json(inputfile)
-        result_path = str(Path(self.final_path, "floor.csv"))
-        df.to_csv(result_path, encoding='utf-8', index=False)
-        
-        return
+        state.finish_stage("text_interpretation", floors)
 
-    def parse_room_info_df(self, df):
-        parsed_info = []
-        current_lines = None
-        
-        for i, row in df.iterrows():
-            if row['Raumstempel']:
-                if current_lines:
-                    info = self.parse_room_info(current_lines)
-                    if info:
-                        parsed_info.append(info)
-                current_lines = []
-            if row['Wort']:
-                current_lines.append(row['Wort'])
-        
-        if current_lines:
-            info = self.parse_room_info(current_lines)
-            if info:
-                parsed_info.append(info)
-        
-        return parsed_info
+        # export floors
+        if state.debug:
+            result_path = str(Path(self.final_path, "floor.json"))
+            with open(result_path, 'w') as out_file:
+                json.dump(floors, out_file, indent=4)
+            out_file.close()
+
+            # one column per image, one row per room
+            result_path = str(Path(self.final_path, "floor.csv"))
+            with open(result_path, 'w', encoding='utf-8', newline='') as out_file:
+                writer = csv.writer(out_file)
+                writer.writerow(list(floors))
+                for i in range(max((len(rooms) for rooms in floors.values()), default=0)):
+                    writer.writerow([rooms[i] if i < len(rooms) else "" for rooms in floors.values()])
+
+        return state
 
     def parse_room_info(self, lines):
 
-        code_regex = r'^[0-9]{1,2}(\.[A-Z]?[A-Z0-9]{2,3}|\-[0-9]{1,2}(\.[A-Z]?[A-Z0-9]{2,3})?|[0-9]{1,2}[a-z])$'
-        # name_regex = r'^(?!^\d+$)\w+(\s\w+)?$'
-        name_regex = r'^(?!^\d+$)[\w\s?!:-]+$'
-        area_regex = r'^(\d+(\.\d+)?)\s?([\w\d]+)$'
-        height_regex = r'^RH\.?:\s?(\d+(\.\d+)?)\s?([a-zA-Z]+)$'
-        
-        code = None
-        name = None
-        area_value = None
-        area_unit = None
-        height_value = None
-        height_unit = None
-        
-        for line in lines:
-            line = line.strip()
-            if re.match(code_regex, line):
-                code = line
-            elif re.match(name_regex, line):
-                name = line
-            elif re.match(area_regex, line):
-                area_match = re.match(area_regex, line)
-                area_value = float(area_match.group(1))
-                area_unit = area_match.group(3)
-            elif re.match(height_regex, line):
-                height_match = re.match(height_regex, line)
-                height_value = float(height_match.group(1))
-                height_unit = height_match.group(3)
+        values = self.parser.parse_lines(lines)
+        area_value, area_unit = values.get("area", (None, None))
+        height_value, height_unit = values.get("height", (None, None))
 
         room = Room(
             nummer=None,
-            name=name,
-            code=code,
+            name=values.get("name"),
+            code=values.get("code"),
             wand_material=None,
             boden_material=None,
             decken_material=None,
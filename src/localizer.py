@@ -1,61 +1,102 @@
 import json
-import os
+import random
 from pathlib import Path
-import subprocess
 from uuid import uuid4
 import cv2
-from tiler import Merger, Tiler
+import numpy as np
 import torch
 
+from .detector import Detector, merge_detections
+from .disk_cache import open_cache
+from .inference_client import InferenceClient, RemoteDetector
+from .pipeline_state import PipelineState, image_paths
+from .tiling import is_blank_tile, overlap_bands, tile_hash, tile_views
+from utils.plots import plot_one_box  # yolov7 utils, importable once .detector is loaded
+
 
 class Localizer:
     
-    def __init__(self, config):
+    def __init__(self, config, detector=None):
         
         self.config = config
         print(config)
         self.model = self.config["input"]["model"]
-
-    def inference(self, filenames, tile_size=640):
+        inference = self.config.get("inference", {})
+        # in-process yolov7, the weights stay resident per process (see model_registry.py), or the yolov7 of the
+        # inference server of the node (see inference_server.py)
+        # the thresholds of the inference profile are applied inside the nms
+        detector_settings = dict(
+            conf_thres=inference.get("conf_thres", 0.5),
+            iou_thres=inference.get("iou_thres", 0.45),
+            augment=inference.get("augment", True)
+        )
+        if detector is None and inference.get("inference_server"):
+            detector = RemoteDetector(InferenceClient(inference["inference_server"]), self.model, **detector_settings)
+        self.detector = detector if detector is not None else Detector(self.model, **detector_settings)
+        self.tile_size = inference.get("tile_size", 640)
+        # tiles of all passed drawings are stacked into batches of this size
+        self.batch_size = inference.get("batch_size", 1)
+        # only for debugging: write the raw and the processed tiles to the cache dirs
+        self.debug_tiles = inference.get("debug_tiles", False)
+        # tiles without ink (white paper) are not sent through the detector
+        self.blank_ink_threshold = inference.get("blank_tile_ink_threshold", 200)
+        self.blank_min_ink_ratio = inference.get("blank_tile_min_ink_ratio", 0)
+        # neighbouring tiles share this many pixels, the duplicates in the shared band are merged per image
+        self.tile_overlap = inference.get("tile_overlap", 0)
+        self.merge_iou_thres = inference.get("merge_iou_thres", 0.45)
+        self.merge_fuse_thres = inference.get("merge_fuse_thres", 0.7)
+        # detections per tile (exact hash of the tile pixels, model and detection settings) in a sqlite file shared
+        # by all workers of the node, unchanged tiles of a revised drawing are not detected again
+        tile_cache_path = inference.get("tile_cache_path")
+        self.tile_cache = open_cache(
+            tile_cache_path, inference.get("tile_cache_max_bytes", 256 * 1024 ** 2)
+        ) if tile_cache_path else None
+        self.colors = [[random.randint(0, 255) for _ in range(3)] for _ in self.detector.names]
+
+    def inference(self, filenames, tile_size=None, state=None):
+        """
+        Detects the text elements of the drawings. The decoded drawings and the elements are handed over to the next
+        stage in the (in-memory) pipeline state, only the visual result is written. In debug mode results.json and a
+        copy of the original drawing are written as well.
+
+        :rtype: PipelineState
+        """
+        tile_size = tile_size or self.tile_size
+        state = state if state is not None else PipelineState()
 
         # ---------------------------- PREPROCESSING --------------------------- #
         # dirs
-        cache_path = self.config["paths"]["text_detection"]["cache_path"]
-        cache_tiled_path = self.config["paths"]["text_detection"]["cache_tiled_path"]
-        cache_processed_path = self.config["paths"]["text_detection"]["cache_processed_path"]
-        cache_processed_labels_path = self.config["paths"]["text_detection"]["cache_processed_labels_path"]
+        # (the visual results, tiles and originals go to the dirs of their image, results.json covers all images)
         final_output_path = self.config["paths"]["text_detection"]["final_path"]
-        final_output_path_visual_results = self.config["paths"]["text_detection"]["final_visual_path"]
-        final_output_path_original_images = self.config["paths"]["text_detection"]["final_original_path"]
         
-        model = self.config["input"]["model"]
-        
-        # tile images
-        tilers_dict = {}
+        # read every image once and tile it, the tiles are views into the decoded image (nothing is written to disk)
+        read_timer = state.timer("text_detection.read_and_tile").start()
+        images_dict = {}
+        tiles_dict = {}
         for filename in filenames:
             
-            # read and tile image
             img = cv2.imread(filename)
             
             filename = filename.split("/")[-1]
-
-            tiler = Tiler(data_shape=img.shape,
-                        tile_shape=(tile_size, tile_size, 3),
-                        channel_dimension=2)
-            tilers_dict[filename] = tiler  # save for merger
-
-            for tile_id, tile in tiler(img):
-                filename_tile = (Path(filename).stem
-                                + "_tile_" + str(tile_id) + ".png")
-                save_path_tile = Path(cache_tiled_path, filename_tile)
-                cv2.imwrite(str(save_path_tile), tile)
+            paths = image_paths(self.config, filename)["text_detection"]
+            images_dict[filename] = img
+            state.images[filename] = img
+            tiles_dict[filename] = tile_views(img, tile_size, self.tile_overlap)
+
+            if self.debug_tiles:
+                for tile_id, _, tile in tiles_dict[filename]:
+                    filename_tile = (Path(filename).stem
+                                    + "_tile_" + str(tile_id) + ".png")
+                    cv2.imwrite(str(Path(paths["cache_tiled_path"], filename_tile)), tile)
             
-            # save original image for later services in output dir
-            original_image_filename_img = str(Path(
-                final_output_path_original_images, 
-                filename
-            ))
-            cv2.imwrite(original_image_filename_img, img)
+            # the later stages get the decoded image from the state, the copy on disk is only for debugging
+            if state.debug:
+                original_image_filename_img = str(Path(
+                    paths["final_original_path"],
+                    filename
+                ))
+                cv2.imwrite(original_image_filename_img, img)
+        read_timer.stop()
 
         # ---------------------------- INFERENCE ------------------------------- #
         # modified by shipanliu because no navdia gpu installed on mac-mini
@@ -65,141 +106,150 @@ class Localizer:
         else:
             print("CUDA not available, using CPU")
 
-        subprocess.run(['python3', 'src/yolov7/detect.py',
-            '--weights', model,
-            '--source', str(cache_tiled_path),
-            '--project', str(cache_path),
-            '--augment',
-            '--name', 'processed',
-            '--img-size', str(tile_size),
-            '--conf-thres', '0.25',
-            '--iou-thres', '0.45',
-            '--device', '0',
-            '--save-txt',
-            '--save-conf',
-            '--augment',
-            '--exist-ok',
-            '--no-trace'
-        ])
+        # skip blank tiles, they get no detections
+        blank_timer = state.timer("text_detection.blank_tiles").start()
+        detections_dict = {}
+        tiles_skipped_dict = {}
+        tile_keys = []
+        for filename in tiles_dict:
+            detections_dict[filename] = [np.zeros((0, 6), dtype=np.float32)] * len(tiles_dict[filename])
+            tiles_skipped_dict[filename] = 0
+            for i, (_, _, tile) in enumerate(tiles_dict[filename]):
+                if is_blank_tile(tile, self.blank_ink_threshold, self.blank_min_ink_ratio):
+                    tiles_skipped_dict[filename] += 1
+                else:
+                    tile_keys.append((filename, i))
+        blank_timer.stop()
+
+        # take the detections of already known tiles from the tile cache
+        tiles_cached_dict = {filename: 0 for filename in tiles_dict}
+        cache_timer = state.timer("text_detection.tile_cache").start()
+        if self.tile_cache is not None:
+            settings_key = self.detector.settings_key()
+            cache_keys = {key: settings_key + ":" + tile_hash(tiles_dict[key[0]][key[1]][2]) for key in tile_keys}
+            cached = self.tile_cache.get_many(cache_keys.values())
+            for filename, i in tile_keys:
+                if cache_keys[(filename, i)] in cached:
+                    detections_dict[filename][i] = np.frombuffer(
+                        cached[cache_keys[(filename, i)]], dtype=np.float32
+                    ).reshape(-1, 6)
+                    tiles_cached_dict[filename] += 1
+            tile_keys = [key for key in tile_keys if cache_keys[key] not in cached]
+        cache_timer.stop()
+
+        # detect text in the tiles (in memory, no subprocess and no label files)
+        # tiles of all drawings go through the detector in shared batches
+        detections = self.detector.detect(
+            [tiles_dict[filename][i][2] for filename, i in tile_keys],
+            batch_size=self.batch_size,
+            timings=state.timings
+        )
+
+        # scatter the detections back to their drawings and tiles
+        for (filename, i), tile_detections in zip(tile_keys, detections):
+            detections_dict[filename][i] = tile_detections
+
+        if self.tile_cache is not None:
+            cache_timer.start()
+            self.tile_cache.set_many({
+                cache_keys[key]: np.ascontiguousarray(tile_detections, dtype=np.float32).tobytes()
+                for key, tile_detections in zip(tile_keys, detections)
+            })
+            cache_timer.stop()
 
         # ---------------------------- POSTPROCESSING -------------------------- #
 
         # setup output dictionary with the following structure
         output = {}
 
-        # merge processed tiles
-        for filename in filenames:
-            
-            img = cv2.imread(filename)
-            filename = filename.split("/")[-1]
-            
+        for filename in images_dict:
 
+            paths = image_paths(self.config, filename)["text_detection"]
             elements = []
 
-            tiler = tilers_dict[filename]
-            merger = Merger(tiler)
-            
-
-            # loop (processed) tiles of the original file
-            for tile_id, tile in tiler(img):
+            # the detections are drawn directly on a copy of the decoded image
+            final_image = images_dict[filename].copy()
 
-                # get processed tile and add to merger
-                filename_tile = (Path(filename).stem
-                                + "_tile_" + str(tile_id) + ".png")
-                save_path_tile = Path(cache_processed_path, filename_tile)
-                img_processed = cv2.imread(str(save_path_tile))
-                merger.add(tile_id, img_processed)
+            # transform to global coords, the tile bbox is (y_min, x_min, y_max, x_max)
+            global_detections = []
+            for (tile_id, tile_bbox, _), tile_detections in zip(tiles_dict[filename], detections_dict[filename]):
 
-                # get labels from txt file and add to global labels file
-                filename_tile_txt = (Path(filename).stem
-                                    + "_tile_" + str(tile_id) + ".txt")
-                save_path_tile_txt = Path(cache_processed_labels_path,
-                                        filename_tile_txt)
-
-                if not os.path.isfile(save_path_tile_txt):
+                if not len(tile_detections):
                     continue  # no preds found in this tile, move on
 
-                with open(save_path_tile_txt, 'r') as in_file:
-                    labels_txt = in_file.readlines()
-
-
-                    # test stuff
-                    print(tiler.get_tile_bbox(tile_id))
-                    print(tiler.get_mosaic_shape())
-                    print(tiler.get_tile_mosaic_position(tile_id))
-
-                    # transform to global coords 
-                    # get bottom-left coords (attention: tiler uses different origin)
-                    x_min = min(
-                        tiler.get_tile_bbox(tile_id)[0][1],
-                        tiler.get_tile_bbox(tile_id)[1][1]
-                    )
-
-                    x_max = max(
-                        tiler.get_tile_bbox(tile_id)[0][1],
-                        tiler.get_tile_bbox(tile_id)[1][1]
-                    )
-
-                    y_min = min(
-                        tiler.get_tile_bbox(tile_id)[0][0],
-                        tiler.get_tile_bbox(tile_id)[1][0]
-                    )
-
-                    y_max = max(
-                        tiler.get_tile_bbox(tile_id)[0][0],
-                        tiler.get_tile_bbox(tile_id)[1][0]
-                    )
-
-                    # get width and height of tile
-                    w = x_max - x_min
-                    h = y_max - y_min
-                    
-                    print(x_min, y_min, x_max, y_max)
-                    print(w, h)
-
-                    for line in labels_txt:
-                        fields = line.split()
-                        class_id = fields[0]
-                        confidence = fields[5]
-
-                        if float(confidence) < 0.5:
-                            continue
-
-                        x1 = int(((float(fields[1]) - float(fields[3])/2.0) * w) + x_min)
-                        y1 = int(((float(fields[2]) - float(fields[4])/2.0) * h) + y_min)
-                        x2 = int(((float(fields[1]) + float(fields[3])/2.0) * w) + x_min)
-                        y2 = int(((float(fields[2]) + float(fields[4])/2.0) * h) + y_min)
-                        
-                        # add line to global labels file
-                        elements.append({
-                            "guid": str(uuid4()),
-                            "class_id": class_id,
-                            "confidence": confidence,
-                            "bbox_xyxy_abs": [x1, y1, x2, y2]
-                        })
-
-            # save final merge
-            final_image = merger.merge(unpad=True)
+                tile_detections = tile_detections.copy()
+                tile_detections[:, [0, 2]] += tile_bbox[1]
+                tile_detections[:, [1, 3]] += tile_bbox[0]
+                global_detections.append(tile_detections[::-1])
+
+            # one global nms and box fusion per image over the detections in the bands shared by neighbouring tiles:
+            # removes the duplicates of the overlapping bands and joins boxes which were cut at a tile seam (without
+            # overlap the tiles share no band, every detection is kept as detected)
+            merge_timer = state.timer("text_detection.merge").start()
+            global_detections = np.concatenate(global_detections) if global_detections else np.zeros((0, 6))
+            if self.tile_overlap and len(global_detections):
+                global_detections = merge_detections(
+                    global_detections,
+                    iou_thres=self.merge_iou_thres,
+                    fuse_thres=self.merge_fuse_thres,
+                    bands=overlap_bands([(tile_id, tile_bbox) for tile_id, tile_bbox, _ in tiles_dict[filename]])
+                )
+            merge_timer.stop()
+
+            draw_timer = state.timer("text_detection.draw_and_write").start()
+            for *xyxy, conf, cls in global_detections:
+
+                x1, y1, x2, y2 = (int(value) for value in xyxy)
+
+                label = f'{self.detector.names[int(cls)]} {conf:.2f}'
+                plot_one_box((x1, y1, x2, y2), final_image, label=label, color=self.colors[int(cls)], line_thickness=1)
+
+                # add line to global labels file
+                elements.append({
+                    "guid": str(uuid4()),
+                    "class_id": '%g' % cls,
+                    "confidence": '%g' % conf,
+                    "bbox_xyxy_abs": [x1, y1, x2, y2]
+                })
+
+            if self.debug_tiles:
+                for tile_id, tile_bbox, _ in tiles_dict[filename]:
+                    filename_tile = (Path(filename).stem
+                                    + "_tile_" + str(tile_id) + ".png")
+                    processed_tile = final_image[tile_bbox[0]:tile_bbox[2], tile_bbox[1]:tile_bbox[3]]
+                    cv2.imwrite(str(Path(paths["cache_processed_path"], filename_tile)), processed_tile)
+
+            # save final visual result
             output_filename_img = str(Path(
-                final_output_path_visual_results,
+                paths["final_visual_path"],
                 filename
             ))
 
             if not cv2.imwrite(output_filename_img, final_image):
                 raise Exception("Image could not be saved: {}".format(output_filename_img))
+            draw_timer.stop()
 
             # sort text elements by coordinate, going from image top to bottom
             elements = sorted(elements, key=lambda item: item["bbox_xyxy_abs"][1], reverse=False)
 
             output[filename] = {
                 "visual_result_path": "visual/" + output_filename_img.split("/")[-1],
-                "elements": elements            
+                "elements": elements,
+                "meta": {
+                    "tiles": len(tiles_dict[filename]),
+                    "tiles_skipped": tiles_skipped_dict[filename],
+                    "tiles_cached": tiles_cached_dict[filename]
+                }
             }
 
+        state.data = output
+        state.finish_stage("text_detection")
+
         # save output as json
-        result_path = str(Path(final_output_path, "results.json"))
-        with open(result_path, "w+") as out_file:
-            json.dump(output, out_file)
-        out_file.close()
+        if state.debug:
+            result_path = str(Path(final_output_path, "results.json"))
+            with open(result_path, "w+") as out_file:
+                json.dump(output, out_file)
+            out_file.close()
 
-        return
\ No newline at end of file
+        return state
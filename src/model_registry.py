@@ -0,0 +1,137 @@
+import functools
+import hashlib
+import logging
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from urllib.parse import urlparse
+
+import torch
+
+
+YOLOV7_PATH = str(Path(__file__).resolve().parent / "yolov7")
+PARSEQ_PATH = str(Path(__file__).resolve().parent / "parseq")
+PARSEQ_MODEL = "parseq"
+# the settings of the recognizer which change its results (decode_cache: the incremental ar decoding, see
+# parseq/strhub/models/parseq/system.py)
+PARSEQ_SETTINGS = {"decode_ar": True, "refine_iters": 1, "decode_cache": True}
+
+
+def load_detector(weights):
+    # yolov7 uses absolute imports ("from models.experimental import ..."),
+    # so its root has to be importable before loading the weights
+    if YOLOV7_PATH not in sys.path:
+        sys.path.insert(0, YOLOV7_PATH)
+    from models.experimental import attempt_load
+
+    return attempt_load(weights, map_location=torch.device("cpu"))
+
+
+def load_recognizer():
+    # the vendored parseq (with the incremental decoding), only the pretrained weights are downloaded (once)
+    parseq = torch.hub.load(PARSEQ_PATH, PARSEQ_MODEL, source='local', pretrained=True,
+                            decode_ar=PARSEQ_SETTINGS["decode_ar"], refine_iters=PARSEQ_SETTINGS["refine_iters"]).eval()
+    parseq.decode_cache = PARSEQ_SETTINGS["decode_cache"]
+    parseq.to(torch.device("cpu"))
+    return parseq
+
+
+def recognizer_weights_path():
+    # where torch.hub keeps the downloaded pretrained weights
+    from .parseq.strhub.models.utils import _WEIGHTS_URL
+
+    return Path(torch.hub.get_dir(), "checkpoints", os.path.basename(urlparse(_WEIGHTS_URL[PARSEQ_MODEL]).path))
+
+
+@functools.lru_cache(maxsize=16)
+def _file_digest(path, size, mtime_ns):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 ** 2), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def weights_digest(path):
+    """
+    sha256 of a weights file, hashed once per process and version (size, modification time) of the file.
+
+    :return: the digest, None if there is no such file
+    :rtype: str or None
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return _file_digest(str(path), stat.st_size, stat.st_mtime_ns)
+
+
+def recognizer_identity():
+    """
+    The recognizer weights and the settings of the recognizer which change its results, without loading the model
+    (for the keys of the checkpoints and of the snippet memo).
+
+    :rtype: dict
+    """
+    return {"model": PARSEQ_MODEL, "weights": weights_digest(recognizer_weights_path()), **PARSEQ_SETTINGS}
+
+
+class ModelRegistry:
+    """
+    Keeps the AI models resident for the lifetime of a (worker) process.
+
+    Every model is loaded at most once per process and then handed out to all
+    following tasks. The counters show whether a task had to pay the cold-load
+    cost (miss) or got an already loaded model (hit).
+    """
+
+    def __init__(self):
+        self._models = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.load_seconds = {}
+
+    def get(self, key, loader):
+        with self._lock:
+            if key in self._models:
+                self.hits += 1
+                return self._models[key]
+
+            self.misses += 1
+            start = time.perf_counter()
+            model = loader()
+            self.load_seconds[key] = time.perf_counter() - start
+            self._models[key] = model
+            logging.info("Loaded model {} in {:.2f}s".format(key, self.load_seconds[key]))
+            return model
+
+    def get_detector(self, weights):
+        return self.get("detector:" + str(weights), lambda: load_detector(weights))
+
+    def get_recognizer(self):
+        return self.get("recognizer:parseq", load_recognizer)
+
+    def is_loaded(self, key):
+        return key in self._models
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "load_seconds": dict(self.load_seconds),
+            "resident": sorted(self._models.keys()),
+        }
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+            self.hits = 0
+            self.misses = 0
+            self.load_seconds = {}
+
+
+# one registry per process, shared by all tasks running in it
+registry = ModelRegistry()
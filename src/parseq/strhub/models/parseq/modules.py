@@ -81,6 +81,18 @@ class DecoderLayer(nn.Module):
                                           content_key_padding_mask)[0]
         return query, content
 
+    def forward_step(self, query, content, memory, content_cache: Optional[Tensor] = None, update_content: bool = True):
+        """Incremental (AR) decoding step. query and content only hold the newest position (N, 1, E).
+        The LayerNorm'd content of all previous positions is passed in as content_cache, which stands in for the
+        keys/values of the self-attention. No masks are needed: with the forward AR context the newest position
+        may attend to all previous ones. Returns the updated cache (previous positions + newest one)."""
+        content_norm = self.norm_c(content)
+        content_kv = content_norm if content_cache is None else torch.cat([content_cache, content_norm], dim=1)
+        query = self.forward_stream(query, self.norm_q(query), content_kv, memory, None, None)[0]
+        if update_content:
+            content = self.forward_stream(content, content_norm, content_kv, memory, None, None)[0]
+        return query, content, content_kv
+
 
 class Decoder(nn.Module):
     __constants__ = ['norm']
@@ -100,6 +112,15 @@ class Decoder(nn.Module):
         query = self.norm(query)
         return query
 
+    def forward_step(self, query, content, memory, cache):
+        """Incremental (AR) decoding step, see DecoderLayer.forward_step. cache holds one tensor (or None before the
+        first step) per layer and is updated in place."""
+        for i, mod in enumerate(self.layers):
+            last = i == len(self.layers) - 1
+            query, content, cache[i] = mod.forward_step(query, content, memory, cache[i], update_content=not last)
+        query = self.norm(query)
+        return query
+
 
 class Encoder(VisionTransformer):
 
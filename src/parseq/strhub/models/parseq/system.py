@@ -66,6 +66,10 @@ class PARSeq(CrossEntropySystem):
         # +1 for <eos>
         self.pos_queries = nn.Parameter(torch.Tensor(1, max_label_length + 1, embed_dim))
         self.dropout = nn.Dropout(p=dropout)
+        # Incremental AR decoding (decoder state of the previous steps is cached), see decode_ar_cached()
+        self.decode_cache = True
+        # Attention masks per (num_steps, device), see cloze_mask()
+        self._mask_cache = {}
         # Encoder has its own init.
         named_apply(partial(init_weights, exclude=['encoder']), self)
         nn.init.trunc_normal_(self.pos_queries, std=.02)
@@ -92,6 +96,62 @@ class PARSeq(CrossEntropySystem):
         tgt_query = self.dropout(tgt_query)
         return self.decoder(tgt_query, tgt_emb, memory, tgt_query_mask, tgt_mask, tgt_padding_mask)
 
+    def cloze_mask(self, num_steps: int) -> Tensor:
+        """The 'cloze' mask used for iterative refinement: the AR forward mask with the token context to the right
+        unmasked. Cached per (num_steps, device), must not be modified in place."""
+        key = (num_steps, self._device)
+        mask = self._mask_cache.get(key)
+        if mask is None:
+            mask = torch.triu(torch.full((num_steps, num_steps), float('-inf'), device=self._device), 1)
+            mask[torch.triu(torch.ones(num_steps, num_steps, dtype=torch.bool, device=self._device), 2)] = 0
+            self._mask_cache[key] = mask
+        return mask
+
+    def decode_ar_cached(self, memory: Tensor, pos_queries: Tensor, num_steps: int, testing: bool) -> Tensor:
+        """Greedy AR decoding, one new position per step.
+        The decoder state of the previous positions is cached (see Decoder.forward_step), so every step only runs the
+        newest position through the decoder instead of the whole prefix. When testing, sequences which have emitted
+        <eos> are dropped from the active batch, their remaining logits stay 0 (argmax is <eos>)."""
+        bs = memory.shape[0]
+        tgt_in = torch.full((bs, num_steps), self.pad_id, dtype=torch.long, device=self._device)
+        tgt_in[:, 0] = self.bos_id
+
+        logits = None
+        steps = num_steps
+        active = torch.arange(bs, device=self._device)  # rows of the batch which are still decoding
+        active_memory = memory
+        cache = [None] * self.decoder.num_layers
+        for i in range(num_steps):
+            j = i + 1  # next token index
+            # content of the newest position: <bos> is the null context, characters get their position information
+            if i == 0:
+                content = self.text_embed(tgt_in[active, :1])
+            else:
+                content = self.pos_queries[:, i - 1:i] + self.text_embed(tgt_in[active, i:j])
+            tgt_out = self.decoder.forward_step(self.dropout(pos_queries[active, i:j]), self.dropout(content),
+                                                active_memory, cache)
+            # the next token probability is in the output's ith token position
+            p_i = self.head(tgt_out)
+            if logits is None:
+                logits = p_i.new_zeros((bs, num_steps, p_i.shape[-1]))
+            logits[active, i:j] = p_i
+            if j < num_steps:
+                # greedy decode. add the next token index to the target input
+                tgt_in[active, j] = p_i[:, 0].argmax(-1)
+                if testing:
+                    finished = (tgt_in == self.eos_id).any(dim=-1)
+                    # Efficient batch decoding: If all output words have at least one EOS token, end decoding.
+                    if finished.all():
+                        steps = j
+                        break
+                    # drop the finished sequences (and their cached state) from the active batch
+                    keep = ~finished[active]
+                    if not keep.all():
+                        active = active[keep]
+                        active_memory = active_memory[keep]
+                        cache = [state[keep] for state in cache]
+        return logits[:, :steps]
+
     def forward(self, images: Tensor, max_length: Optional[int] = None) -> Tensor:
         testing = max_length is None
         max_length = self.max_label_length if max_length is None else min(max_length, self.max_label_length)
@@ -103,10 +163,12 @@ class PARSeq(CrossEntropySystem):
         # Query positions up to `num_steps`
         pos_queries = self.pos_queries[:, :num_steps].expand(bs, -1, -1)
 
-        # Special case for the forward permutation. Faster than using `generate_attn_masks()`
-        tgt_mask = query_mask = torch.triu(torch.full((num_steps, num_steps), float('-inf'), device=self._device), 1)
+        if self.decode_ar and self.decode_cache:
+            logits = self.decode_ar_cached(memory, pos_queries, num_steps, testing)
+        elif self.decode_ar:
+            # Special case for the forward permutation. Faster than using `generate_attn_masks()`
+            tgt_mask = query_mask = torch.triu(torch.full((num_steps, num_steps), float('-inf'), device=self._device), 1)
 
-        if self.decode_ar:
             tgt_in = torch.full((bs, num_steps), self.pad_id, dtype=torch.long, device=self._device)
             tgt_in[:, 0] = self.bos_id
 
@@ -139,7 +201,8 @@ class PARSeq(CrossEntropySystem):
         if self.refine_iters:
             # For iterative refinement, we always use a 'cloze' mask.
             # We can derive it from the AR forward mask by unmasking the token context to the right.
-            query_mask[torch.triu(torch.ones(num_steps, num_steps, dtype=torch.bool, device=self._device), 2)] = 0
+            # (the AR forward mask used to be modified in place, so the content stream gets the cloze mask as well)
+            query_mask = tgt_mask = self.cloze_mask(num_steps)
             bos = torch.full((bs, 1), self.bos_id, dtype=torch.long, device=self._device)
             for i in range(self.refine_iters):
                 # Prior context is the previous output.
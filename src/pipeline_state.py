@@ -0,0 +1,94 @@
+import copy
+import json
+from pathlib import Path
+
+import cv2
+
+from .stage_timer import StageTimer
+
+
+def image_paths(config, image_filename):
+    """
+    Output paths of an image. A config for several images (see prepare_project_cfg in store/utility/ai_utils.py) has
+    the paths of every image in "image_paths", the config of a single image only "paths".
+
+    :rtype: dict
+    """
+    return config.get("image_paths", {}).get(image_filename, config["paths"])
+
+
+class PipelineState:
+    """
+    In-memory hand-off between the stages of the ai pipeline (Localizer -> Recognizer -> Interpreter).
+
+    Every drawing is decoded once by the Localizer and then shared by all stages, no stage has to read the results
+    or the original drawing of the previous stage from disk.
+
+    images: decoded drawings (BGR numpy arrays, as returned by cv2) by filename
+    data: the elements structure, same layout as the results.json files of the stages, updated by every stage
+    results: the final result of every stage by stage name (text_detection, text_recognition, text_interpretation),
+             these are copies, so that later stages can not modify them
+    debug: the stages still write their results.json files and copies of the original drawings
+    timings: wall time, cpu time and peak rss of the stages and their parts by name, e.g. "text_detection.inference"
+    """
+
+    def __init__(self, debug=False):
+        self.images = {}
+        self.data = {}
+        self.results = {}
+        self.debug = debug
+        self.timings = {}
+
+    def timer(self, name):
+        """
+        :rtype: StageTimer
+        """
+        return StageTimer(self.timings, name)
+
+    def finish_stage(self, stage, result=None):
+        """
+        Stores the result of a stage (data by default) as a deep copy.
+
+        :rtype: dict
+        """
+        self.results[stage] = copy.deepcopy(self.data if result is None else result)
+        return self.results[stage]
+
+    def to_dict(self):
+        """
+        Everything but the decoded drawings, json serializable, to hand the state over to a stage running in another
+        process (see the stage tasks in store/tasks.py).
+
+        :rtype: dict
+        """
+        return {"data": self.data, "results": self.results, "timings": self.timings, "debug": self.debug}
+
+    @classmethod
+    def from_dict(cls, state_dict, filenames):
+        """
+        Builds the state from to_dict, the drawings are decoded again from filenames.
+
+        :rtype: PipelineState
+        """
+        state = cls(debug=state_dict["debug"])
+        state.data = state_dict["data"]
+        state.results = state_dict["results"]
+        state.timings = state_dict["timings"]
+        for filename in filenames:
+            state.images[Path(filename).name] = cv2.imread(str(filename))
+        return state
+
+    @classmethod
+    def load(cls, input_path, debug=True):
+        """
+        Builds the state from the files written by a stage in debug mode (results.json and original/), e.g. to run a
+        single stage on its own.
+
+        :rtype: PipelineState
+        """
+        state = cls(debug=debug)
+        with open(str(Path(input_path, "results.json"))) as in_file:
+            state.data = json.load(in_file)
+        for image_filename in state.data:
+            state.images[image_filename] = cv2.imread(str(Path(input_path, "original", image_filename)))
+        return state
@@ -1,130 +1,228 @@
+import hashlib
 import json
 import logging
 import os
+import time
 import zipfile
 from pathlib import Path
+from types import SimpleNamespace
 from zipfile import ZipFile
 
 import cv2
 import torch
 from PIL import Image
+from .inference_client import InferenceClient
+from .model_registry import recognizer_identity, registry
+from .pipeline_state import PipelineState, image_paths
+from .snippet_memo import open_memo
 from .parseq.strhub.data.module import SceneTextDataModule
 
 class Recognizer:
     
-    def __init__(self, config):
+    def __init__(self, config, parseq=None, client=None):
         
         self.config = config
+        inference = self.config.get("inference", {})
 
         # Load model and image transforms
         # self.device = "cuda:0" #modified by shipan
         self.device = torch.device('cpu')
-        self.parseq = torch.hub.load('baudm/parseq', 'parseq', pretrained=True).eval()
-        self.parseq.to(self.device)
-        self.img_transform = SceneTextDataModule.get_transform(self.parseq.hparams.img_size)
+        # with an inference server (see inference_server.py) the snippets are recognized by the model of the server,
+        # this process loads no model
+        if client is None and inference.get("inference_server"):
+            client = InferenceClient(inference["inference_server"])
+        self.client = client
+        if self.client is not None:
+            self.parseq = None
+            hparams = SimpleNamespace(**self.client.recognizer_info())
+        else:
+            # the model stays resident per process, see model_registry.py
+            self.parseq = parseq if parseq is not None else registry.get_recognizer()
+            self.img_transform = SceneTextDataModule.get_transform(self.parseq.hparams.img_size)
+            hparams = self.parseq.hparams
+
+        # snippets are recognized in batches of this size, sorted by aspect ratio (similar text lengths in one batch,
+        # so that the decoder can stop as soon as every sequence of the batch has ended)
+        self.batch_size = max(1, int(inference.get("recognition_batch_size", 32)))
+        self.bucket_by_aspect_ratio = inference.get("recognition_bucket_by_aspect_ratio", True)
+
+        # memoized text of snippets seen before (in-process lru, optionally backed by a sqlite file of the node), the
+        # texts of other recognizer weights are not shared
+        memo_max_entries = inference.get("snippet_memo_max_entries", 20000)
+        identity = hashlib.sha1(json.dumps(recognizer_identity(), sort_keys=True).encode()).hexdigest()[:16]
+        self.memo = open_memo(
+            "parseq-{}-{}-{}-{}".format(identity, hparams.img_size, hparams.decode_ar, hparams.refine_iters),
+            max_entries=memo_max_entries,
+            path=inference.get("snippet_memo_path"),
+            max_bytes=inference.get("snippet_memo_max_bytes", 64 * 1024 ** 2)
+        ) if memo_max_entries else None
 
         # dirs
         self.cache_path = self.config["paths"]["text_recognition"]["cache_path"]
         self.final_path = self.config["paths"]["text_recognition"]["final_path"]
 
+    def make_snippets(self, state):
+        '''Cuts the text snippets of all elements of the previous text localization
+        service out of the decoded drawings of the pipeline state (numpy views, nothing is copied)
+        '''
+        data = state.data
+        for image_filename in data:
+
+            img = state.images[image_filename]
+
+            for element in data[image_filename]["elements"]:
+
+                bbox_xyxy_abs = element['bbox_xyxy_abs']
+
+                # save snippet
+                element["snippet"] = img[
+                    int(bbox_xyxy_abs[1]):int(bbox_xyxy_abs[3]),
+                    int(bbox_xyxy_abs[0]):int(bbox_xyxy_abs[2]),
+                    :
+                ]
+
+        return data
+
     def make_snippets_from_images_and_coords(self, input_path, cache_path):
         '''Processes results from the previous text localization
-        service, in particular, this function expects the following file structure:
+        service, in particular, this function expects the following file structure
+        (written by the localizer in debug mode):
         input_file/
             - original/ --> from here, snippets are taken
             - visual/
             results.json --> snippets are defined in here
         '''
-        
-        # Get image files
-        filenames = [filename for filename in os.listdir(input_path)
-                    if filename.endswith(".json")]
-        logging.info("Number of found image files: "+ str(len(filenames)))
-        input_json = filenames[0]
+        return self.make_snippets(PipelineState.load(input_path))
 
-        with open(str(Path(input_path, input_json))) as in_file:
-            data = json.load(in_file)
+    def batches(self, snippets, batch_size=None):
+        """
+        Splits the snippets into batches of indices. With bucketing the snippets are sorted by aspect ratio first,
+        so that a batch holds snippets of similar text length.
 
-            # for each image, create snippets
-            for image_filename in data:
+        :rtype: list
+        """
+        batch_size = self.batch_size if batch_size is None else max(1, int(batch_size))
+        order = list(range(len(snippets)))
+        if self.bucket_by_aspect_ratio:
+            order.sort(key=lambda i: snippets[i].shape[1] / max(snippets[i].shape[0], 1))
+        return [order[start:start + batch_size] for start in range(0, len(order), batch_size)]
 
-                # get the image
-                image_path = str(Path(input_path, "original", image_filename))
-                img = cv2.imread(image_path)
-                w, h = img.shape[1], img.shape[0]
-
-                # get text snippets with conf over threshold
-                for i, element in enumerate(data[image_filename]["elements"]):
-
-                    bbox_xyxy_abs = element['bbox_xyxy_abs']
-                        
-                    snippet = img[
-                        int(bbox_xyxy_abs[1]):int(bbox_xyxy_abs[3]),
-                        int(bbox_xyxy_abs[0]):int(bbox_xyxy_abs[2]),
-                        :
-                    ]
-                    snippet_path = str(Path(cache_path, Path(image_filename).stem + "_snippet_{}".format(str(i)) + ".png"))
-
-                    # save abs coords
-                    data[image_filename]["elements"][i]["bbox_xyxy_abs"] = bbox_xyxy_abs
-                    
-                    # save snippet
-                    data[image_filename]["elements"][i]["snippet"] = snippet
-                    
-                    logging.info("Saving snippet at {}".format(snippet_path))
-        
-        return data
-    
+    @torch.no_grad()
+    def recognize(self, snippets, batch_size=None):
+        """
+        Recognizes the text of the snippets (BGR numpy arrays, as cut from the cv2 image).
+        Every batch runs through one forward pass and one tokenizer.decode call.
+
+        :return: list of (text, confidence) in the order of the snippets
+        :rtype: list
+        """
+        if self.client is not None:
+            # batched on the server, together with the snippets of the other workers
+            return self.client.recognize(snippets)
+
+        results = [None] * len(snippets)
+        for batch in self.batches(snippets, batch_size):
+            # Preprocess. Model expects a batch of images with shape: (B, C, H, W)
+            imgs = torch.stack([
+                self.img_transform(Image.fromarray(cv2.cvtColor(snippets[i], cv2.COLOR_BGR2RGB)))
+                for i in batch
+            ]).to(self.device)
+
+            logits = self.parseq(imgs)  # (B, 26, 95), 94 characters + [EOS] symbol
+
+            # Greedy decoding
+            labels, confidences = self.parseq.tokenizer.decode(logits.softmax(-1))
+
+            # scatter back to the snippet order
+            for i, label, confidence in zip(batch, labels, confidences):
+                results[i] = (label, float(confidence.prod()) if len(confidence) else 0.0)
+        return results
+
+    def recognize_memoized(self, snippets):
+        """
+        Like recognize, but snippets known to the memo (see snippet_memo.py) are not recognized again and the
+        snippets of this call with the same key are only recognized once.
+
+        :return: list of (text, confidence) and a list with True for every snippet which was not recognized
+        :rtype: tuple
+        """
+        keys = [self.memo.key(snippet) for snippet in snippets]
+        first_index = {key: i for i, key in reversed(list(enumerate(keys)))}
+        found = self.memo.get_many(list(first_index))
+
+        unknown = {key: i for key, i in first_index.items() if key not in found}
+        start = time.perf_counter()
+        recognized = dict(zip(unknown, self.recognize([snippets[i] for i in unknown.values()])))
+        self.memo.record_recognition_time(time.perf_counter() - start, len(unknown))
 
-    def inference(self, input_path):
+        self.memo.set_many(recognized)
+        found.update(recognized)
+
+        recognized_indices = set(unknown.values())
+        return [found[key] for key in keys], [i not in recognized_indices for i in range(len(snippets))]
+
+    def inference(self, input_path=None, state=None):
+        """
+        Recognizes the text of all elements in the pipeline state (or of the results written to input_path by the
+        localizer in debug mode). Only the visual result is written, results.json and the original drawing only in
+        debug mode.
+
+        :rtype: PipelineState
+        """
 
         # ---------------------------- PREPROCESSING --------------------------- #
         # gather images
-        data = self.make_snippets_from_images_and_coords(
-            input_path,
-            self.cache_path)
+        state = state if state is not None else PipelineState.load(input_path)
+        with state.timer("text_recognition.snippets"):
+            data = self.make_snippets(state)
+
+        # ---------------------------- INFERENCE ------------------------------- #
+        # the snippets of all images are recognized together in batches
+        keys = [(image_filename, i) for image_filename in data for i in range(len(data[image_filename]["elements"]))]
+        logging.info("Recognizing {} snippets in batches of {} ...".format(len(keys), self.batch_size))
+        snippets = [data[image_filename]["elements"][i]["snippet"] for image_filename, i in keys]
+        with state.timer("text_recognition.inference"):
+            if self.memo is not None:
+                recognized, memo_hits = self.recognize_memoized(snippets)
+            else:
+                recognized, memo_hits = self.recognize(snippets), [False] * len(snippets)
+
+        for (image_filename, i), (label, _) in zip(keys, recognized):
+            data[image_filename]["elements"][i]["text"] = label
+
+        # hit rate and the (estimated) recognition time saved by the memo per drawing
+        if self.memo is not None:
+            for image_filename in data:
+                snippets_nr = len(data[image_filename]["elements"])
+                hits = sum(hit for (filename, _), hit in zip(keys, memo_hits) if filename == image_filename)
+                data[image_filename].setdefault("meta", {})["snippet_memo"] = {
+                    "snippets": snippets_nr,
+                    "hits": hits,
+                    "hit_rate": hits / snippets_nr if snippets_nr else 0.0,
+                    "seconds_saved": hits * self.memo.seconds_per_snippet,
+                }
+            logging.info("Snippet memo: {}".format(self.memo.stats()))
 
+        # ---------------------------- POSTPROCESSING -------------------------- #
         # iterate input images
+        draw_timer = state.timer("text_recognition.draw_and_write").start()
         for image_filename in data:
 
-            logging.info("Load original image ...")
-            visual_result = cv2.imread(str(Path(input_path, "original", image_filename)))
-            logging.info("Save original image for further processing ...")
-            cv2.imwrite(
-                str(Path(self.final_path, "original", image_filename)),
-                visual_result
-            )
-            
-            logging.info("Iterate text snippets...")
-            # iterate text snippets per image
-            for i, element in enumerate(data[image_filename]["elements"]):
-                
-                logging.info("Recognizing snippet ...")
-
-                # get snippet path and load snippet
-                # snippet_path = element["snippet_path"]
-                # img = Image.open(str(Path(cache_path, snippet_path))).convert('RGB')
-                
-                # load snippet
-                snippet = cv2.cvtColor(element["snippet"], cv2.COLOR_BGR2RGB)
-                img = Image.fromarray(snippet)
-            
-                # Preprocess. Model expects a batch of images with shape: (B, C, H, W)
-                img = self.img_transform(img).unsqueeze(0).to(self.device)
-
-                logits = self.parseq(img)
-                logits.shape  # torch.Size([1, 26, 95]), 94 characters + [EOS] symbol
-
-                # Greedy decoding
-                pred = logits.softmax(-1)
-                label, confidence = self.parseq.tokenizer.decode(pred)
-
-                data[image_filename]["elements"][i]["text"] = label[0]
-                
+            final_path = image_paths(self.config, image_filename)["text_recognition"]["final_path"]
+            visual_result = state.images[image_filename].copy()
+            if state.debug:
+                logging.info("Save original image for further processing ...")
+                cv2.imwrite(
+                    str(Path(final_path, "original", image_filename)),
+                    state.images[image_filename]
+                )
+
+            for element in data[image_filename]["elements"]:
+
                 # make visual result
                 cv2.putText(
                     img=visual_result,
-                    text=label[0],
+                    text=element["text"],
                     org=(element['bbox_xyxy_abs'][0],element['bbox_xyxy_abs'][1]),
                     fontFace=cv2.FONT_HERSHEY_DUPLEX,
                     fontScale=1,
@@ -139,19 +237,24 @@ class Recognizer:
                     thickness=1
                 )
 
-                cv2.imwrite(
-                    str(Path(self.final_path, "visual", image_filename)),
-                    visual_result
-                )
-        
                 # Pop snippet from output dict
-                data[image_filename]["elements"][i].pop("snippet")
-                
+                element.pop("snippet")
+
+            # the visual result is written once per image
+            cv2.imwrite(
+                str(Path(final_path, "visual", image_filename)),
+                visual_result
+            )
+        draw_timer.stop()
+
+        state.finish_stage("text_recognition")
+
         # save output as json
-        logging.info("Save results ...")
-        result_path = str(Path(self.final_path, "results.json"))
-        with open(result_path, "w+") as out_file:
-            json.dump(data, out_file)
-        out_file.close()
+        if state.debug:
+            logging.info("Save results ...")
+            result_path = str(Path(self.final_path, "results.json"))
+            with open(result_path, "w+") as out_file:
+                json.dump(data, out_file)
+            out_file.close()
 
-        return
\ No newline at end of file
+        return state
@@ -0,0 +1,81 @@
+import functools
+import re
+
+import yaml
+
+
+# the rules of a room stamp line, in the order of their priority: the first rule whose pattern matches the whole line
+# decides what the line is, a later line of the same kind overwrites an earlier one. code and name take the whole
+# line, area and height the named groups "value" (a number) and "unit".
+DEFAULT_RULES = [
+    {"field": "code",
+     "pattern": r'^[0-9]{1,2}(\.[A-Z]?[A-Z0-9]{2,3}|\-[0-9]{1,2}(\.[A-Z]?[A-Z0-9]{2,3})?|[0-9]{1,2}[a-z])$'},
+    {"field": "name", "pattern": r'^(?!^\d+$)[\w\s?!:-]+$'},
+    {"field": "area", "pattern": r'^(?P<value>\d+(\.\d+)?)\s?(?P<unit>[\w\d]+)$'},
+    {"field": "height", "pattern": r'^RH\.?:\s?(?P<value>\d+(\.\d+)?)\s?(?P<unit>[a-zA-Z]+)$'},
+]
+
+FIELDS = ("code", "name", "area", "height")
+MEASURE_FIELDS = ("area", "height")
+
+
+class RoomStampParser:
+    """
+    Parses the lines of a room stamp with the rules compiled into one pattern: a single match per line finds the first
+    matching rule (every rule is an alternative of its own named group, the alternatives are tried in the order of the
+    rules) and its value and unit.
+
+    The patterns of the rules must not use numbered backreferences or global inline flags (the groups are renumbered
+    and the flags would apply to all rules).
+    """
+
+    def __init__(self, rules=None):
+        rules = DEFAULT_RULES if rules is None else rules
+
+        self.fields = []
+        alternatives = []
+        for i, rule in enumerate(rules):
+            if rule["field"] not in FIELDS:
+                raise ValueError(f'unknown room stamp field {rule["field"]}, expected one of {FIELDS}')
+            # group names are unique in a pattern, so value and unit get the number of the rule
+            pattern = rule["pattern"].replace("(?P<value>", f"(?P<value{i}>").replace("(?P<unit>", f"(?P<unit{i}>")
+            if rule["field"] in MEASURE_FIELDS and (f"(?P<value{i}>" not in pattern or f"(?P<unit{i}>" not in pattern):
+                raise ValueError(f'the pattern of the room stamp field {rule["field"]} needs the groups value and unit')
+            self.fields.append(rule["field"])
+            alternatives.append(f"(?P<rule{i}>{pattern})")
+
+        self.regex = re.compile("|".join(alternatives))
+
+    def parse_lines(self, lines):
+        """
+        :return: the value of every field (area and height as (value, unit)) found in the lines
+        :rtype: dict
+        """
+        values = {}
+        for line in lines:
+            line = line.strip()
+            match = self.regex.match(line)
+            if match is None:
+                continue
+            # the outer group of the matching rule is the last one closed
+            i = int(match.lastgroup[len("rule"):])
+            field = self.fields[i]
+            if field in MEASURE_FIELDS:
+                values[field] = (float(match.group(f"value{i}")), match.group(f"unit{i}"))
+            else:
+                values[field] = line
+        return values
+
+
+@functools.lru_cache(maxsize=None)
+def get_parser(rules_path=None):
+    """
+    The parser of a rules file (yaml, a list of rules like DEFAULT_RULES), of the default rules without a path.
+    Compiled once per (worker) process and rules file.
+
+    :rtype: RoomStampParser
+    """
+    if rules_path is None:
+        return RoomStampParser()
+    with open(rules_path, "r", encoding="utf-8") as rules_file:
+        return RoomStampParser(yaml.safe_load(rules_file))
@@ -0,0 +1,111 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from .disk_cache import open_cache
+
+
+class SnippetMemo:
+    """
+    Memoizes the recognized text of snippets. Room stamps repeat the same strings (room names, units, heights), so
+    most snippets of a drawing look like a snippet recognized before.
+
+    The key of a snippet is the digest of its normalized crop: grayscale, downscaled to the recognizer input size and
+    binarized halfway between its paper and its ink, so that scanner grain and jpeg artefacts do not change it. Only
+    exact keys hit, a snippet which differs from a known one in a single pixel of the normalized crop is recognized.
+    Bounded by an in-process LRU of max_entries, optionally backed by a node-wide DiskCache.
+    """
+
+    def __init__(self, namespace, max_entries=20000, backing_store=None, size=(128, 32)):
+        self.namespace = namespace
+        self.max_entries = int(max_entries)
+        self.backing_store = backing_store
+        self.size = tuple(size)  # (width, height)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # average recognition time of a snippet, to estimate the time saved by the hits
+        self.seconds_per_snippet = 0.0
+
+    def normalize(self, snippet):
+        """
+        :return: the ink pixels of the downscaled grayscale snippet, packed into bytes
+        :rtype: np.ndarray
+        """
+        gray = cv2.cvtColor(snippet, cv2.COLOR_BGR2GRAY) if snippet.ndim == 3 else snippet
+        small = cv2.resize(gray, self.size, interpolation=cv2.INTER_AREA)
+        paper, ink = int(small.max()), int(small.min())
+        # a snippet without contrast has no ink
+        ink_pixels = small < (paper + ink) / 2 if paper - ink > 32 else np.zeros(small.shape, dtype=bool)
+        return np.packbits(ink_pixels)
+
+    def key(self, snippet):
+        return self.namespace + ":" + hashlib.blake2b(self.normalize(snippet).tobytes(), digest_size=16).hexdigest()
+
+    def get_many(self, keys):
+        """
+        :return: dict of the found keys and their (text, confidence)
+        :rtype: dict
+        """
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    found[key] = self._entries[key]
+
+        missing = [key for key in keys if key not in found]
+        if missing and self.backing_store is not None:
+            stored = {key: tuple(json.loads(value)) for key, value in self.backing_store.get_many(missing).items()}
+            self._remember(stored)
+            found.update(stored)
+
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def set_many(self, items):
+        self._remember(items)
+        if self.backing_store is not None:
+            self.backing_store.set_many({key: json.dumps(list(value)).encode() for key, value in items.items()})
+
+    def _remember(self, items):
+        with self._lock:
+            for key, value in items.items():
+                self._entries[key] = value
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def record_recognition_time(self, seconds, snippets):
+        if snippets:
+            self.seconds_per_snippet = seconds / snippets
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "seconds_per_snippet": self.seconds_per_snippet,
+        }
+
+
+# one memo per namespace and process, so that it outlives the single tasks
+_memos = {}
+_memos_lock = threading.Lock()
+
+
+def open_memo(namespace, max_entries=20000, path=None, max_bytes=64 * 1024 ** 2):
+    with _memos_lock:
+        if namespace not in _memos:
+            backing_store = open_cache(path, max_bytes=max_bytes) if path else None
+            _memos[namespace] = SnippetMemo(namespace, max_entries=max_entries, backing_store=backing_store)
+        return _memos[namespace]
@@ -0,0 +1,63 @@
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+
+def peak_rss_mb():
+    """
+    Peak resident set size of this process so far (high-water mark), 0 if unknown.
+
+    :rtype: float
+    """
+    if resource is None:
+        return 0.0
+    # ru_maxrss is in kilobytes on linux, in bytes on macos
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / 1024 ** 2 if sys.platform == 'darwin' else maxrss / 1024
+
+
+class StageTimer:
+    """
+    Measures a (sub)stage of the pipeline: wall time, cpu time of the process and the peak rss at the end of the
+    stage. The peak rss is the high-water mark of the process, rss_growth_mb is how much the stage raised it.
+
+        with StageTimer(timings, "text_detection.inference"):
+            ...
+
+    or timer = StageTimer(timings, name).start() ... timer.stop() for parts of a longer function. The measurement is
+    stored in the timings dict under the name (by the with statement also if the stage raises), repeated measurements
+    of the same name (e.g. one per batch) are summed up.
+    """
+
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def start(self):
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.process_time()
+        self.rss_start = peak_rss_mb()
+        return self
+
+    def stop(self):
+        peak_rss = peak_rss_mb()
+        timing = self.timings.setdefault(self.name, {
+            "wall_seconds": 0.0, "cpu_seconds": 0.0, "peak_rss_mb": 0.0, "rss_growth_mb": 0.0, "calls": 0
+        })
+        timing["wall_seconds"] += time.perf_counter() - self.wall_start
+        timing["cpu_seconds"] += time.process_time() - self.cpu_start
+        timing["peak_rss_mb"] = max(timing["peak_rss_mb"], peak_rss)
+        timing["rss_growth_mb"] += peak_rss - self.rss_start
+        timing["calls"] += 1
+        return timing
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
@@ -0,0 +1,99 @@
+import hashlib
+
+import numpy as np
+
+
+def tile_starts(size, tile_size, overlap=0):
+    # start positions along one axis, neighbouring tiles share `overlap` pixels
+    stride = tile_size - overlap
+    if stride <= 0:
+        raise ValueError(f"tile overlap ({overlap}) has to be smaller than the tile size ({tile_size})")
+
+    starts = [0]
+    while starts[-1] + tile_size < size:
+        starts.append(starts[-1] + stride)
+    return starts
+
+
+def tile_grid(height, width, tile_size, overlap=0):
+    """
+    Computes the tile windows for an image of the given size.
+
+    Tiles are laid out row by row from the top left corner, the tiles at the right and bottom edges are clipped to
+    the image (not padded), so every window can be used as a numpy view into the decoded image. With overlap > 0
+    neighbouring tiles share a band of `overlap` pixels, so text crossing a seam is fully contained in one tile.
+
+    :return: list of (tile_id, (y_min, x_min, y_max, x_max))
+    :rtype: list
+    """
+    windows = []
+    tile_id = 0
+    for y_min in tile_starts(height, tile_size, overlap):
+        for x_min in tile_starts(width, tile_size, overlap):
+            windows.append((tile_id, (y_min, x_min, min(y_min + tile_size, height), min(x_min + tile_size, width))))
+            tile_id += 1
+    return windows
+
+
+def overlap_bands(windows):
+    """
+    The bands shared by neighbouring tiles of a grid (see tile_grid), the only places where a text was cut by a tile
+    seam or detected by two tiles.
+
+    :return: x bands and y bands, every band as (start, end) in image coordinates
+    :rtype: tuple
+    """
+    bands = []
+    for start_index in (1, 0):  # x_min / x_max, then y_min / y_max of the (y_min, x_min, y_max, x_max) windows
+        starts = sorted({bbox[start_index] for _, bbox in windows})
+        ends = sorted({bbox[start_index + 2] for _, bbox in windows})
+        bands.append([(start, end) for start, end in zip(starts[1:], ends[:-1])])
+    return tuple(bands)
+
+
+def tile_views(img, tile_size, overlap=0):
+    """
+    Splits an image (H, W, C) into tiles without copying, every tile is a view into img.
+
+    :return: list of (tile_id, (y_min, x_min, y_max, x_max), tile)
+    :rtype: list
+    """
+    return [
+        (tile_id, bbox, img[bbox[0]:bbox[2], bbox[1]:bbox[3]])
+        for tile_id, bbox in tile_grid(img.shape[0], img.shape[1], tile_size, overlap)
+    ]
+
+
+def is_blank_tile(tile, ink_threshold=200, min_ink_ratio=0.0001):
+    """
+    Cheap pre-filter for sparse drawings: a tile counts as blank (no ink), if less than min_ink_ratio of its pixels
+    are darker than ink_threshold. A pixel is dark, if its darkest channel is below the threshold.
+
+    :param ink_threshold: gray value (0 - 255) below which a pixel counts as ink
+    :param min_ink_ratio: minimal share of ink pixels for a tile to be processed, 0 disables the filter
+    :rtype: bool
+    """
+    if min_ink_ratio <= 0:
+        return False
+    if tile.size == 0:
+        return True
+
+    darkest = tile.min(axis=2) if tile.ndim == 3 else tile
+    ink_pixels = np.count_nonzero(darkest < ink_threshold)
+    return ink_pixels < min_ink_ratio * darkest.size
+
+
+def tile_hash(tile):
+    """
+    Exact hash of the tile pixels (and shape), tiles of a view are hashed row by row without copying.
+
+    :rtype: str
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(repr((tile.shape, tile.dtype.str)).encode())
+    if tile.flags.c_contiguous:
+        digest.update(tile.data)
+    else:
+        for row in tile:
+            digest.update(np.ascontiguousarray(row).data)
+    return digest.hexdigest()
@@ -97,7 +97,7 @@ class ProjectAdmin(admin.ModelAdmin):
     list_display = ["id", 'name', 'ai_model_name', 'status', 'user_name', 'created_at', 'updated_at']
 
     # for detailed view
-    fields = ['id', "name", "description", 'ai_model_name', 'status', 'user_name', 'created_at', 'updated_at']
+    fields = ['id', "name", "description", 'ai_model_name', 'inference_profile', 'status', 'user_name', 'created_at', 'updated_at']
     readonly_fields = ['id', 'ai_model_name', 'status', 'user_name', 'created_at', 'updated_at']
     inlines = [ImageInline]
 
@@ -237,7 +237,7 @@ class ResultSetAdmin(admin.ModelAdmin):
     list_per_page = 10
 
     list_select_related = ["project", "project__customer__user", "ai_model"]
-    list_filter = [ProjectNameFilterForResultSet, "project__customer__user", 'created_at']
+    list_filter = [ProjectNameFilterForResultSet, "project__customer__user", "ai_model", 'created_at']
     search_fields = ['project__name', "project__customer__user"]
 
     # for list_display
@@ -305,9 +305,16 @@ class ResultSetAdmin(admin.ModelAdmin):
         return False  # Prevent updating ResultSet from admin
 
 
+class InferenceProfileInline(admin.TabularInline):
+    model = models.InferenceProfile
+    fields = ["name", "augment", "tile_size", "conf_thres", "iou_thres", "batch_size"]
+    extra = 0
+
+
 @admin.register(models.AiModel)
 class AiModelAdmin(admin.ModelAdmin):
     list_display = ['name', 'description', 'created_at']
+    inlines = [InferenceProfileInline]
 
 
     list_filter = ['created_at', 'updated_at']
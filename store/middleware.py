@@ -0,0 +1,48 @@
+import time
+
+from django.db import connection
+
+from .utility.metrics import REQUEST_DB_QUERIES, REQUEST_DURATION
+
+
+class MetricsMiddleware:
+    """
+    Records the latency and the number of database queries of every request by view and DRF viewset action
+    (e.g. ProjectsViewSet / start), see utility/metrics.py.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = 0
+
+        def count_query(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        start = time.perf_counter()
+        with connection.execute_wrapper(count_query):
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+
+        view, action = self.view_and_action(request)
+        # requests which did not resolve to a view (404, static files) are not recorded
+        if view is not None:
+            REQUEST_DURATION.labels(view=view, action=action, method=request.method,
+                                    status=response.status_code).observe(duration)
+            REQUEST_DB_QUERIES.labels(view=view, action=action).observe(queries)
+        return response
+
+    @staticmethod
+    def view_and_action(request):
+        match = getattr(request, "resolver_match", None)
+        if match is None:
+            return None, None
+        func = match.func
+        # viewsets: the class and the mapping of http methods to actions (list, retrieve, start, ...)
+        view_class = getattr(func, "cls", None) or getattr(func, "view_class", None)
+        view = view_class.__name__ if view_class is not None else match.view_name
+        actions = getattr(func, "actions", None) or {}
+        return view, actions.get(request.method.lower(), request.method.lower())
@@ -1,6 +1,8 @@
 from django.core.validators import MinValueValidator
 from django.db import models
-from .utility.utilities import project_image_directory_path
+from django.utils import timezone
+from .utility import progress
+from .utility.utilities import file_sha256, project_image_directory_path
 from django.conf import settings
 from django.contrib import admin
 import os
@@ -62,6 +64,46 @@ class AiModel(models.Model):
         db_table = "ai_model"
 
 
+# named inference settings (speed / accuracy trade-off) of an ai model, selected per project by name
+# names without a row here fall back to settings.AI_INFERENCE_PROFILES
+class InferenceProfile(models.Model):
+    ai_model = models.ForeignKey(AiModel, on_delete=models.CASCADE, related_name='inference_profiles')
+    name = models.CharField(max_length=50)  # e.g. fast, balanced, accurate
+    # test time augmentation, runs every tile through 3 scales (about 3x slower)
+    augment = models.BooleanField(default=True)
+    tile_size = models.PositiveIntegerField(default=640, validators=[MinValueValidator(32)])
+    # applied inside the nms, boxes below conf_thres are never materialized
+    conf_thres = models.FloatField(default=0.5)
+    iou_thres = models.FloatField(default=0.45)
+    batch_size = models.PositiveIntegerField(default=8, validators=[MinValueValidator(1)])
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def as_inference_settings(self):
+        # same keys as settings.AI_INFERENCE, merged into the cfg of every image
+        return {
+            "augment": self.augment,
+            "tile_size": self.tile_size,
+            "conf_thres": self.conf_thres,
+            "iou_thres": self.iou_thres,
+            "batch_size": self.batch_size,
+        }
+
+    @classmethod
+    def available_names(cls, ai_model_id):
+        # names of all profiles which can be selected for a project with this ai model
+        names = set(settings.AI_INFERENCE_PROFILES)
+        names.update(cls.objects.filter(ai_model_id=ai_model_id).values_list('name', flat=True))
+        return sorted(names)
+
+    def __str__(self) -> str:
+        return f"inference profile: {self.name}, ai-model id: {self.ai_model_id}"
+
+    class Meta:
+        db_table = "inference_profile"
+        unique_together = [['ai_model', 'name']]
+
+
 
 class Project(models.Model):
 
@@ -71,6 +113,7 @@ class Project(models.Model):
         ('PROCESSING', 'Processing'),
         ('COMPLETED', 'Completed'),
         ('FAILED', 'Failed'),
+        ('CANCELLED', 'Cancelled'),
     ]
 
     name = models.CharField(max_length=200)
@@ -79,6 +122,8 @@ class Project(models.Model):
     #  if the referenced AiModel is to be deleted, if any projects use this ai model, then this ai model can not be deleted
     ai_model = models.ForeignKey(AiModel, on_delete=models.PROTECT, null=True, related_name='projects')
     status = models.CharField(max_length=50, choices=STATUS_CHOICES, default='PENDING')  # Example: pending, processing, completed, failed
+    # name of the InferenceProfile (of the ai_model) or of settings.AI_INFERENCE_PROFILES used for this project
+    inference_profile = models.CharField(max_length=50, default='accurate')
     # if you delete a custiomer. and this customer has projects related, then you can not delete
     customer = models.ForeignKey(Customer, on_delete=models.PROTECT, related_name="projects")
     created_at = models.DateTimeField(auto_now_add=True)
@@ -106,12 +151,36 @@ class Project(models.Model):
         # Call the "real" delete() method to delete the object from the database
         super().delete(*args, **kwargs)
 
+    # the params hash (see ResultSet.params_hash) of the current inference settings of the project with its ai model
+    # (or another one), None if the inference profile of the project does not exist for the ai model
+    def current_params_hash(self, ai_model_id=None):
+        # imported here, both import the models
+        from store.utility.ai_utils import get_inference_settings
+        from store.utility.result_cache import get_params_hash
+
+        ai_model_id = self.ai_model_id if ai_model_id is None else ai_model_id
+        try:
+            inference = get_inference_settings(ai_model_id, self.inference_profile, self.customer_id)
+        except ValueError:
+            return None
+        return get_params_hash(ai_model_id, inference)
+
+    # after switching the ai model or the inference profile: an image has a result, if it has a result set of the
+    # current ai model and inference settings, these images are not processed again by start_rest
+    def update_has_result(self):
+        with_result = ResultSet.objects.filter(
+            project=self, ai_model_id=self.ai_model_id, params_hash=self.current_params_hash()
+        ).values('image_id')
+        Image.objects.filter(project=self, id__in=with_result).update(has_result=True)
+        Image.objects.filter(project=self).exclude(id__in=with_result).update(has_result=False)
+
     def update_status_based_on_images(self):
         unprocessed_images_exist = Image.objects.filter(project=self, has_result=False).exists()
         if unprocessed_images_exist and self.status == 'PROCESSING':  # Use named constants or direct string if STATUS_CHOICES is not an enum
             return
 
-        if self.status == 'FAILED':  # Use named constants or direct string if STATUS_CHOICES is not an enum
+        # a failed or cancelled project keeps its status until it is started again
+        if self.status in ['FAILED', 'CANCELLED']:  # Use named constants or direct string if STATUS_CHOICES is not an enum
             return
         elif unprocessed_images_exist:
             self.status = 'PENDING'  # 'PENDING'
@@ -140,9 +209,17 @@ class Image(models.Model):
 
     image_file = models.ImageField(upload_to=project_image_directory_path, validators=[simgle_image_size_vsalidator])
     has_result = models.BooleanField(default=False)
+    # sha256 of the uploaded file, identical drawings (e.g. re-uploads in other projects) reuse their results
+    content_hash = models.CharField(max_length=64, blank=True, default='', db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    def save(self, *args, **kwargs):
+        # hash the content once, when the file is uploaded
+        if self.image_file and not self.content_hash:
+            self.content_hash = file_sha256(self.image_file)
+        super().save(*args, **kwargs)
+
     """
     Override the delete() method in Image model: This method will be called whenever an Image object is deleted(whenever an image is deleted, I want also delete them locally)
     """
@@ -166,12 +243,8 @@ class Image(models.Model):
             else:
                 print(f"in models.py for model Image deleting image with image_id: {self.id}, image_name: {self.name} failed!!!")
 
-        # Delete corresponding ResultSet entry
-        try:
-            result_set = ResultSet.objects.get(image=self)
-            result_set.delete()
-        except ResultSet.DoesNotExist:
-            pass  # If ResultSet does not exist, no action needed
+        # Delete the ResultSet entries of all ai models
+        ResultSet.objects.filter(image=self).delete()
 
         # Call the "real" delete() method to delete the object from the database
         super().delete(*args, **kwargs)
@@ -191,9 +264,12 @@ class Image(models.Model):
         db_table = "image"
 
 class ResultSet(models.Model):
-    image = models.OneToOneField(Image, on_delete=models.CASCADE)
+    # one result set per image, ai model and parameters, the results of the other ai models of the image are kept
+    image = models.ForeignKey(Image, on_delete=models.CASCADE, related_name='resultSets')
     project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='resultSets')
     ai_model = models.ForeignKey(AiModel, on_delete=models.SET_NULL, null=True, related_name='resultSets')
+    # hash of the ai model and the inference settings the result was produced with (see utility/result_cache.py)
+    params_hash = models.CharField(max_length=64, blank=True, default='', db_index=True)
 
     result_detection = models.JSONField()
     result_recognition = models.JSONField()
@@ -203,6 +279,9 @@ class ResultSet(models.Model):
     text_recognition_image_path = models.CharField(max_length=500, blank=True, null=True)
     text_interpretation_image_path = models.CharField(max_length=500, blank=True, null=True)
 
+    # wall time, cpu time and peak rss of the pipeline stages and their parts, by name (see src/stage_timer.py)
+    timings = models.JSONField(default=dict, blank=True)
+
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -226,20 +305,75 @@ class ResultSet(models.Model):
         return None
 
     # nsure that the has_result field of the Image model is updated whenever a ResultSet is saved
+    # (only a result of the current ai model and inference settings of the project counts)
     def save(self, *args, **kwargs):
         super().save(*args, **kwargs)  # Save the ResultSet first
 
         # Check if there is a related image and update its has_result field
-        if self.image:
+        if (self.image and self.ai_model_id == self.project.ai_model_id
+                and self.params_hash == self.project.current_params_hash()):
             self.image.has_result = True
             self.image.save()  # Save the image with the updated has_result field
 
-
-
+    # the current result set of every image of the project: the one of its ai model (or another one) with the
+    # current inference settings of the project (one per image, see the unique constraint)
+    @classmethod
+    def latest_of_project(cls, project, ai_model_id=None):
+        ai_model_id = project.ai_model_id if ai_model_id is None else ai_model_id
+        return cls.objects.filter(
+            project_id=project.id, ai_model_id=ai_model_id, params_hash=project.current_params_hash(ai_model_id)
+        )
 
     def __str__(self) -> str:
         return f"result_set id: {self.id}"
 
     class Meta:
         db_table = "result_set"
+        constraints = [
+            models.UniqueConstraint(fields=['image', 'ai_model', 'params_hash'], name='unique_result_set_per_model'),
+        ]
+
 
+
+# a run of the ai models on (some) images of a project, started by /projects/{id}/start or /start_rest
+# only one run of a project is RUNNING at a time, the task ids are kept to cancel the run
+class ProjectRun(models.Model):
+
+    STATUS_CHOICES = [
+        ('RUNNING', 'Running'),
+        ('FINISHED', 'Finished'),
+        ('CANCELLED', 'Cancelled'),
+    ]
+
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='runs')
+    status = models.CharField(max_length=50, choices=STATUS_CHOICES, default='RUNNING')
+    image_ids = models.JSONField(default=list)
+    task_ids = models.JSONField(default=list)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    # a RUNNING run is finished once all its images are done or failed (see utility/progress.py), or if it is older
+    # than AI_RUN_TIMEOUT (e.g. its workers were killed), so that the project can be started again
+    def update_status(self):
+        if self.status != 'RUNNING':
+            return
+        run_progress = progress.get_progress(self.project_id)
+        timed_out = (timezone.now() - self.created_at).total_seconds() > settings.AI_RUN_TIMEOUT
+        if run_progress is None or run_progress["finished"] or timed_out:
+            self.status = 'FINISHED'
+            self.finished_at = timezone.now()
+            self.save(update_fields=["status", "finished_at"])
+
+    # the RUNNING run of the project (None if there is none), the caller should hold a lock on the project row
+    @classmethod
+    def get_active(cls, project_id):
+        run = cls.objects.filter(project_id=project_id, status='RUNNING').order_by('-created_at').first()
+        if run is not None:
+            run.update_status()
+        return run if run is not None and run.status == 'RUNNING' else None
+
+    def __str__(self) -> str:
+        return f"project run id: {self.id}, project: {self.project_id}, status: {self.status}"
+
+    class Meta:
+        db_table = "project_run"
@@ -1,3 +1,4 @@
+from django.conf import settings
 from rest_framework.permissions import IsAuthenticated, BasePermission, SAFE_METHODS
 
 # here DIY Permission
@@ -12,3 +13,11 @@ class IsAdminOrReadOnly(BasePermission):
             return request.user and request.user.is_authenticated
         # this means if "request.user" is set, then check "request.user.is_staff(means it can logi in the admin pannel)", -----> means it is admin
         return bool(request.user and request.user.is_staff)
+
+
+# the metrics are for the prometheus server (settings.METRICS_ALLOWED_IPS) and the admins only
+class IsAdminOrMetricsScraper(BasePermission):
+    def has_permission(self, request, view):
+        if request.META.get("REMOTE_ADDR") in settings.METRICS_ALLOWED_IPS:
+            return True
+        return bool(request.user and request.user.is_staff)
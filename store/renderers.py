@@ -0,0 +1,14 @@
+from rest_framework.renderers import BaseRenderer
+
+
+class EventStreamRenderer(BaseRenderer):
+    """
+    Lets DRF accept requests for server-sent events (Accept: text/event-stream), the view streams the events itself.
+    """
+    media_type = "text/event-stream"
+    format = "event-stream"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # only used for error responses of the streaming views
+        return f"event: error\ndata: {data}\n\n".encode()
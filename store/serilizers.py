@@ -1,14 +1,31 @@
+from django.conf import settings
 from rest_framework import serializers
-from .models import Customer, AiModel, Project, Image, ResultSet
+from .models import Customer, AiModel, InferenceProfile, Project, Image, ResultSet
 from django.db import transaction
 from core.serializers import UserSerializer, DetailUserSerializer
 
 
+class InferenceProfileModelSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = InferenceProfile
+        fields = ["id", "name", "augment", "tile_size", "conf_thres", "iou_thres", "batch_size"]
+
+
 # SLizer for AI
 class AisModelSerilizer(serializers.ModelSerializer):
     class Meta:
         model = AiModel
-        fields = ["id", "name", "description"]
+        fields = ["id", "name", "description", "inference_profiles"]
+
+    inference_profiles = InferenceProfileModelSerializer(many=True, read_only=True)
+
+
+# a project can only use a profile known for its ai model (stored profile or settings.AI_INFERENCE_PROFILES)
+def validate_inference_profile_for_ai_model(inference_profile, ai_model_id):
+    if inference_profile not in InferenceProfile.available_names(ai_model_id):
+        raise serializers.ValidationError(
+            {"inference_profile": f"Unknown inference profile {inference_profile} for ai_model {ai_model_id}"}
+        )
 
 
 
@@ -46,7 +63,7 @@ class ImageModelSerializer(serializers.ModelSerializer):
 class ProjectsModelSerilizer(serializers.ModelSerializer):
     class Meta:
         model = Project
-        fields = ["id", "name", "description", "ai_model_id", "customer_id", "customer_username", "status", "images_nr", "images", "created_at", "updated_at"]
+        fields = ["id", "name", "description", "ai_model_id", "inference_profile", "customer_id", "customer_username", "status", "images_nr", "images", "created_at", "updated_at"]
 
     ai_model_id = serializers.IntegerField()
     customer_id = serializers.IntegerField()
@@ -63,7 +80,7 @@ class ProjectsModelSerilizer(serializers.ModelSerializer):
 class CreateProjectsModelSerilizer(serializers.ModelSerializer):
     class Meta:
         model = Project
-        fields = ["id", "name", "description", "ai_model_id"]
+        fields = ["id", "name", "description", "ai_model_id", "inference_profile"]
 
     ai_model_id = serializers.PrimaryKeyRelatedField(
         queryset=AiModel.objects.all(),
@@ -75,6 +92,12 @@ class CreateProjectsModelSerilizer(serializers.ModelSerializer):
             raise serializers.ValidationError("There is no ai_model in database")
         return value
 
+    def validate(self, attrs):
+        if 'inference_profile' in attrs:
+            ai_model = attrs.get('ai_model_id')
+            validate_inference_profile_for_ai_model(attrs['inference_profile'], getattr(ai_model, 'id', ai_model))
+        return attrs
+
     # get the "customer_id" from context passed from ViewSet to create a new project
     def create(self, validated_data):
         # get the customer_id
@@ -89,10 +112,21 @@ class CreateProjectsModelSerilizer(serializers.ModelSerializer):
 class UpdateProjectsModelSerilizer(serializers.ModelSerializer):
     class Meta:
         model = Project
-        fields = ['name', 'description', 'ai_model_id']
+        fields = ['name', 'description', 'ai_model_id', 'inference_profile']
 
     ai_model_id = serializers.IntegerField()
 
+    def validate(self, attrs):
+        ai_model_id = attrs.get('ai_model_id', self.instance.ai_model_id if self.instance else None)
+        if 'inference_profile' in attrs:
+            validate_inference_profile_for_ai_model(attrs['inference_profile'], ai_model_id)
+        elif self.instance and 'ai_model_id' in attrs:
+            # the stored profile of the project may only exist for its old ai model, the project falls back to the
+            # default profile then
+            if self.instance.inference_profile not in InferenceProfile.available_names(ai_model_id):
+                attrs['inference_profile'] = settings.AI_DEFAULT_INFERENCE_PROFILE
+        return attrs
+
 
 
 
@@ -121,9 +155,9 @@ class ResultSetModelSerializer(serializers.ModelSerializer):
     class Meta:
         model = ResultSet
         fields = [
-            'id', 'project_id', 'image_id', 'ai_model_id',
+            'id', 'project_id', 'image_id', 'ai_model_id', 'params_hash',
             'text_detection_image_url', 'text_recognition_image_url', 'text_interpretation_image_url',
-            'result_detection', 'result_recognition', 'result_interpretation',
+            'result_detection', 'result_recognition', 'result_interpretation', 'timings',
             'created_at', 'updated_at'
         ]
 
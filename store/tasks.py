@@ -4,81 +4,382 @@ for the celery tasks
 """
 
 # tasks.py
-from celery import shared_task
-from .utility.ai_utils import prepare_cfg, run_ai_model
+from celery import chain, chord, shared_task
+from celery.signals import worker_process_init
+from .utility.ai_utils import (get_inference_settings, get_model_cache_stats, get_results_dir, prepare_cfg,
+                               prepare_project_cfg, run_ai_model, run_ai_stage, warm_up_models)
+from .utility.result_cache import (find_cached_result_set, get_params_hash, link_file, record_lookup,
+                                   rename_image_in_result)
+from .utility.metrics import forget_project, record_process_image, start_metrics_server, task_in_flight
+from .utility.stage_timings import share_of_batch
+from .utility import progress
 from .models import Image, ResultSet, Project
+from src.stage_timer import StageTimer
 from django.conf import settings
+from django.db import transaction
 import os
-import json
+from uuid import uuid4
 
 
 
+# every worker process serves its metrics (prometheus text format) on its own port
+@worker_process_init.connect
+def serve_metrics(**kwargs):
+    if settings.METRICS_WORKER_PORT is None:
+        return
+    port = start_metrics_server(settings.METRICS_WORKER_PORT, address=settings.METRICS_WORKER_ADDRESS)
+    if port is None:
+        print(f"no free port for the metrics of worker process {os.getpid()}")
+    else:
+        print(f"metrics of worker process {os.getpid()} on port {port}")
+
+
+# load the ai models once per worker process, every task reuses them afterwards
+@worker_process_init.connect
+def load_ai_models(**kwargs):
+    if not settings.AI_WARM_UP_MODELS:
+        return
+    try:
+        stats = warm_up_models()
+        print(f"ai models are resident in worker process {os.getpid()}: {stats}")
+    except Exception as e:
+        # the tasks will load the models on first use instead
+        print(f"warming up the ai models failed: {e}")
+
 
 @shared_task
 def process_image(project_id, image_id, ai_model_id):
+    with task_in_flight(project_id):
+        return _process_image(project_id, image_id, ai_model_id)
+
+
+def _process_image(project_id, image_id, ai_model_id):
     # Retrieve the image instance
     image = Image.objects.get(id=image_id)
     project = Project.objects.get(id=project_id)
     image_name = image.name  # the image_name here is with extensions
-    image_old_name = image.old_name
-    image_file_path = image.image_url()
-    image_base_name = os.path.splitext(image_name)[0]
+    progress.set_image_status(project_id, image_id, progress.PROCESSING)
+
+    # an identical drawing (same content hash) processed with the same ai model and parameters is not processed again,
+    # its results are reused and its visual results are hardlinked
+    timings = {}
+    params_hash = None
+    visual_paths = NO_VISUAL_PATHS
+    result_cache_hit = False
+    try:
+        with StageTimer(timings, "result_cache"):
+            params_hash = get_params_hash(ai_model_id, get_inference_settings(ai_model_id, project.inference_profile, project.customer_id))
+            visual_paths = get_visual_paths(project_id, image_name, get_results_dir(ai_model_id, params_hash))
+            ai_results = reuse_cached_result(image, ai_model_id, params_hash, visual_paths)
+        result_cache_hit = ai_results is not None
+
+        if not result_cache_hit:
+            cfg_file_path = prepare_cfg(project_id, image_name, ai_model_id, project.inference_profile, project.customer_id)
+            # the results of the 3 stages, None if the processing failed
+            ai_results = run_ai_model(
+                cfg_file_path,
+                on_stage=lambda stage: progress.set_image_status(project_id, image_id, progress.PROCESSING, stage)
+            )
+            if ai_results is not None:
+                timings.update(ai_results.pop("timings", {}))
+    except Exception as e:
+        # e.g. an unknown inference profile: the image fails like a failed processing instead of staying "processing"
+        print(f"preparing the processing of image {image_id} in project {project_id} failed: {e}")
+        ai_results = None
+
+    return save_image_results(project, image, ai_model_id, params_hash, visual_paths, ai_results, timings,
+                              result_cache_hit)
+
+
+# processes several images of a project at once (see AI_EXECUTION_MODE): the cfg and the models are set up once, the
+# tiles and snippets of all images go through the detector and the recognizer in shared batches, and the result sets
+# of all images are written in one transaction
+@shared_task
+def process_project(project_id, image_ids, ai_model_id):
+    with task_in_flight(project_id):
+        return _process_project(project_id, image_ids, ai_model_id)
+
+
+def _process_project(project_id, image_ids, ai_model_id):
+    project = Project.objects.get(id=project_id)
+    images = list(Image.objects.filter(project_id=project_id, id__in=image_ids).order_by("id"))
+    for image in images:
+        progress.set_image_status(project_id, image.id, progress.PROCESSING)
+
+    # identical drawings are taken from the result cache, only the others are processed
+    timings = {image.id: {} for image in images}
+    ai_results = {image.id: None for image in images}
+    params_hash = None
+    visual_paths = {image.id: NO_VISUAL_PATHS for image in images}
+    cache_hits = set()
+    try:
+        params_hash = get_params_hash(ai_model_id, get_inference_settings(ai_model_id, project.inference_profile, project.customer_id))
+        results_dir = get_results_dir(ai_model_id, params_hash)
+        visual_paths = {image.id: get_visual_paths(project_id, image.name, results_dir) for image in images}
+        for image in images:
+            with StageTimer(timings[image.id], "result_cache"):
+                ai_results[image.id] = reuse_cached_result(image, ai_model_id, params_hash, visual_paths[image.id])
+        cache_hits = {image_id for image_id, results in ai_results.items() if results is not None}
+
+        rest = [image for image in images if image.id not in cache_hits]
+
+        def on_stage(stage):
+            for image in rest:
+                progress.set_image_status(project_id, image.id, progress.PROCESSING, stage)
+
+        if rest:
+            cfg_file_path = prepare_project_cfg(project_id, [image.name for image in rest], ai_model_id,
+                                                project.inference_profile, project.customer_id,
+                                                batch_name=f"batch_{rest[0].id}")
+            # the results of the 3 stages for all images, None if the processing failed
+            batch_results = run_ai_model(cfg_file_path, on_stage=on_stage)
+            if batch_results is not None:
+                batch_timings = share_of_batch(batch_results.pop("timings", {}), len(rest))
+                for image in rest:
+                    # every stage result is keyed by the image name
+                    ai_results[image.id] = {
+                        stage: {image.name: stage_result[image.name]}
+                        for stage, stage_result in batch_results.items() if image.name in stage_result
+                    }
+                    timings[image.id].update(batch_timings)
+    except Exception as e:
+        # e.g. an unknown inference profile: the images which are not taken from the result cache fail like a failed
+        # processing instead of staying "processing"
+        print(f"preparing the processing of the images {image_ids} in project {project_id} failed: {e}")
+        ai_results = {image_id: results if image_id in cache_hits else None for image_id, results in ai_results.items()}
+
+    with transaction.atomic():
+        images_data = [
+            save_image_results(project, image, ai_model_id, params_hash, visual_paths[image.id], ai_results[image.id],
+                               timings[image.id], image.id in cache_hits)
+            for image in images
+        ]
+
+    return {
+        "project_id": project_id,
+        "success": all(image_data["success"] for image_data in images_data),
+        "images": images_data,
+    }
+
+
+# ---- STAGE PIPELINE ----
+# AI_EXECUTION_MODE "pipeline": every image runs through a chain of one task per stage, every task is routed to the
+# queue of its stage (see CELERY_TASK_ROUTES), so that the worker pools can be sized per stage and the stages of
+# different images overlap. The tasks hand over a json payload: the ids, the cfg, the timings and the pipeline state
+# without the decoded drawing (PipelineState.to_dict), "state" is None once a stage failed.
+
+@shared_task
+def detect_text(project_id, image_id, ai_model_id):
+    image = Image.objects.get(id=image_id)
+    project = Project.objects.get(id=project_id)
+    payload = {
+        "project_id": project_id,
+        "image_id": image_id,
+        "ai_model_id": ai_model_id,
+        "cfg_path": None,
+        "params_hash": None,
+        "timings": {},
+        "result_cache_hit": False,
+        "state": None,
+    }
+
+    # an identical drawing is not processed again, the later stages pass its results on
+    # a failure (e.g. an unknown inference profile) is handed on like a failed stage, so that persist_results records
+    # it and the chord callback still finalizes the project
+    try:
+        with StageTimer(payload["timings"], "result_cache"):
+            payload["params_hash"] = get_params_hash(
+                ai_model_id, get_inference_settings(ai_model_id, project.inference_profile, project.customer_id)
+            )
+            ai_results = reuse_cached_result(image, ai_model_id, payload["params_hash"], get_visual_paths(
+                project_id, image.name, get_results_dir(ai_model_id, payload["params_hash"])
+            ))
+    except Exception as e:
+        print(f"preparing the processing of image {image_id} in project {project_id} failed: {e}")
+        progress.set_image_status(project_id, image_id, progress.FAILED)
+        return payload
+    if ai_results is not None:
+        payload["result_cache_hit"] = True
+        payload["state"] = {"data": {}, "results": ai_results, "timings": {}, "debug": False}
+        return payload
+
+    progress.set_image_status(project_id, image_id, progress.PROCESSING, "text_detection")
+    with task_in_flight(project_id):
+        try:
+            payload["cfg_path"] = prepare_cfg(project_id, image.name, ai_model_id, project.inference_profile,
+                                              project.customer_id)
+            payload["state"] = run_ai_stage("text_detection", payload["cfg_path"])
+        except Exception as e:
+            print(f"preparing the cfg of image {image_id} in project {project_id} failed: {e}")
+            progress.set_image_status(project_id, image_id, progress.FAILED)
+    return payload
+
+
+def run_next_stage(payload, stage):
+    # stages after a failed stage or of a reused result do nothing
+    if payload["state"] is None or payload["result_cache_hit"]:
+        return payload
+    progress.set_image_status(payload["project_id"], payload["image_id"], progress.PROCESSING, stage)
+    with task_in_flight(payload["project_id"]):
+        payload["state"] = run_ai_stage(stage, payload["cfg_path"], payload["state"])
+    return payload
+
+
+@shared_task
+def recognize_text(payload):
+    return run_next_stage(payload, "text_recognition")
+
+
+@shared_task
+def interpret_text(payload):
+    return run_next_stage(payload, "text_interpretation")
+
+
+@shared_task
+def persist_results(payload):
+    project = Project.objects.get(id=payload["project_id"])
+    image = Image.objects.get(id=payload["image_id"])
+    state = payload["state"]
+    timings = dict(payload["timings"], **(state["timings"] if state is not None else {}))
+    visual_paths = NO_VISUAL_PATHS if payload["params_hash"] is None else get_visual_paths(
+        project.id, image.name, get_results_dir(payload["ai_model_id"], payload["params_hash"])
+    )
+    return save_image_results(
+        project, image, payload["ai_model_id"], payload["params_hash"], visual_paths,
+        state["results"] if state is not None else None,
+        timings, payload["result_cache_hit"]
+    )
+
+
+def dispatch_pipeline(project_id, image_ids, ai_model_id):
+    # one chain per image, the project status is finalized once all chains are done
+    # the task ids are set here, so that all tasks of the chains can be revoked (see ProjectRun)
+    chains = []
+    task_ids = []
+    for image_id in image_ids:
+        signatures = [detect_text.s(project_id, image_id, ai_model_id), recognize_text.s(), interpret_text.s(),
+                      persist_results.s()]
+        for signature in signatures:
+            task_ids.append(str(uuid4()))
+            signature.set(task_id=task_ids[-1])
+        chains.append(chain(*signatures))
+    workflow = chord(chains)(update_project_status.si(project_id, True))
+    return task_ids + [workflow.id]
+
+
+# splits the images of a project into tasks: process_project tasks of AI_PROJECT_CHUNK_SIZE images, or one
+# process_image task per image (AI_EXECUTION_MODE "image", or projects with more than AI_PROJECT_MAX_BATCHED_IMAGES
+# images, which are spread over all workers instead), or one chain of stage tasks per image (AI_EXECUTION_MODE
+# "pipeline"); returns the ids of all tasks
+# new_run=False: the images are added to the running run of the project
+def dispatch_processing(project_id, image_ids, ai_model_id, new_run=True):
+    image_ids = list(image_ids)
+    if new_run:
+        progress.start_run(project_id, image_ids)
+    else:
+        progress.extend_run(project_id, image_ids)
+    if settings.AI_EXECUTION_MODE == "pipeline":
+        return dispatch_pipeline(project_id, image_ids, ai_model_id)
+    if settings.AI_EXECUTION_MODE == "image" or len(image_ids) > settings.AI_PROJECT_MAX_BATCHED_IMAGES:
+        return [process_image.delay(project_id, image_id, ai_model_id).id for image_id in image_ids]
+
+    chunk_size = max(1, settings.AI_PROJECT_CHUNK_SIZE)
+    return [
+        process_project.delay(project_id, image_ids[start:start + chunk_size], ai_model_id).id
+        for start in range(0, len(image_ids), chunk_size)
+    ]
+
+
+# the visual paths of an image which failed before its parameters were known (no result set is written for it)
+NO_VISUAL_PATHS = (None, None, None)
+
+
+# relative paths (below MEDIA_ROOT) of the visual results of an image: detection, recognition, interpretation
+# (results_dir: the dir of the ai model and parameters, see get_results_dir)
+def get_visual_paths(project_id, image_name, results_dir):
+    base_output_path_relative = os.path.join('outputs', f'project_{project_id}', os.path.splitext(image_name)[0],
+                                             results_dir)
+    return tuple(
+        os.path.join(base_output_path_relative, stage, 'final', 'visual', image_name)
+        for stage in ['text_detection', 'text_recognition', 'text_interpretation']
+    )
+
+
+# the results of an identical drawing (same content hash, ai model and parameters) for the image, its visual results
+# are hardlinked to the paths of the image; None if there is no such result
+def reuse_cached_result(image, ai_model_id, params_hash, visual_paths):
+    cached_result_set = find_cached_result_set(image, ai_model_id, params_hash)
+    ai_results = None
+    if cached_result_set is not None:
+        try:
+            cached_image_name = cached_result_set.image.name
+            detection_image_relative_path, recognition_image_relative_path, interpretation_image_relative_path = visual_paths
+            link_file(cached_result_set.text_detection_image_path, detection_image_relative_path)
+            link_file(cached_result_set.text_recognition_image_path, recognition_image_relative_path)
+            link_file(cached_result_set.text_interpretation_image_path, interpretation_image_relative_path)
+            ai_results = {
+                "text_detection": rename_image_in_result(cached_result_set.result_detection, cached_image_name, image.name),
+                "text_recognition": rename_image_in_result(cached_result_set.result_recognition, cached_image_name, image.name),
+                "text_interpretation": rename_image_in_result(cached_result_set.result_interpretation, cached_image_name, image.name),
+            }
+        except OSError as e:
+            print(f"reusing the result of image {cached_result_set.image_id} failed, processing again: {e}")
+    record_lookup(hit=ai_results is not None)
+    return ai_results
+
 
-    cfg_file_path = prepare_cfg(project_id, image_name, ai_model_id)
-    # the ai result will be a boolean, True
-    ai_processing_successful = run_ai_model(cfg_file_path)
+# saves the result set of a processed image (ai_results is None if the processing failed), returns the task result
+def save_image_results(project, image, ai_model_id, params_hash, visual_paths, ai_results, timings, result_cache_hit):
+    project_id = project.id
+    image_id = image.id
+    image_name = image.name
+    detection_image_relative_path, recognition_image_relative_path, interpretation_image_relative_path = visual_paths
+    ai_processing_successful = ai_results is not None
 
     # Ergebnis-Dictionary vorbereiten
     result_data = {
         "image_id": image_id,
         "image_info": {
             "name": image_name,
-            "old_name": image_old_name,
-            "image_url": image_file_path
+            "old_name": image.old_name,
+            "image_url": image.image_url()
         },
         "success": ai_processing_successful,
-        "error_msg": ""
+        "error_msg": "",
+        # hits/misses/load time of the resident models, a miss here means this task paid the cold-load cost
+        "model_cache": get_model_cache_stats(),
+        # the result of an identical drawing was reused
+        "result_cache": "hit" if result_cache_hit else "miss"
     }
 
     if ai_processing_successful:
-        base_output_path_relative = os.path.join('outputs', f'project_{project_id}', image_base_name)
-        detection_image_relative_path = os.path.join(base_output_path_relative, 'text_detection', 'final', 'visual', image_name)
-        recognition_image_relative_path = os.path.join(base_output_path_relative, 'text_recognition', 'final', 'visual', image_name)
-        interpretation_image_relative_path = os.path.join(base_output_path_relative, 'text_interpretation', 'final', 'visual', image_name)
-        # Construct paths for the processed JSON results
-        base_output_path = os.path.join(settings.MEDIA_ROOT, 'outputs', f'project_{project_id}', image_base_name)
-        # Load JSON results
-        detection_json_path = os.path.join(base_output_path, 'text_detection', 'final', 'results.json')
-        recognition_json_path = os.path.join(base_output_path, 'text_recognition', 'final', 'results.json')
-        interpretation_json_path = os.path.join(base_output_path, 'text_interpretation', 'final', 'floor.json')
-
-        # Check if all 3 JSON files exist, if all exists then means the processing is done[actually if the interpretation_json_path exists, then it means it is done]
-        if os.path.exists(detection_json_path) and os.path.exists(recognition_json_path) and os.path.exists(interpretation_json_path):
-            with open(detection_json_path, 'r') as file:
-                detection_result = json.load(file)
-            with open(recognition_json_path, 'r') as file:
-                recognition_result = json.load(file)
-            with open(interpretation_json_path, 'r') as file:
-                interpretation_result = json.load(file)
-
-            # check if the result with the image_id already exists or not, if yes, then update the old tuple:
+        # the stages hand over their results in memory, only the visual results are written to disk
+        detection_result = ai_results.get("text_detection")
+        recognition_result = ai_results.get("text_recognition")
+        interpretation_result = ai_results.get("text_interpretation")
 
+        # Check if all 3 results exist, if all exists then means the processing is done
+        if detection_result is not None and recognition_result is not None and interpretation_result is not None:
+            # one result set per image, ai model and parameters: the result of the same model and parameters is
+            # updated, the results of the other models are kept (switching back to a model reuses them)
             result_set, created = ResultSet.objects.update_or_create(
                 image_id=image_id,
+                ai_model_id=ai_model_id,
+                params_hash=params_hash,
                 defaults={
                     "project_id": project_id,
-                    "ai_model_id": ai_model_id,
                     "result_detection": detection_result,
                     "result_recognition": recognition_result,
                     "result_interpretation": interpretation_result,
                     "text_detection_image_path": detection_image_relative_path,
                     "text_recognition_image_path": recognition_image_relative_path,
                     "text_interpretation_image_path": interpretation_image_relative_path,
+                    "timings": timings,
                 }
             )
 
         else:
-            result_data["error_msg"] = f"The singe processing succeeds for image with name: {image_name}, in project with project id: {project_id}, but not all 3 json files are produced"
+            result_data["error_msg"] = f"The singe processing succeeds for image with name: {image_name}, in project with project id: {project_id}, but not all 3 results are produced"
             result_data["success"] = False
     else:
         # set the status of project to Failed
@@ -87,14 +388,21 @@ def process_image(project_id, image_id, ai_model_id):
         result_data["error_msg"] = f"The singe processing failed for image with name: {image_name}, in project with project id: {project_id}, this image can not be processed, please delete this image of this project and upload a new one and try again"
         result_data["success"] = False
 
+    progress.set_image_status(project_id, image_id, progress.DONE if result_data["success"] else progress.FAILED)
+    record_process_image(result_data, timings, ai_results)
     return result_data
 
 
 
 
-# currently not in use
+# chord callback of the stage pipeline: finalizes the project status once all images are done
+# (finished=True: the run is over, a project which is still PROCESSING gets the status of its images)
 @shared_task
-def update_project_status(project_id):
+def update_project_status(project_id, finished=False):
+    if finished:
+        forget_project(project_id)
     project = Project.objects.get(id=project_id)
+    if finished and project.status == Project.STATUS_CHOICES[1][0]:  # 'PROCESSING'
+        project.status = Project.STATUS_CHOICES[0][0]  # 'PENDING'
     # update the project status
     project.update_status_based_on_images()
\ No newline at end of file
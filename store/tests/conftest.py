@@ -7,6 +7,16 @@ from model_bakery import baker
 from store.models import AiModel, Project, ResultSet, Image
 from django.conf import settings
 
+@pytest.fixture(autouse=True)
+def locmem_cache(settings):
+    # the tests do not need a running redis
+    settings.CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    from django.core.cache import cache
+    cache.clear()
+    yield
+    cache.clear()
+
+
 @pytest.fixture
 def api_client():
     return APIClient()
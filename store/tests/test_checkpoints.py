@@ -0,0 +1,142 @@
+# store/tests/test_checkpoints.py
+from pathlib import Path
+
+import cv2
+import numpy as np
+import pytest
+
+from src import checkpoints
+from src.checkpoints import STAGES, StageCheckpoints, stage_keys
+from src.disk_cache import DiskCache
+from src.pipeline_state import PipelineState
+
+
+@pytest.fixture(autouse=True)
+def recognizer(monkeypatch):
+    # the identity of the recognizer weights, without torch
+    identity = {"model": "parseq", "weights": "digest-1"}
+    monkeypatch.setattr(checkpoints, "recognizer_identity", lambda: dict(identity))
+    return identity
+
+
+@pytest.fixture
+def cfg(tmp_path):
+    filenames = []
+    for name in ("plan_a.png", "plan_b.png"):
+        filename = str(tmp_path / "input" / name)
+        Path(filename).parent.mkdir(exist_ok=True)
+        cv2.imwrite(filename, np.full((20, 20, 3), len(filenames) * 100, dtype=np.uint8))
+        filenames.append(filename)
+    (tmp_path / "rules.yaml").write_text("[]")
+    return {
+        "input": {"images": filenames, "model": str(tmp_path / "best.pt")},
+        "inference": {"tile_size": 640, "room_stamp_rules": str(tmp_path / "rules.yaml")},
+        "paths": {stage: {"final_visual_path": str(tmp_path / stage)} for stage in STAGES},
+    }
+
+
+def fake_stage_runners(cfg, calls):
+    # the stages write their visual result and hand over their data like the localizer, recognizer and interpreter
+    def run(stage):
+        def run_stage(state, filenames):
+            calls.append((stage, sorted(Path(filename).name for filename in filenames)))
+            for filename in filenames:
+                name = Path(filename).name
+                if stage == "text_detection":
+                    state.images[name] = cv2.imread(filename)
+                    state.data[name] = {"elements": [{"bbox_xyxy_abs": [0, 0, 4, 4]}], "meta": {"tiles": 1}}
+                elif stage == "text_recognition":
+                    state.data[name]["elements"][0]["text"] = "2.27"
+                visual_path = Path(cfg["paths"][stage]["final_visual_path"], name)
+                visual_path.parent.mkdir(exist_ok=True)
+                cv2.imwrite(str(visual_path), state.images[name])
+            if stage == "text_interpretation":
+                state.finish_stage(stage, {name: [{"code": state.data[name]["elements"][0]["text"]}]
+                                           for name in state.data})
+            else:
+                state.finish_stage(stage)
+        return run_stage
+
+    return {stage: run(stage) for stage in STAGES}
+
+
+def run_pipeline(cfg, cache, calls):
+    stage_runners = fake_stage_runners(cfg, calls)
+    state = PipelineState()
+    stage_checkpoints = StageCheckpoints(cfg, cfg["input"]["images"], cache)
+    for stage in STAGES:
+        stage_checkpoints.run(stage, state, stage_runners[stage])
+    return state
+
+
+class TestStageCheckpoints:
+
+    def test_unchanged_rerun_restores_every_stage(self, cfg, tmp_path):
+        cache = DiskCache(tmp_path / "checkpoints.sqlite3")
+        first = run_pipeline(cfg, cache, [])
+        visual_path = Path(cfg["paths"]["text_recognition"]["final_visual_path"], "plan_a.png")
+        visual_path.unlink()
+
+        calls = []
+        second = run_pipeline(cfg, cache, calls)
+
+        assert calls == []
+        assert second.results["text_interpretation"] == first.results["text_interpretation"]
+        assert second.results["text_recognition"]["plan_b.png"]["meta"] == {"tiles": 1, "checkpoint": True}
+        # the visual results are written again, the drawings are not even decoded
+        assert visual_path.is_file()
+        assert second.images == {}
+
+    def test_changed_interpretation_rules_only_rerun_the_interpretation(self, cfg, tmp_path):
+        cache = DiskCache(tmp_path / "checkpoints.sqlite3")
+        run_pipeline(cfg, cache, [])
+        Path(cfg["inference"]["room_stamp_rules"]).write_text("- {field: code, pattern: '^x$'}")
+
+        calls = []
+        state = run_pipeline(cfg, cache, calls)
+
+        assert calls == [("text_interpretation", ["plan_a.png", "plan_b.png"])]
+        assert state.results["text_interpretation"]["plan_a.png"] == [{"code": "2.27"}]
+
+    def test_changed_recognizer_keeps_the_detection(self, cfg, tmp_path, recognizer):
+        cache = DiskCache(tmp_path / "checkpoints.sqlite3")
+        run_pipeline(cfg, cache, [])
+        # other weights in the checkpoint file of the recognizer
+        recognizer["weights"] = "digest-2"
+
+        calls = []
+        run_pipeline(cfg, cache, calls)
+
+        assert [stage for stage, _ in calls] == ["text_recognition", "text_interpretation"]
+
+    def test_changed_drawing_only_reruns_that_drawing(self, cfg, tmp_path):
+        cache = DiskCache(tmp_path / "checkpoints.sqlite3")
+        run_pipeline(cfg, cache, [])
+        cv2.imwrite(cfg["input"]["images"][1], np.full((20, 20, 3), 7, dtype=np.uint8))
+
+        calls = []
+        state = run_pipeline(cfg, cache, calls)
+
+        assert calls == [(stage, ["plan_b.png"]) for stage in STAGES]
+        assert list(state.results["text_interpretation"]) == ["plan_a.png", "plan_b.png"]
+
+    def test_detection_settings_invalidate_all_stages(self, cfg):
+        keys = stage_keys(cfg, cfg["input"]["images"][0])
+        cfg["inference"]["tile_size"] = 960
+        changed = stage_keys(cfg, cfg["input"]["images"][0])
+
+        assert all(keys[stage] != changed[stage] for stage in STAGES)
+
+    def test_snippet_memo_invalidates_the_recognition(self, cfg):
+        keys = stage_keys(cfg, cfg["input"]["images"][0])
+        cfg["inference"]["snippet_memo_max_entries"] = 0
+        changed = stage_keys(cfg, cfg["input"]["images"][0])
+
+        assert [keys[stage] != changed[stage] for stage in STAGES] == [False, True, True]
+
+    def test_without_checkpoint_file_every_stage_runs(self, cfg):
+        calls = []
+        run_pipeline(cfg, None, calls)
+        run_pipeline(cfg, None, calls)
+
+        assert [stage for stage, _ in calls] == list(STAGES) * 2
@@ -0,0 +1,85 @@
+# store/tests/test_clustering.py
+import json
+import os
+
+import numpy as np
+import pytest
+from django.conf import settings
+
+from src.clustering import clusters_from_labels, grid_cluster
+
+
+SAMPLE_RESULT_SET = os.path.join(
+    settings.BASE_DIR, "steps_example_project_19", "step4_get_result_set", "project_19_image_55.json"
+)
+
+
+def brute_force_clusters(points, eps):
+    # DBSCAN with min_samples=2: connected components of the eps graph, single points are noise
+    points = np.asarray(points, dtype=np.float64)
+    distances = np.sqrt(((points[:, None] - points[None]) ** 2).sum(axis=2))
+    labels = np.full(len(points), -1)
+    next_label = 0
+    for start in range(len(points)):
+        if labels[start] != -1 or (distances[start] <= eps).sum() < 2:
+            continue
+        labels[start] = next_label
+        stack = [start]
+        while stack:
+            point = stack.pop()
+            for neighbour in np.nonzero(distances[point] <= eps)[0]:
+                if labels[neighbour] == -1:
+                    labels[neighbour] = next_label
+                    stack.append(neighbour)
+        next_label += 1
+    return labels
+
+
+class TestGridCluster:
+
+    @pytest.mark.parametrize("seed", range(20))
+    def test_same_labels_as_brute_force(self, seed):
+        rng = np.random.default_rng(seed)
+        points = rng.uniform(0, 500, size=(150, 2)).round()
+        eps = rng.uniform(5, 40)
+
+        assert grid_cluster(points, eps).tolist() == brute_force_clusters(points, eps).tolist()
+
+    def test_noise_and_cluster_order(self):
+        points = [(100, 100), (0, 0), (3, 0), (103, 0), (6, 0), (100, 104)]
+
+        labels = grid_cluster(points, 5)
+
+        assert labels.tolist() == [0, 1, 1, -1, 1, 0]
+        assert [cluster.tolist() for cluster in clusters_from_labels(labels)] == [[0, 5], [1, 2, 4]]
+
+    def test_distance_equal_to_eps_is_connected(self):
+        assert grid_cluster([(0, 0), (3, 4)], 5).tolist() == [0, 0]
+
+    def test_eps_zero_connects_identical_points_only(self):
+        assert grid_cluster([(1, 1), (1, 1), (2, 1)], 0).tolist() == [0, 0, -1]
+
+    def test_empty_input(self):
+        assert grid_cluster(np.zeros((0, 2)), 10).tolist() == []
+        assert clusters_from_labels([]) == []
+
+    def test_sample_drawing(self):
+        with open(SAMPLE_RESULT_SET) as f:
+            recognition = json.load(f)["result_recognition"]
+        elements = next(iter(recognition.values()))["elements"]
+        boxes = np.array([element["bbox_xyxy_abs"] for element in elements], dtype=np.float64)
+        eps = np.mean(np.abs(boxes[:, 3] - boxes[:, 1])) * 2
+
+        labels = grid_cluster(boxes[:, :2], eps)
+
+        assert labels.tolist() == brute_force_clusters(boxes[:, :2], eps).tolist()
+        assert len(clusters_from_labels(labels)) == 46
+
+    def test_same_labels_as_sklearn_dbscan(self):
+        cluster = pytest.importorskip("sklearn.cluster")
+        rng = np.random.default_rng(0)
+        points = rng.uniform(0, 2000, size=(2000, 2))
+
+        expected = cluster.DBSCAN(eps=25, min_samples=2).fit(points).labels_
+
+        assert grid_cluster(points, 25).tolist() == expected.tolist()
@@ -0,0 +1,33 @@
+# store/tests/test_disk_cache.py
+import time
+
+from src.disk_cache import DiskCache
+
+
+class TestDiskCache:
+
+    def test_set_and_get(self, tmp_path):
+        cache = DiskCache(tmp_path / "cache.sqlite3")
+        cache.set_many({"a": b"1", "b": b"22"})
+
+        assert cache.get("a") == b"1"
+        assert cache.get("missing") is None
+        assert cache.get_many(["a", "b", "c"]) == {"a": b"1", "b": b"22"}
+        assert cache.stats()["entries"] == 2
+
+    def test_shared_between_cache_objects(self, tmp_path):
+        DiskCache(tmp_path / "cache.sqlite3").set("a", b"1")
+
+        assert DiskCache(tmp_path / "cache.sqlite3").get("a") == b"1"
+
+    def test_least_recently_used_entries_are_evicted(self, tmp_path):
+        cache = DiskCache(tmp_path / "cache.sqlite3", max_bytes=100)
+        cache.set_many({"a": b"x" * 40, "b": b"y" * 40})
+        time.sleep(0.01)
+        cache.get("a")  # a is used again, b is now the least recently used entry
+        time.sleep(0.01)
+
+        cache.set("c", b"z" * 40)
+
+        assert set(cache.get_many(["a", "b", "c"])) == {"a", "c"}
+        assert cache.stats()["bytes"] <= 100
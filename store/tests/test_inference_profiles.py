@@ -0,0 +1,43 @@
+# store/tests/test_inference_profiles.py
+import pytest
+from django.conf import settings
+from model_bakery import baker
+
+from store.models import InferenceProfile
+from store.utility.ai_utils import get_inference_settings
+
+
+@pytest.mark.django_db
+class TestInferenceProfiles:
+
+    def test_settings_profile_is_used_without_stored_profile(self, ai_model):
+        inference = get_inference_settings(ai_model.id, "fast")
+
+        assert inference["profile"] == "fast"
+        assert inference["augment"] == settings.AI_INFERENCE_PROFILES["fast"]["augment"]
+        # the general inference settings are kept
+        assert inference["tile_overlap"] == settings.AI_INFERENCE["tile_overlap"]
+
+    def test_stored_profile_wins(self, ai_model):
+        baker.make(InferenceProfile, ai_model=ai_model, name="fast", augment=False, tile_size=1280,
+                   conf_thres=0.6, iou_thres=0.5, batch_size=4)
+
+        inference = get_inference_settings(ai_model.id, "fast")
+
+        assert inference["tile_size"] == 1280
+        assert inference["conf_thres"] == 0.6
+        assert inference["batch_size"] == 4
+
+    def test_default_profile(self, ai_model):
+        assert get_inference_settings(ai_model.id)["profile"] == settings.AI_DEFAULT_INFERENCE_PROFILE
+
+    def test_unknown_profile(self, ai_model):
+        with pytest.raises(ValueError):
+            get_inference_settings(ai_model.id, "turbo")
+
+    def test_room_stamp_rules_of_the_customer(self, ai_model, settings):
+        settings.AI_ROOM_STAMP_RULES = {7: "rules/customer_7.yaml"}
+
+        assert get_inference_settings(ai_model.id, customer_id=7)["room_stamp_rules"] == "rules/customer_7.yaml"
+        # customers without rules keep the settings (and the result cache key) unchanged
+        assert "room_stamp_rules" not in get_inference_settings(ai_model.id, customer_id=8)
@@ -0,0 +1,151 @@
+# store/tests/test_inference_server.py
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from src.inference_client import InferenceClient, InferenceServerError, RemoteDetector, parse_address
+from src.inference_server import DynamicBatcher, InferenceServer
+
+
+class FakeDetector:
+    names = ["text"]
+
+    def settings_key(self):
+        return "fake"
+
+    def detect(self, tiles):
+        # one detection per tile with the mean of the tile as confidence, none on a blank tile
+        return [
+            np.array([[0, 0, tile.shape[1], tile.shape[0], tile.mean(), 0]], dtype=np.float32)[:int(tile.mean() > 0)]
+            for tile in tiles
+        ]
+
+
+class FakeServer(InferenceServer):
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.batch_sizes = []
+
+    def detect(self, tiles):
+        self.batch_sizes.append(len(tiles))
+        return FakeDetector().detect(tiles)
+
+    def get_detector(self, settings):
+        self.check_weights(settings["weights"])
+        with self._lock:
+            if not self.detection_batchers:
+                self.detection_batchers["fake"] = DynamicBatcher(self.detect, self.detection_batch_size,
+                                                                 self.max_latency)
+            return FakeDetector(), self.detection_batchers["fake"]
+
+    def get_recognizer(self):
+        with self._lock:
+            if self.recognition_batcher is None:
+                self.recognizer = SimpleNamespace(parseq=SimpleNamespace(
+                    hparams=SimpleNamespace(img_size=[32, 128], decode_ar=True, refine_iters=1)
+                ))
+                self.recognition_batcher = DynamicBatcher(
+                    lambda snippets: [(str(snippet.shape[1]), 0.5) for snippet in snippets],
+                    self.recognition_batch_size, self.max_latency
+                )
+            return self.recognizer, self.recognition_batcher
+
+
+@pytest.fixture
+def server(tmp_path):
+    server = FakeServer(detection_batch_size=8, max_latency=0.2, weights=["best.pt"])
+    address = str(tmp_path / "inference.sock")
+    threading.Thread(target=server.serve, args=(address,), daemon=True).start()
+    for _ in range(100):
+        if (tmp_path / "inference.sock").exists():
+            break
+        time.sleep(0.01)
+    return server, InferenceClient(address)
+
+
+class TestDynamicBatcher:
+
+    def test_concurrent_requests_share_batches(self):
+        batch_sizes = []
+
+        def run_batch(items):
+            batch_sizes.append(len(items))
+            return [item * 2 for item in items]
+
+        batcher = DynamicBatcher(run_batch, max_batch_size=4, max_latency=0.2)
+        results = {}
+        threads = [
+            threading.Thread(target=lambda k=k: results.update({k: batcher.submit([k, k + 10])})) for k in range(3)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        batcher.close()
+
+        assert results == {0: [0, 20], 1: [2, 22], 2: [4, 24]}
+        assert batch_sizes == [4, 2]
+
+    def test_a_failed_batch_fails_its_requests(self):
+        batcher = DynamicBatcher(lambda items: 1 / 0, max_latency=0)
+
+        with pytest.raises(ZeroDivisionError):
+            batcher.submit([1])
+        assert batcher.submit([]) == []
+        batcher.close()
+
+
+class TestInferenceServer:
+
+    def test_detect_and_recognize(self, server):
+        server, client = server
+        detector = RemoteDetector(client, "best.pt", conf_thres=0.5)
+        tiles = [np.full((640, 640, 3), 10, dtype=np.uint8), np.full((640, 200, 3), 20, dtype=np.uint8)[:, ::2]]
+        timings = {}
+
+        detections = detector.detect(tiles, batch_size=1, timings=timings)
+        texts = client.recognize([np.zeros((20, width, 3), dtype=np.uint8) for width in (40, 90)])
+
+        assert detector.names == ["text"]
+        assert detector.settings_key() == "fake"
+        assert [detection.tolist() for detection in detections] == [[[0, 0, 640, 640, 10, 0]],
+                                                                    [[0, 0, 100, 640, 20, 0]]]
+        assert "text_detection.server" in timings
+        assert texts == [("40", 0.5), ("90", 0.5)]
+        assert client.recognizer_info() == {"img_size": [32, 128], "decode_ar": True, "refine_iters": 1}
+
+    def test_tiles_of_concurrent_workers_are_batched(self, server):
+        server, client = server
+        tiles = [np.zeros((64, 64, 3), dtype=np.uint8)] * 4
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(client.detect(tiles, {"weights": "best.pt"})))
+                   for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert server.batch_sizes == [8]
+        assert [[detections.shape for detections in result] for result in results] == [[(0, 6)] * 4] * 2
+
+    def test_errors_are_raised_in_the_client(self, server):
+        _, client = server
+
+        with pytest.raises(InferenceServerError):
+            client.request({"op": "train"})
+
+    def test_only_the_weights_of_the_server_are_loaded(self, server):
+        _, client = server
+
+        with pytest.raises(InferenceServerError, match="not served"):
+            RemoteDetector(client, "/tmp/other.pt")
+        with pytest.raises(InferenceServerError, match="not served"):
+            client.detect([np.zeros((64, 64, 3), dtype=np.uint8)], {"weights": "../best.pt"})
+
+    def test_addresses(self):
+        assert parse_address("127.0.0.1:8765")[1] == ("127.0.0.1", 8765)
+        assert parse_address("/run/inference.sock")[1] == "/run/inference.sock"
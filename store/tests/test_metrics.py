@@ -0,0 +1,71 @@
+# store/tests/test_metrics.py
+import pytest
+from rest_framework import status
+
+from store.utility import metrics
+
+
+def sample(name, **labels):
+    return metrics.REGISTRY.get_sample_value(name, labels) or 0
+
+
+class TestRecordProcessImage:
+
+    def test_tiles_and_snippets_of_a_processed_image(self):
+        before = {status: sample("ai_tiles_processed_total", status=status) for status in ("detected", "blank")}
+        recognized = sample("ai_snippets_processed_total", status="recognized")
+        ai_results = {
+            "text_detection": {"a.png": {"meta": {"tiles": 10, "tiles_skipped": 4, "tiles_cached": 0}}},
+            "text_recognition": {"a.png": {"elements": [{}, {}, {}]}},
+        }
+
+        metrics.record_process_image({"success": True, "result_cache": "miss"}, {"total": {"wall_seconds": 2.0}},
+                                     ai_results)
+
+        assert sample("ai_tiles_processed_total", status="detected") - before["detected"] == 6
+        assert sample("ai_tiles_processed_total", status="blank") - before["blank"] == 4
+        assert sample("ai_snippets_processed_total", status="recognized") - recognized == 3
+
+
+class TestTasksInFlight:
+
+    def test_in_flight_tasks_per_project(self):
+        with metrics.task_in_flight(7):
+            with metrics.task_in_flight(7):
+                assert sample("ai_tasks_in_flight", project_id="7") == 2
+            assert sample("ai_tasks_in_flight", project_id="7") == 1
+
+        # the series of a project goes away with its last task
+        assert metrics.REGISTRY.get_sample_value("ai_tasks_in_flight", {"project_id": "7"}) is None
+
+    def test_finished_run_removes_the_series(self):
+        with metrics.task_in_flight(8):
+            metrics.forget_project(8)
+            assert metrics.REGISTRY.get_sample_value("ai_tasks_in_flight", {"project_id": "8"}) is None
+
+
+@pytest.mark.django_db
+class TestMetricsEndpoint:
+
+    def test_request_latency_by_viewset_action(self, api_client, admin_user, settings):
+        settings.METRICS_CELERY_QUEUES = []
+        api_client.force_authenticate(user=admin_user)
+        api_client.get("/store/projects/")
+
+        response = api_client.get("/metrics")
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response["Content-Type"].startswith("text/plain; version=0.0.4")
+        body = response.content.decode()
+        assert 'http_request_duration_seconds_count{action="list",method="GET",status="200",view="ProjectsViewSet"}' in body
+        assert 'http_request_db_queries_count{action="list",view="ProjectsViewSet"}' in body
+
+    def test_only_admins_and_the_scraper_get_the_metrics(self, api_client, regular_user, settings):
+        settings.METRICS_CELERY_QUEUES = []
+        api_client.force_authenticate(user=regular_user)
+
+        assert api_client.get("/metrics").status_code == status.HTTP_403_FORBIDDEN
+
+        settings.METRICS_ALLOWED_IPS = ["127.0.0.1"]
+        api_client.force_authenticate(user=None)
+        assert api_client.get("/metrics").status_code == status.HTTP_200_OK
@@ -0,0 +1,38 @@
+# store/tests/test_model_registry.py
+from src.model_registry import ModelRegistry, weights_digest
+
+
+class TestModelRegistry:
+
+    def test_model_is_loaded_once(self):
+        registry = ModelRegistry()
+        calls = []
+
+        def loader():
+            calls.append(1)
+            return object()
+
+        first = registry.get("detector:best.pt", loader)
+        second = registry.get("detector:best.pt", loader)
+
+        assert first is second
+        assert len(calls) == 1
+        assert registry.hits == 1
+        assert registry.misses == 1
+        assert "detector:best.pt" in registry.stats()["load_seconds"]
+
+    def test_clear_resets_counters(self):
+        registry = ModelRegistry()
+        registry.get("recognizer:parseq", object)
+        registry.clear()
+
+        assert registry.stats() == {"hits": 0, "misses": 0, "load_seconds": {}, "resident": []}
+
+    def test_weights_digest_follows_the_file(self, tmp_path):
+        weights = tmp_path / "parseq.pt"
+        weights.write_bytes(b"weights")
+        first = weights_digest(weights)
+        weights.write_bytes(b"other weights")
+
+        assert weights_digest(weights) != first
+        assert weights_digest(tmp_path / "missing.pt") is None
@@ -0,0 +1,55 @@
+# store/tests/test_parseq_decoding.py
+import sys
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("timm")
+pytest.importorskip("pytorch_lightning")
+
+from src.model_registry import PARSEQ_PATH  # noqa: E402
+
+if PARSEQ_PATH not in sys.path:
+    sys.path.insert(0, PARSEQ_PATH)
+
+from strhub.models.utils import create_model  # noqa: E402
+
+
+def make_parseq(refine_iters):
+    # small random parseq, the decoding paths only have to agree with each other
+    torch.manual_seed(0)
+    model = create_model('parseq-tiny', pretrained=False, refine_iters=refine_iters).eval()
+    # a larger bias for <eos> makes the sequences end at different steps
+    with torch.no_grad():
+        model.head.bias[0] += 2.0
+    return model
+
+
+def decode(model, images, decode_cache):
+    model.decode_cache = decode_cache
+    with torch.no_grad():
+        logits = model(images)
+    return logits, model.tokenizer.decode(logits.softmax(-1))
+
+
+class TestParseqDecoding:
+
+    @pytest.mark.parametrize("refine_iters", [0, 1])
+    def test_cached_decoding_matches_greedy_decoding(self, refine_iters):
+        model = make_parseq(refine_iters)
+        images = torch.rand(6, 3, *model.hparams.img_size)
+
+        logits, (labels, probs) = decode(model, images, decode_cache=False)
+        cached_logits, (cached_labels, cached_probs) = decode(model, images, decode_cache=True)
+
+        assert cached_labels == labels
+        for cached, expected in zip(cached_probs, probs):
+            assert torch.allclose(cached, expected, atol=1e-5)
+        assert cached_logits.shape == logits.shape
+        if refine_iters:
+            # after the refinement every position is recomputed, finished sequences make no difference
+            assert torch.allclose(cached_logits, logits, atol=1e-4)
+
+    def test_cloze_mask_is_cached(self):
+        model = make_parseq(1)
+        assert model.cloze_mask(26) is model.cloze_mask(26)
@@ -0,0 +1,46 @@
+# store/tests/test_pipeline_state.py
+import json
+
+import cv2
+import numpy as np
+
+from src.pipeline_state import PipelineState
+
+
+class TestPipelineState:
+
+    def test_stage_results_are_not_changed_by_later_stages(self):
+        state = PipelineState()
+        state.data = {"p1_1.png": {"elements": [{"guid": "a", "bbox_xyxy_abs": [0, 0, 10, 10]}]}}
+        detection = state.finish_stage("text_detection")
+
+        # the next stage works on the same data
+        element = state.data["p1_1.png"]["elements"][0]
+        element["text"] = "WC"
+        element["bbox_xyxy_abs"][2] = 99
+
+        assert detection == {"p1_1.png": {"elements": [{"guid": "a", "bbox_xyxy_abs": [0, 0, 10, 10]}]}}
+        assert state.results["text_detection"] is detection
+
+    def test_load_written_results(self, tmp_path):
+        (tmp_path / "original").mkdir()
+        cv2.imwrite(str(tmp_path / "original" / "p1_1.png"), np.full((20, 30, 3), 255, dtype=np.uint8))
+        (tmp_path / "results.json").write_text('{"p1_1.png": {"elements": []}}')
+
+        state = PipelineState.load(tmp_path)
+
+        assert state.data == {"p1_1.png": {"elements": []}}
+        assert state.images["p1_1.png"].shape == (20, 30, 3)
+
+    def test_state_without_images_round_trip(self, tmp_path):
+        cv2.imwrite(str(tmp_path / "p1_1.png"), np.full((20, 30, 3), 255, dtype=np.uint8))
+        state = PipelineState()
+        state.data = {"p1_1.png": {"elements": []}}
+        state.finish_stage("text_detection")
+        state.timings["text_detection"] = {"wall_seconds": 1.0}
+
+        restored = PipelineState.from_dict(json.loads(json.dumps(state.to_dict())), [str(tmp_path / "p1_1.png")])
+
+        assert restored.results == {"text_detection": {"p1_1.png": {"elements": []}}}
+        assert restored.timings == {"text_detection": {"wall_seconds": 1.0}}
+        assert restored.images["p1_1.png"].shape == (20, 30, 3)
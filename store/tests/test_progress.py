@@ -0,0 +1,102 @@
+# store/tests/test_progress.py
+import json
+import threading
+import time
+
+import pytest
+from django.conf import settings
+from model_bakery import baker
+from rest_framework import status
+
+from store.models import Project
+from store.utility import progress
+
+
+class TestEta:
+
+    def test_eta_from_the_throughput_of_the_last_images(self):
+        # 4 images finished in 6 seconds (2 seconds per image), 5 remaining
+        assert progress.estimate_eta(0.0, [10.0, 12.0, 14.0, 16.0], 5) == 10.0
+
+    def test_no_eta_before_the_first_image_is_done(self):
+        assert progress.estimate_eta(0.0, [], 5) is None
+        assert progress.estimate_eta(0.0, [10.0], 0) == 0.0
+
+
+class TestProgressUpdates:
+
+    def test_seconds_of_an_image_from_its_first_stage(self):
+        progress.start_run(-1, [1])
+
+        progress.set_image_status(-1, 1, progress.PROCESSING, "text_detection")
+        time.sleep(0.05)
+        progress.set_image_status(-1, 1, progress.PROCESSING, "text_recognition")
+        progress.set_image_status(-1, 1, progress.DONE)
+
+        assert progress.get_progress(-1)["seconds_per_image"] >= 0.05
+
+    def test_concurrent_extends_keep_all_images(self):
+        progress.start_run(-2, [0])
+        threads = [threading.Thread(target=progress.extend_run, args=(-2, [k])) for k in range(1, 9)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        progress.cancel_run(-2)
+
+        run_progress = progress.get_progress(-2)
+        assert sorted(image["image_id"] for image in run_progress["images"]) == list(range(9))
+        assert run_progress["cancelled"]
+
+
+@pytest.mark.django_db
+class TestProgressEndpoint:
+
+    def test_progress_of_a_running_project(self, api_client, regular_user, project):
+        progress.start_run(project.id, [1, 2, 3])
+        progress.set_image_status(project.id, 1, progress.PROCESSING, "text_detection")
+        progress.set_image_status(project.id, 1, progress.DONE)
+        progress.set_image_status(project.id, 2, progress.PROCESSING, "text_recognition")
+        api_client.force_authenticate(user=regular_user)
+
+        response = api_client.get(f"/store/projects/{project.id}/progress/")
+
+        assert response.status_code == status.HTTP_200_OK
+        assert (response.data["queued"], response.data["processing"], response.data["done"]) == (1, 1, 1)
+        assert response.data["images"][1] == {"image_id": 2, "status": "processing", "stage": "text_recognition"}
+        assert not response.data["finished"]
+        # the progress endpoint does not touch the project
+        assert Project.objects.get(id=project.id).status == project.status
+
+    def test_progress_of_other_customers_is_hidden(self, api_client, project):
+        progress.start_run(project.id, [1])
+        api_client.force_authenticate(user=baker.make(settings.AUTH_USER_MODEL, is_staff=False))
+
+        response = api_client.get(f"/store/projects/{project.id}/progress/")
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    def test_progress_stream_ends_with_the_run(self, api_client, regular_user, project):
+        progress.start_run(project.id, [1])
+        progress.set_image_status(project.id, 1, progress.DONE)
+        api_client.force_authenticate(user=regular_user)
+
+        response = api_client.get(f"/store/projects/{project.id}/progress/stream/", HTTP_ACCEPT="text/event-stream")
+
+        assert response.status_code == status.HTTP_200_OK
+        events = b"".join(response.streaming_content).decode().strip().split("\n\n")
+        assert events[0] == f"retry: {settings.AI_PROGRESS_STREAM_INTERVAL * 1000}"
+        assert events[1].startswith("event: progress\ndata: ")
+        assert json.loads(events[1].split("data: ", 1)[1])["done"] == 1
+        assert events[-1] == "event: end\ndata: {}"
+
+    def test_progress_stream_is_closed_for_a_reconnect(self, api_client, regular_user, project, settings):
+        settings.AI_PROGRESS_STREAM_TIMEOUT = 0
+        progress.start_run(project.id, [1])
+        api_client.force_authenticate(user=regular_user)
+
+        response = api_client.get(f"/store/projects/{project.id}/progress/stream/", HTTP_ACCEPT="text/event-stream")
+
+        events = b"".join(response.streaming_content).decode().strip().split("\n\n")
+        assert [event.split("\n")[0] for event in events] == [f"retry: {settings.AI_PROGRESS_STREAM_INTERVAL * 1000}",
+                                                             "event: progress"]
@@ -0,0 +1,89 @@
+# store/tests/test_project_processing.py
+import pytest
+from model_bakery import baker
+
+from store import tasks
+from store.models import Image, ResultSet
+from store.utility.stage_timings import share_of_batch
+
+
+class FakeTask:
+
+    def __init__(self, args):
+        self.args = args
+        self.id = str(len(args[1]) if isinstance(args[1], list) else args[1])
+
+
+@pytest.fixture
+def delayed(monkeypatch):
+    calls = {"process_project": [], "process_image": []}
+
+    def delay(name):
+        def record(*args):
+            calls[name].append(args)
+            return FakeTask(args)
+        return record
+
+    monkeypatch.setattr(tasks.process_project, "delay", delay("process_project"))
+    monkeypatch.setattr(tasks.process_image, "delay", delay("process_image"))
+    return calls
+
+
+class TestDispatchProcessing:
+
+    def test_images_are_processed_in_chunks(self, settings, delayed):
+        settings.AI_EXECUTION_MODE = "project"
+        settings.AI_PROJECT_CHUNK_SIZE = 2
+
+        tasks.dispatch_processing(1, [1, 2, 3, 4, 5], 7)
+
+        assert delayed["process_project"] == [(1, [1, 2], 7), (1, [3, 4], 7), (1, [5], 7)]
+        assert delayed["process_image"] == []
+
+    def test_large_projects_fall_back_to_one_task_per_image(self, settings, delayed):
+        settings.AI_EXECUTION_MODE = "project"
+        settings.AI_PROJECT_MAX_BATCHED_IMAGES = 2
+
+        tasks.dispatch_processing(1, [1, 2, 3], 7)
+
+        assert delayed["process_image"] == [(1, 1, 7), (1, 2, 7), (1, 3, 7)]
+        assert delayed["process_project"] == []
+
+    def test_share_of_batch(self):
+        timings = {"text_detection": {"wall_seconds": 4.0, "cpu_seconds": 2.0, "peak_rss_mb": 900.0}}
+
+        assert share_of_batch(timings, 4) == {
+            "text_detection": {"wall_seconds": 1.0, "cpu_seconds": 0.5, "peak_rss_mb": 900.0, "batch_images": 4}
+        }
+
+
+@pytest.mark.django_db
+class TestProcessProject:
+
+    def test_result_sets_of_all_images_are_saved(self, project, ai_model, monkeypatch, settings, tmp_path):
+        settings.MEDIA_ROOT = str(tmp_path)
+        images = [baker.make(Image, project=project, name=f"{name}.png") for name in ["a", "b"]]
+        processed = []
+
+        def run_ai_model(cfg_file_path, on_stage=None):
+            processed.append(cfg_file_path)
+            timing = {"wall_seconds": 2.0, "cpu_seconds": 2.0, "peak_rss_mb": 500.0}
+            results = {
+                stage: {image.name: {"elements": [], "stage": stage} for image in images}
+                for stage in ["text_detection", "text_recognition", "text_interpretation"]
+            }
+            return dict(results, timings={"total": timing})
+
+        monkeypatch.setattr(tasks, "prepare_project_cfg", lambda *args, **kwargs: "cfg.yaml")
+        monkeypatch.setattr(tasks, "run_ai_model", run_ai_model)
+        monkeypatch.setattr(tasks, "get_model_cache_stats", lambda: {})
+
+        result = tasks.process_project(project.id, [image.id for image in images], ai_model.id)
+
+        # one pipeline run for both images
+        assert processed == ["cfg.yaml"]
+        assert result["success"]
+        result_set = ResultSet.objects.get(image=images[1])
+        assert result_set.result_recognition == {"b.png": {"elements": [], "stage": "text_recognition"}}
+        assert result_set.timings["total"]["wall_seconds"] == 1.0
+        assert ResultSet.objects.filter(project=project).count() == 2
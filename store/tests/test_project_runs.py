@@ -0,0 +1,93 @@
+# store/tests/test_project_runs.py
+import pytest
+from model_bakery import baker
+from rest_framework import status
+
+from store import views
+from store.models import Image, Project, ProjectRun
+from store.utility import progress
+
+
+@pytest.fixture
+def dispatched(monkeypatch):
+    calls = []
+
+    def dispatch_processing(project_id, image_ids, ai_model_id, new_run=True):
+        # the progress is tracked like by the real dispatch, the tasks are not queued
+        (progress.start_run if new_run else progress.extend_run)(project_id, image_ids)
+        calls.append((list(image_ids), new_run))
+        return [f"task-{image_id}" for image_id in image_ids]
+
+    monkeypatch.setattr(views, "dispatch_processing", dispatch_processing)
+    return calls
+
+
+@pytest.fixture
+def revoked(monkeypatch):
+    calls = []
+    monkeypatch.setattr(views.current_app.control, "revoke", lambda task_ids, **kwargs: calls.append((task_ids, kwargs)))
+    return calls
+
+
+@pytest.mark.django_db
+class TestProjectRuns:
+
+    def test_second_start_is_rejected(self, api_client, regular_user, project, dispatched):
+        images = baker.make(Image, project=project, _quantity=2)
+        api_client.force_authenticate(user=regular_user)
+
+        first = api_client.post(f"/store/projects/{project.id}/start/")
+        second = api_client.post(f"/store/projects/{project.id}/start/")
+
+        assert first.status_code == status.HTTP_202_ACCEPTED
+        assert second.status_code == status.HTTP_409_CONFLICT
+        assert len(dispatched) == 1
+        run = ProjectRun.objects.get(project=project)
+        assert run.task_ids == [f"task-{image.id}" for image in images]
+
+    def test_finished_run_does_not_block_a_new_start(self, api_client, regular_user, project, dispatched):
+        image = baker.make(Image, project=project)
+        api_client.force_authenticate(user=regular_user)
+
+        api_client.post(f"/store/projects/{project.id}/start/")
+        progress.set_image_status(project.id, image.id, progress.DONE)
+        response = api_client.post(f"/store/projects/{project.id}/start/")
+
+        assert response.status_code == status.HTTP_202_ACCEPTED
+        assert ProjectRun.objects.filter(project=project, status="FINISHED").count() == 1
+
+    def test_start_rest_is_merged_into_the_running_run(self, api_client, regular_user, project, dispatched):
+        first_image = baker.make(Image, project=project, has_result=False)
+        api_client.force_authenticate(user=regular_user)
+        api_client.post(f"/store/projects/{project.id}/start/")
+
+        second_image = baker.make(Image, project=project, has_result=False)
+        response = api_client.post(f"/store/projects/{project.id}/start_rest/")
+
+        assert response.status_code == status.HTTP_202_ACCEPTED
+        # only the new image is dispatched, into the running run
+        assert dispatched[-1] == ([second_image.id], False)
+        run = ProjectRun.objects.get(project=project)
+        assert run.image_ids == [first_image.id, second_image.id]
+
+    def test_cancel_revokes_the_tasks(self, api_client, regular_user, project, dispatched, revoked):
+        baker.make(Image, project=project, _quantity=2)
+        api_client.force_authenticate(user=regular_user)
+        api_client.post(f"/store/projects/{project.id}/start/")
+
+        response = api_client.post(f"/store/projects/{project.id}/cancel/")
+
+        assert response.status_code == status.HTTP_200_OK
+        run = ProjectRun.objects.get(project=project)
+        assert revoked == [(run.task_ids, {"terminate": True})]
+        assert run.status == "CANCELLED"
+        assert Project.objects.get(id=project.id).status == "CANCELLED"
+        assert progress.get_progress(project.id)["finished"]
+
+    def test_cancel_without_running_run(self, api_client, regular_user, project, revoked):
+        api_client.force_authenticate(user=regular_user)
+
+        response = api_client.post(f"/store/projects/{project.id}/cancel/")
+
+        assert response.status_code == status.HTTP_409_CONFLICT
+        assert revoked == []
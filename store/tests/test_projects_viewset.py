@@ -2,7 +2,7 @@
 import pytest
 from rest_framework import status
 from django.conf import settings
-from store.models import Project, Image, AiModel
+from store.models import Project, Image, AiModel, InferenceProfile
 from model_bakery import baker
 
 import tempfile
@@ -50,6 +50,19 @@ class TestProjectsViewSet:
         assert response.data['name'] == project_data['name']
         assert 'id' in response.data
 
+    def test_create_project_with_inference_profile(self, api_client, regular_user, ai_model):
+        api_client.force_authenticate(user=regular_user)
+        project_data = {"name": "Fast Project", "ai_model_id": ai_model.id, "inference_profile": "fast"}
+        response = api_client.post("/store/projects/", project_data)
+        assert response.status_code == status.HTTP_201_CREATED
+        assert Project.objects.get(id=response.data['id']).inference_profile == "fast"
+
+    def test_create_project_with_unknown_inference_profile(self, api_client, regular_user, ai_model):
+        api_client.force_authenticate(user=regular_user)
+        project_data = {"name": "Project", "ai_model_id": ai_model.id, "inference_profile": "turbo"}
+        response = api_client.post("/store/projects/", project_data)
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
 
     # update
     def test_update_project_authenticated(self, api_client, regular_user, project):
@@ -60,6 +73,17 @@ class TestProjectsViewSet:
         assert response.data['name'] == updated_data['name']
         assert response.data['description'] == updated_data['description']
 
+    def test_update_ai_model_resets_profile_of_the_old_model(self, api_client, regular_user, project, ai_model):
+        baker.make(InferenceProfile, ai_model=ai_model, name="night")
+        Project.objects.filter(id=project.id).update(inference_profile="night")
+        other_model = baker.make(AiModel)
+        api_client.force_authenticate(user=regular_user)
+
+        response = api_client.patch(f"/store/projects/{project.id}/", {"ai_model_id": other_model.id})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert Project.objects.get(id=project.id).inference_profile == settings.AI_DEFAULT_INFERENCE_PROFILE
+
 
 
     # delete
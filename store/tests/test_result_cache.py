@@ -0,0 +1,99 @@
+# store/tests/test_result_cache.py
+import os
+
+import pytest
+from django.core.files.uploadedfile import SimpleUploadedFile
+from model_bakery import baker
+from rest_framework import status
+
+from store.models import Image, ResultSet
+from store.utility import result_cache
+
+
+VISUAL_PATHS = {
+    "text_detection_image_path": "outputs/project_1/a/text_detection/final/visual/a.png",
+    "text_recognition_image_path": "outputs/project_1/a/text_recognition/final/visual/a.png",
+    "text_interpretation_image_path": "outputs/project_1/a/text_interpretation/final/visual/a.png",
+}
+
+
+@pytest.fixture
+def media_root(settings, tmp_path):
+    settings.MEDIA_ROOT = str(tmp_path)
+    return tmp_path
+
+
+def write_visual_results(media_root):
+    for path in VISUAL_PATHS.values():
+        os.makedirs(os.path.dirname(media_root / path), exist_ok=True)
+        (media_root / path).write_bytes(b"visual")
+
+
+@pytest.mark.django_db
+class TestResultCache:
+
+    def test_content_hash_is_set_on_upload(self, project, media_root):
+        image = Image.objects.create(project=project, name="a.png", old_name="a", type="png",
+                                     image_file=SimpleUploadedFile("a.png", b"drawing"))
+
+        # sha256 of b"drawing"
+        assert image.content_hash == "27f3282691613a41f159fe0fb8f3791f3b99fa00fc62df29edeeafe496eb0fdd"
+        assert Image.objects.filter(content_hash=image.content_hash).count() == 1
+
+    def test_result_of_identical_drawing_is_found(self, project, ai_model, media_root):
+        donor = baker.make(Image, project=project, name="a.png", content_hash="h" * 64)
+        image = baker.make(Image, project=project, name="b.png", content_hash="h" * 64)
+        result_set = baker.make(ResultSet, project=project, ai_model=ai_model, image=donor, params_hash="p",
+                                **VISUAL_PATHS)
+        write_visual_results(media_root)
+
+        assert result_cache.find_cached_result_set(image, ai_model.id, "p") == result_set
+        # other parameters, no result
+        assert result_cache.find_cached_result_set(image, ai_model.id, "q") is None
+
+    def test_result_without_visual_results_is_not_reused(self, project, ai_model, media_root):
+        donor = baker.make(Image, project=project, name="a.png", content_hash="h" * 64)
+        image = baker.make(Image, project=project, name="b.png", content_hash="h" * 64)
+        baker.make(ResultSet, project=project, ai_model=ai_model, image=donor, params_hash="p", **VISUAL_PATHS)
+
+        assert result_cache.find_cached_result_set(image, ai_model.id, "p") is None
+
+    def test_link_file(self, media_root):
+        write_visual_results(media_root)
+        target = "outputs/project_2/b/text_detection/final/visual/b.png"
+
+        result_cache.link_file(VISUAL_PATHS["text_detection_image_path"], target)
+
+        assert (media_root / target).read_bytes() == b"visual"
+
+    def test_params_hash_ignores_batch_size(self):
+        inference = {"augment": True, "tile_size": 640, "batch_size": 8}
+
+        assert result_cache.get_params_hash(1, inference) == result_cache.get_params_hash(1, dict(inference, batch_size=1))
+        assert result_cache.get_params_hash(1, inference) != result_cache.get_params_hash(1, dict(inference, augment=False))
+        assert result_cache.get_params_hash(1, inference) != result_cache.get_params_hash(2, inference)
+        # results with and without the snippet memo are not shared
+        assert result_cache.get_params_hash(1, inference) != result_cache.get_params_hash(
+            1, dict(inference, snippet_memo_max_entries=20000)
+        )
+
+    def test_rename_image_in_result(self):
+        result = {"a.png": {"visual_result_path": "visual/a.png", "elements": []}}
+
+        assert result_cache.rename_image_in_result(result, "a.png", "b.png") == {
+            "b.png": {"visual_result_path": "visual/b.png", "elements": []}
+        }
+
+    def test_stats_endpoint(self, api_client, admin_user, regular_user):
+        result_cache.record_lookup(hit=True)
+        result_cache.record_lookup(hit=False)
+        result_cache.record_lookup(hit=False)
+        result_cache.record_lookup(hit=True)
+
+        api_client.force_authenticate(user=regular_user)
+        assert api_client.get("/store/ais/result-cache/").status_code == status.HTTP_403_FORBIDDEN
+
+        api_client.force_authenticate(user=admin_user)
+        response = api_client.get("/store/ais/result-cache/")
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data == {"hits": 2, "misses": 2, "hit_rate": 0.5}
@@ -0,0 +1,104 @@
+# store/tests/test_result_history.py
+import pytest
+from model_bakery import baker
+from rest_framework import status
+
+from store import tasks, views
+from store.models import AiModel, Image, Project, ResultSet
+
+
+RESULTS = {
+    "text_detection": {"a.png": {"elements": []}},
+    "text_recognition": {"a.png": {"elements": []}},
+    "text_interpretation": {"a.png": []},
+}
+
+
+def profile_hash(project, ai_model_id, profile="accurate"):
+    # the params hash of the project with the ai model and the inference profile
+    return Project(ai_model_id=ai_model_id, inference_profile=profile, customer_id=project.customer_id) \
+        .current_params_hash()
+
+
+def save_results(project, image, ai_model_id, params_hash):
+    visual_paths = tasks.get_visual_paths(project.id, image.name, tasks.get_results_dir(ai_model_id, params_hash))
+    return tasks.save_image_results(project, image, ai_model_id, params_hash, visual_paths, RESULTS, {}, False)
+
+
+@pytest.fixture(autouse=True)
+def no_model_cache_stats(monkeypatch):
+    monkeypatch.setattr(tasks, "get_model_cache_stats", lambda: {})
+
+
+@pytest.mark.django_db
+class TestResultHistory:
+
+    def test_results_of_every_ai_model_are_kept(self, project, ai_model):
+        other_model = baker.make(AiModel)
+        image = baker.make(Image, project=project, name="a.png")
+
+        save_results(project, image, ai_model.id, "hash_a")
+        save_results(project, image, other_model.id, "hash_b")
+        save_results(project, image, ai_model.id, "hash_a")
+
+        assert ResultSet.objects.filter(image=image).count() == 2
+        detection_paths = set(ResultSet.objects.values_list("text_detection_image_path", flat=True))
+        assert len(detection_paths) == 2
+
+    def test_switching_the_ai_model_serves_stored_results(self, api_client, regular_user, project, ai_model,
+                                                          monkeypatch):
+        other_model = baker.make(AiModel)
+        done, open_image = (baker.make(Image, project=project, name=name) for name in ["a.png", "b.png"])
+        save_results(project, done, other_model.id, profile_hash(project, other_model.id))
+        save_results(project, done, ai_model.id, profile_hash(project, ai_model.id))
+        save_results(project, open_image, ai_model.id, profile_hash(project, ai_model.id))
+        dispatched = []
+        monkeypatch.setattr(views, "dispatch_processing",
+                            lambda project_id, image_ids, ai_model_id, new_run=True: dispatched.append(image_ids) or [])
+        api_client.force_authenticate(user=regular_user)
+
+        response = api_client.patch(f"/store/projects/{project.id}/", {"ai_model_id": other_model.id})
+        assert response.status_code == status.HTTP_200_OK
+        api_client.post(f"/store/projects/{project.id}/start_rest/")
+
+        # only the image without a result of the new ai model is processed
+        assert dispatched == [[open_image.id]]
+        assert Image.objects.get(id=done.id).has_result
+        assert not Image.objects.get(id=open_image.id).has_result
+
+    def test_results_endpoint_selects_the_ai_model(self, api_client, regular_user, project, ai_model):
+        other_model = baker.make(AiModel)
+        image = baker.make(Image, project=project, name="a.png")
+        save_results(project, image, ai_model.id, profile_hash(project, ai_model.id))
+        save_results(project, image, other_model.id, profile_hash(project, other_model.id))
+        api_client.force_authenticate(user=regular_user)
+
+        current = api_client.get(f"/store/projects/{project.id}/results/")
+        other = api_client.get(f"/store/projects/{project.id}/results/{image.id}/?ai_model={other_model.id}")
+        invalid = api_client.get(f"/store/projects/{project.id}/results/?ai_model=best")
+
+        assert [result["ai_model_id"] for result in current.data] == [ai_model.id]
+        assert other.data["ai_model_id"] == other_model.id
+        assert other.data["params_hash"] == profile_hash(project, other_model.id)
+        assert invalid.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_current_result_set_follows_the_inference_profile(self, api_client, regular_user, project, ai_model):
+        image = baker.make(Image, project=project, name="a.png")
+        save_results(project, image, ai_model.id, profile_hash(project, ai_model.id, "fast"))
+        save_results(project, image, ai_model.id, profile_hash(project, ai_model.id, "accurate"))
+
+        result_sets = ResultSet.latest_of_project(project)
+        assert [result_set.params_hash for result_set in result_sets] == [profile_hash(project, ai_model.id)]
+
+        # a profile without results: the image is open again
+        api_client.force_authenticate(user=regular_user)
+        api_client.patch(f"/store/projects/{project.id}/", {"inference_profile": "balanced"})
+
+        assert not Image.objects.get(id=image.id).has_result
+        assert api_client.get(f"/store/projects/{project.id}/results/").data == []
+
+        api_client.patch(f"/store/projects/{project.id}/", {"inference_profile": "fast"})
+
+        assert Image.objects.get(id=image.id).has_result
+        current = api_client.get(f"/store/projects/{project.id}/results/").data
+        assert [result["params_hash"] for result in current] == [profile_hash(project, ai_model.id, "fast")]
@@ -0,0 +1,79 @@
+# store/tests/test_room_stamp_parser.py
+import copy
+import json
+import os
+
+import pytest
+import yaml
+from django.conf import settings
+
+from src.interpreter import Floor, Interpreter, TextFieldFinder
+from src.room_stamp_parser import DEFAULT_RULES, RoomStampParser, get_parser
+
+
+SAMPLE_RESULT_SET = os.path.join(
+    settings.BASE_DIR, "steps_example_project_19", "step4_get_result_set", "project_19_image_55.json"
+)
+
+
+class TestRoomStampParser:
+
+    def test_fields_of_a_stamp(self):
+        values = RoomStampParser().parse_lines(["2.27", "Buro", "9.95 m2", "RH: 2.55 m"])
+
+        assert values == {"code": "2.27", "name": "Buro", "area": (9.95, "m2"), "height": (2.55, "m")}
+
+    def test_first_matching_rule_wins_and_later_lines_overwrite(self):
+        # "RH 250" is a name (no colon) and overwrites the first name, "7" and "3.?" match no rule
+        values = RoomStampParser().parse_lines([" 12a ", "Flur", "RH 250", "12.5m2", "7", "3.?"])
+
+        assert values == {"code": "12a", "name": "RH 250", "area": (12.5, "m2")}
+
+    def test_custom_rules_from_yaml(self, tmp_path):
+        # the area rule of the customer comes first, otherwise "NGF 12 qm" would be a name
+        rules = [{"field": "area", "pattern": r'^NGF\s(?P<value>\d+)\s(?P<unit>qm)$'}]
+        rules += [rule for rule in DEFAULT_RULES if rule["field"] != "area"]
+        rules_path = tmp_path / "customer_rules.yaml"
+        rules_path.write_text(yaml.safe_dump(rules))
+
+        parser = get_parser(str(rules_path))
+
+        assert parser is get_parser(str(rules_path))
+        assert parser.parse_lines(["NGF 12 qm"]) == {"area": (12.0, "qm")}
+        assert parser.parse_lines(["9.95 m2"]) == {}
+
+    def test_rules_are_validated(self):
+        with pytest.raises(ValueError):
+            RoomStampParser([{"field": "volume", "pattern": r'^\d+$'}])
+        with pytest.raises(ValueError):
+            RoomStampParser([{"field": "height", "pattern": r'^RH (\d+)$'}])
+
+
+class TestInterpreterRooms:
+
+    def test_sample_drawing(self):
+        with open(SAMPLE_RESULT_SET) as f:
+            result_set = json.load(f)
+        data = TextFieldFinder(copy.deepcopy(result_set["result_recognition"])).find_text_fields()
+        interpreter = Interpreter({"paths": {"text_interpretation": {"final_path": ""}}, "inference": {}})
+
+        floors = {
+            image: Floor(interpreter.parse_rooms(interpreter.preprocess(data[image]["fields"]))).to_list()
+            for image in data
+        }
+
+        assert floors == result_set["result_interpretation"]
+
+    def test_fields_without_name_or_code_are_discarded(self):
+        interpreter = Interpreter({"paths": {"text_interpretation": {"final_path": ""}}})
+        fields = [
+            {"text_snippets": ["1.", "2.0"], "position": [0, 0, 5, 5]},
+            {"text_snippets": ["", None], "position": [5, 5, 9, 9]},
+            {"text_snippets": ["2.21", "EDV-Technik"], "position": [10, 10, 20, 20]},
+        ]
+
+        rooms = interpreter.parse_rooms(fields)
+
+        assert [(room.code, room.name, room.position_on_drawing) for room in rooms] == [
+            ("2.21", "EDV-Technik", [10, 10, 20, 20])
+        ]
@@ -0,0 +1,48 @@
+# store/tests/test_snippet_memo.py
+import cv2
+import numpy as np
+
+from src.disk_cache import DiskCache
+from src.snippet_memo import SnippetMemo
+
+
+def make_snippet(text, noise=0):
+    snippet = np.full((30, 120, 3), 255, dtype=np.uint8)
+    cv2.putText(snippet, text, (4, 22), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 0), 2)
+    if noise:
+        snippet = np.clip(snippet.astype(int) - np.random.default_rng(0).integers(0, noise, snippet.shape), 0, 255)
+    return snippet.astype(np.uint8)
+
+
+class TestSnippetMemo:
+
+    def test_similar_snippets_share_a_key(self):
+        memo = SnippetMemo("parseq")
+
+        assert memo.key(make_snippet("Flur")) == memo.key(make_snippet("Flur", noise=3))
+        assert memo.key(make_snippet("Flur")) != memo.key(make_snippet("Bad"))
+
+    def test_only_exact_keys_hit(self):
+        memo = SnippetMemo("parseq")
+        memo.set_many({memo.key(make_snippet("Bad")): ("Bad", 0.9), memo.key(make_snippet("2,50")): ("2,50", 0.8)})
+
+        keys = [memo.key(make_snippet(text)) for text in ("Bad", "Bar", "2,60", "2,50")]
+
+        assert list(memo.get_many(keys).values()) == [("Bad", 0.9), ("2,50", 0.8)]
+
+    def test_lru_bound_and_stats(self):
+        memo = SnippetMemo("parseq", max_entries=2)
+        memo.set_many({"a": ("Flur", 0.9), "b": ("Bad", 0.8)})
+        memo.get_many(["a"])
+        memo.set_many({"c": ("WC", 0.7)})  # evicts b, the least recently used entry
+
+        assert memo.get_many(["a", "b", "c"]) == {"a": ("Flur", 0.9), "c": ("WC", 0.7)}
+        assert memo.stats()["hits"] == 3
+        assert memo.stats()["misses"] == 1
+
+    def test_backing_store(self, tmp_path):
+        store = DiskCache(tmp_path / "snippets.sqlite3")
+        SnippetMemo("parseq", backing_store=store).set_many({"a": ("Flur", 0.9)})
+
+        # a new process (empty lru) finds the text in the backing store
+        assert SnippetMemo("parseq", backing_store=store).get_many(["a"]) == {"a": ("Flur", 0.9)}
@@ -0,0 +1,92 @@
+# store/tests/test_stage_pipeline.py
+import pytest
+from model_bakery import baker
+
+from store import tasks
+from store.models import Image, Project, ResultSet
+
+
+@pytest.fixture
+def stages(monkeypatch, settings, tmp_path):
+    settings.MEDIA_ROOT = str(tmp_path)
+    runs = []
+
+    def run_ai_stage(stage, cfg_path, state_dict=None):
+        runs.append(stage)
+        state_dict = state_dict or {"data": {}, "results": {}, "timings": {}, "debug": False}
+        state_dict["results"][stage] = {"a.png": {"stage": stage}}
+        state_dict["timings"][stage] = {"wall_seconds": 1.0}
+        return state_dict
+
+    monkeypatch.setattr(tasks, "prepare_cfg", lambda *args: "cfg.yaml")
+    monkeypatch.setattr(tasks, "run_ai_stage", run_ai_stage)
+    monkeypatch.setattr(tasks, "get_model_cache_stats", lambda: {})
+    return runs
+
+
+def run_chain(project_id, image_id, ai_model_id):
+    payload = tasks.detect_text(project_id, image_id, ai_model_id)
+    return tasks.persist_results(tasks.interpret_text(tasks.recognize_text(payload)))
+
+
+@pytest.mark.django_db
+class TestStagePipeline:
+
+    def test_stages_hand_over_their_state(self, project, ai_model, stages):
+        image = baker.make(Image, project=project, name="a.png")
+
+        result = run_chain(project.id, image.id, ai_model.id)
+
+        assert stages == ["text_detection", "text_recognition", "text_interpretation"]
+        assert result["success"]
+        result_set = ResultSet.objects.get(image=image)
+        assert result_set.result_interpretation == {"a.png": {"stage": "text_interpretation"}}
+        assert set(result_set.timings) == {"result_cache", "text_detection", "text_recognition", "text_interpretation"}
+
+    def test_stages_after_a_failed_stage_are_skipped(self, project, ai_model, stages, monkeypatch):
+        image = baker.make(Image, project=project, name="a.png")
+        monkeypatch.setattr(tasks, "run_ai_stage", lambda *args: stages.append(args[0]))
+
+        result = run_chain(project.id, image.id, ai_model.id)
+
+        assert stages == ["text_detection"]
+        assert not result["success"]
+        assert Project.objects.get(id=project.id).status == "FAILED"
+
+    def test_unknown_inference_profile_fails_the_image(self, project, ai_model, stages):
+        image = baker.make(Image, project=project, name="a.png")
+        Project.objects.filter(id=project.id).update(inference_profile="turbo")
+        tasks.progress.start_run(project.id, [image.id])
+
+        result = run_chain(project.id, image.id, ai_model.id)
+
+        # the chain runs to its end, so that the chord callback finalizes the project
+        assert stages == []
+        assert not result["success"]
+        assert tasks.progress.get_progress(project.id)["failed"] == 1
+
+    def test_failed_cfg_fails_the_image(self, project, ai_model, stages, monkeypatch):
+        image = baker.make(Image, project=project, name="a.png")
+        monkeypatch.setattr(tasks, "prepare_cfg", lambda *args: open("/missing/cfg.yaml"))
+
+        result = tasks.persist_results(tasks.detect_text(project.id, image.id, ai_model.id))
+
+        assert not result["success"]
+        assert Project.objects.get(id=project.id).status == "FAILED"
+
+    def test_chord_callback_finalizes_the_project_status(self, project):
+        baker.make(Image, project=project, has_result=True)
+        project.status = "PROCESSING"
+        project.save()
+
+        tasks.update_project_status(project.id, True)
+
+        assert Project.objects.get(id=project.id).status == "COMPLETED"
+
+    def test_stage_tasks_have_their_own_queues(self, settings):
+        queues = {name: route["queue"] for name, route in settings.CELERY_TASK_ROUTES.items()}
+
+        assert queues["store.tasks.detect_text"] == "detection"
+        assert queues["store.tasks.recognize_text"] == "recognition"
+        assert queues["store.tasks.interpret_text"] == "interpretation"
+        assert queues["store.tasks.persist_results"] == "persistence"
@@ -0,0 +1,66 @@
+# store/tests/test_stage_timings.py
+import pytest
+from django.conf import settings
+from model_bakery import baker
+from rest_framework import status
+
+from src.stage_timer import StageTimer
+from store.models import Image, ResultSet
+
+
+def timing(wall_seconds, cpu_seconds, peak_rss_mb):
+    return {"wall_seconds": wall_seconds, "cpu_seconds": cpu_seconds, "peak_rss_mb": peak_rss_mb,
+            "rss_growth_mb": 0.0, "calls": 1}
+
+
+class TestStageTimer:
+
+    def test_repeated_measurements_are_summed_up(self):
+        timings = {}
+        for _ in range(3):
+            with StageTimer(timings, "text_detection.forward"):
+                sum(range(10000))
+
+        assert timings["text_detection.forward"]["calls"] == 3
+        assert timings["text_detection.forward"]["wall_seconds"] > 0
+        assert timings["text_detection.forward"]["peak_rss_mb"] > 0
+
+    def test_measurement_is_stored_if_the_stage_raises(self):
+        timings = {}
+        with pytest.raises(ValueError):
+            with StageTimer(timings, "text_interpretation"):
+                raise ValueError()
+
+        assert timings["text_interpretation"]["calls"] == 1
+
+
+@pytest.mark.django_db
+class TestProjectTimings:
+
+    def test_timings_are_aggregated_per_stage(self, api_client, regular_user, project, ai_model):
+        for wall_seconds in [1.0, 3.0]:
+            baker.make(ResultSet, project=project, ai_model=ai_model, image=baker.make(Image, project=project),
+                       timings={"text_detection": timing(wall_seconds, wall_seconds / 2, 100 * wall_seconds)})
+        baker.make(ResultSet, project=project, ai_model=ai_model, image=baker.make(Image, project=project),
+                   timings={"result_cache": timing(0.5, 0.1, 50.0)})
+        api_client.force_authenticate(user=regular_user)
+
+        response = api_client.get(f"/store/projects/{project.id}/timings/")
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data["images_nr"] == 3
+        detection = response.data["stages"]["text_detection"]
+        assert detection["images"] == 2
+        assert detection["wall_seconds_total"] == 4.0
+        assert detection["wall_seconds_mean"] == 2.0
+        assert detection["wall_seconds_max"] == 3.0
+        assert detection["cpu_seconds_mean"] == 1.0
+        assert detection["peak_rss_mb_max"] == 300.0
+        assert response.data["stages"]["result_cache"]["images"] == 1
+
+    def test_timings_of_other_customers_are_hidden(self, api_client, project):
+        api_client.force_authenticate(user=baker.make(settings.AUTH_USER_MODEL, is_staff=False))
+
+        response = api_client.get(f"/store/projects/{project.id}/timings/")
+
+        assert response.status_code != status.HTTP_200_OK
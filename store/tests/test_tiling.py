@@ -0,0 +1,74 @@
+# store/tests/test_tiling.py
+import numpy as np
+import pytest
+
+from src.detector import merge_detections
+from src.tiling import is_blank_tile, overlap_bands, tile_grid, tile_views
+
+
+class TestTiling:
+
+    def test_grid_covers_image_with_clipped_edges(self):
+        windows = tile_grid(1000, 1500, 640)
+
+        assert [bbox for _, bbox in windows] == [
+            (0, 0, 640, 640), (0, 640, 640, 1280), (0, 1280, 640, 1500),
+            (640, 0, 1000, 640), (640, 640, 1000, 1280), (640, 1280, 1000, 1500),
+        ]
+        assert [tile_id for tile_id, _ in windows] == list(range(6))
+
+    def test_tiles_are_views(self):
+        img = np.zeros((700, 700, 3), dtype=np.uint8)
+        tiles = tile_views(img, 640)
+
+        assert all(np.shares_memory(tile, img) for _, _, tile in tiles)
+        assert tiles[-1][2].shape == (60, 60, 3)
+
+    def test_white_tile_is_blank(self):
+        tile = np.full((640, 640, 3), 255, dtype=np.uint8)
+        assert is_blank_tile(tile)
+
+    def test_tile_with_text_is_not_blank(self):
+        tile = np.full((640, 640, 3), 255, dtype=np.uint8)
+        tile[100:112, 100:150] = 0  # a word
+        assert not is_blank_tile(tile)
+
+    def test_blank_filter_can_be_disabled(self):
+        tile = np.full((640, 640, 3), 255, dtype=np.uint8)
+        assert not is_blank_tile(tile, min_ink_ratio=0)
+
+    def test_overlapping_grid(self):
+        windows = tile_grid(640, 1500, 640, overlap=64)
+
+        assert [bbox for _, bbox in windows] == [(0, 0, 640, 640), (0, 576, 640, 1216), (0, 1152, 640, 1500)]
+
+    def test_overlap_has_to_be_smaller_than_tile(self):
+        with pytest.raises(ValueError):
+            tile_grid(1000, 1000, 640, overlap=640)
+
+    def test_overlap_bands(self):
+        windows = tile_grid(1000, 1500, 640, overlap=64)
+
+        assert overlap_bands(windows) == ([(576, 640), (1152, 1216)], [(576, 640)])
+
+
+class TestMergeDetections:
+
+    DETECTIONS = np.array([
+        [100, 100, 300, 200, 0.9, 0],   # a stamp box
+        [120, 120, 200, 160, 0.8, 0],   # a label inside of it, within one tile
+        [540, 300, 660, 330, 0.85, 0],  # a word across the first band
+        [560, 302, 630, 328, 0.7, 0],   # the part of it detected by the first tile
+    ], dtype=np.float32)
+
+    def test_only_detections_in_the_bands_are_merged(self):
+        bands = overlap_bands(tile_grid(640, 1500, 640, overlap=64))
+
+        merged = merge_detections(self.DETECTIONS, iou_thres=0.45, fuse_thres=0.7, bands=bands)
+
+        assert merged[:, :4].tolist() == [[100, 100, 300, 200], [540, 300, 660, 330], [120, 120, 200, 160]]
+
+    def test_without_bands_nested_boxes_are_fused(self):
+        merged = merge_detections(self.DETECTIONS, iou_thres=0.45, fuse_thres=0.7)
+
+        assert merged[:, :4].tolist() == [[100, 100, 300, 200], [540, 300, 660, 330]]
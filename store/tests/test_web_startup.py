@@ -0,0 +1,31 @@
+# store/tests/test_web_startup.py
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+
+# the web tier must not import the ml stack, it is only imported in the celery workers
+STARTUP_SCRIPT = """
+import sys
+import django
+django.setup()
+from django.urls import get_resolver
+get_resolver().url_patterns
+import store.tasks
+heavy = [name for name in ("torch", "torchvision", "cv2", "tiler", "pandas", "sklearn") if name in sys.modules]
+print("heavy modules:" + ",".join(heavy))
+"""
+
+
+class TestWebStartup:
+
+    def test_django_setup_does_not_import_ml_stack(self):
+        # the settings module the tests run with (pytest.ini / --ds), not the production settings
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get("DJANGO_SETTINGS_MODULE", "project.settings"))
+        output = subprocess.run(
+            [sys.executable, "-c", STARTUP_SCRIPT], cwd=settings.BASE_DIR, env=env,
+            check=True, capture_output=True, text=True
+        ).stdout
+
+        assert output.strip().splitlines()[-1] == "heavy modules:"
@@ -5,130 +5,282 @@ import os
 
 from django.conf import settings
 
-from src.cleaner import Cleaner
-from src.localizer import Localizer
-from src.recognizer import Recognizer
-from src.interpreter import Interpreter
+from store.models import InferenceProfile
+from store.utility.result_cache import get_params_hash
 
+# the ml stack (src.* -> torch, cv2, yolov7, parseq, ...) is imported inside the functions which run
+# the models, so it is only loaded in the celery workers; the django web processes import this module (via tasks.py)
+# without paying the import time and memory of it
 
 
-# to generate the dynamic ymal file for running the ai models
-def prepare_cfg(project_id, image_name, ai_model_id):
-
-    # Extract the base file name without the extension
-    base_image_name = os.path.splitext(image_name)[0]
+# AI model files mapping based on ai_model_id
+# here will be a problem if you later add/delete the ai model
+AI_MODEL_FILES = {
+    1: 'best.pt',    # Assuming '1' corresponds to the 'best' model
+    2: 'epoch_299.pt'  # And '2' corresponds to the 'epoch_299' model
+}
 
-    # Define the base paths
-    base_media_path = settings.MEDIA_ROOT  # BASE_DIR/media
-    base_output_path = os.path.join(base_media_path, 'outputs', f'project_{project_id}')  # BASE_DIR/media/outputs/project_1
-    base_model_path = os.path.join(settings.BASE_DIR, 'store', 'ai', 'model_weights', 'weights')
-    original_ai_outputs_path = os.path.join(settings.BASE_DIR, 'store', 'ai', 'outputs')
-
-    # AI model files mapping based on ai_model_id
-    # here will be a problem if you later add/delete the ai model
-    ai_models = {
-        1: 'best.pt',    # Assuming '1' corresponds to the 'best' model
-        2: 'epoch_299.pt'  # And '2' corresponds to the 'epoch_299' model
-    }
 
+def get_model_weights_path(ai_model_id):
     # Select the AI model file based on ai_model_id
-    model_file_name = ai_models.get(ai_model_id)
+    model_file_name = AI_MODEL_FILES.get(ai_model_id)
     if not model_file_name:
         raise ValueError(f'AI model with ID {ai_model_id} does not exist')
+    return os.path.join(settings.BASE_DIR, 'store', 'ai', 'model_weights', 'weights', model_file_name)
 
-    # Define the configuration with dynamic paths
-    cfg = {
-        'input': {
-            'image': os.path.join(base_media_path, f'project_{project_id}', image_name),
-            'model': os.path.join(base_model_path, model_file_name)
+
+# load all detectors and the recognizer once, so that no task pays the cold-load cost
+# with an inference server the workers load no models, the server has them
+def warm_up_models():
+    from src.model_registry import registry
+
+    if settings.AI_INFERENCE.get("inference_server"):
+        return registry.stats()
+    for ai_model_id in AI_MODEL_FILES:
+        weights_path = get_model_weights_path(ai_model_id)
+        if not os.path.isfile(weights_path):
+            print(f"warm up skipped for ai model {ai_model_id}, weights not found: {weights_path}")
+            continue
+        registry.get_detector(weights_path)
+    registry.get_recognizer()
+    return registry.stats()
+
+
+# hits/misses/load times of the models resident in this (worker) process
+def get_model_cache_stats():
+    from src.model_registry import registry
+
+    return registry.stats()
+
+
+# inference settings of an ai model for the given profile name (fast, balanced, accurate, ...)
+# a profile stored for the ai model wins over the profiles defined in the settings
+# the room stamp rules of the customer are part of the settings, so that they are part of the result cache key
+def get_inference_settings(ai_model_id, profile_name=None, customer_id=None):
+    profile_name = profile_name or settings.AI_DEFAULT_INFERENCE_PROFILE
+    inference = dict(settings.AI_INFERENCE)
+
+    profile = InferenceProfile.objects.filter(ai_model_id=ai_model_id, name=profile_name).first()
+    if profile is not None:
+        inference.update(profile.as_inference_settings())
+    elif profile_name in settings.AI_INFERENCE_PROFILES:
+        inference.update(settings.AI_INFERENCE_PROFILES[profile_name])
+    else:
+        raise ValueError(f'Inference profile {profile_name} does not exist for AI model with ID {ai_model_id}')
+
+    inference["profile"] = profile_name
+    if customer_id in settings.AI_ROOM_STAMP_RULES:
+        inference["room_stamp_rules"] = str(settings.AI_ROOM_STAMP_RULES[customer_id])
+    return inference
+
+
+# the outputs of every ai model and parameters (see ResultSet.params_hash) have a dir of their own, so that the
+# visual results of the other models stay valid (switching back to a model reuses its results)
+def get_results_dir(ai_model_id, params_hash):
+    return f"model_{ai_model_id}_{params_hash[:8]}"
+
+
+# output paths of an image of a project (BASE_DIR/media/outputs/project_1/<image>/<results dir>/...), the dirs are
+# created
+def get_output_paths(project_id, image_name, results_dir):
+
+    # Extract the base file name without the extension
+    base_image_name = os.path.join(os.path.splitext(image_name)[0], results_dir)
+
+    # Define the base paths
+    base_output_path = os.path.join(settings.MEDIA_ROOT, 'outputs', f'project_{project_id}')  # BASE_DIR/media/outputs/project_1
+
+    paths = {
+        "general": {
+            "output_path": os.path.join(base_output_path, base_image_name)
+        },
+        'text_detection': {
+            "output_path": os.path.join(base_output_path, base_image_name, "text_detection"),
+            "cache_path": os.path.join(base_output_path, base_image_name, "text_detection", "cache"),
+            "cache_tiled_path": os.path.join(base_output_path, base_image_name, "text_detection", "cache", "tiled"),
+            "cache_processed_path": os.path.join(base_output_path, base_image_name, "text_detection", "cache", "processed"),
+            "cache_processed_labels_path": os.path.join(base_output_path, base_image_name, "text_detection", "cache", "processed", "labels"),
+            "final_path": os.path.join(base_output_path, base_image_name, "text_detection", "final"),
+            "final_visual_path": os.path.join(base_output_path, base_image_name, "text_detection", "final", "visual"),
+            "final_original_path": os.path.join(base_output_path, base_image_name, "text_detection", "final", "original"),
+        },
+        'text_recognition': {
+            "output_path": os.path.join(base_output_path, base_image_name, "text_recognition"),
+            "cache_path": os.path.join(base_output_path, base_image_name, "text_recognition", "cache"),
+            "cache_tiled_path": os.path.join(base_output_path, base_image_name, "text_recognition", "cache", "tiled"),
+            "cache_processed_path": os.path.join(base_output_path, base_image_name, "text_recognition", "cache", "processed"),
+            "cache_processed_labels_path": os.path.join(base_output_path, base_image_name, "text_recognition", "cache", "processed", "labels"),
+            "final_path": os.path.join(base_output_path, base_image_name, "text_recognition", "final"),
+            "final_visual_path": os.path.join(base_output_path, base_image_name, "text_recognition", "final", "visual"),
+            "final_original_path": os.path.join(base_output_path, base_image_name, "text_recognition", "final", "original"),
+        },
+        'text_interpretation': {
+            "output_path": os.path.join(base_output_path, base_image_name, "text_interpretation"),
+            "cache_path": os.path.join(base_output_path, base_image_name, "text_interpretation", "cache"),
+            "cache_tiled_path": os.path.join(base_output_path, base_image_name, "text_interpretation", "cache", "tiled"),
+            "cache_processed_path": os.path.join(base_output_path, base_image_name, "text_interpretation", "cache", "processed"),
+            "cache_processed_labels_path": os.path.join(base_output_path, base_image_name, "text_interpretation", "cache", "processed", "labels"),
+            "final_path": os.path.join(base_output_path, base_image_name, "text_interpretation", "final"),
+            "final_visual_path": os.path.join(base_output_path, base_image_name, "text_interpretation", "final", "visual"),
+            "final_original_path": os.path.join(base_output_path, base_image_name, "text_interpretation", "final", "original"),
         },
-        'paths': {
-            "general": {
-                "output_path": os.path.join(base_output_path, base_image_name)
-            },
-            'text_detection': {
-                "output_path": os.path.join(base_output_path, base_image_name, "text_detection"),
-                "cache_path": os.path.join(base_output_path, base_image_name, "text_detection", "cache"),
-                "cache_tiled_path": os.path.join(base_output_path, base_image_name, "text_detection", "cache", "tiled"),
-                "cache_processed_path": os.path.join(base_output_path, base_image_name, "text_detection", "cache", "processed"),
-                "cache_processed_labels_path": os.path.join(base_output_path, base_image_name, "text_detection", "cache", "processed", "labels"),
-                "final_path": os.path.join(base_output_path, base_image_name, "text_detection", "final"),
-                "final_visual_path": os.path.join(base_output_path, base_image_name, "text_detection", "final", "visual"),
-                "final_original_path": os.path.join(base_output_path, base_image_name, "text_detection", "final", "original"),
-            },
-            'text_recognition': {
-                "output_path": os.path.join(base_output_path, base_image_name, "text_recognition"),
-                "cache_path": os.path.join(base_output_path, base_image_name, "text_recognition", "cache"),
-                "cache_tiled_path": os.path.join(base_output_path, base_image_name, "text_recognition", "cache", "tiled"),
-                "cache_processed_path": os.path.join(base_output_path, base_image_name, "text_recognition", "cache", "processed"),
-                "cache_processed_labels_path": os.path.join(base_output_path, base_image_name, "text_recognition", "cache", "processed", "labels"),
-                "final_path": os.path.join(base_output_path, base_image_name, "text_recognition", "final"),
-                "final_visual_path": os.path.join(base_output_path, base_image_name, "text_recognition", "final", "visual"),
-                "final_original_path": os.path.join(base_output_path, base_image_name, "text_recognition", "final", "original"),
-            },
-            'text_interpretation': {
-                "output_path": os.path.join(base_output_path, base_image_name, "text_interpretation"),
-                "cache_path": os.path.join(base_output_path, base_image_name, "text_interpretation", "cache"),
-                "cache_tiled_path": os.path.join(base_output_path, base_image_name, "text_interpretation", "cache", "tiled"),
-                "cache_processed_path": os.path.join(base_output_path, base_image_name, "text_interpretation", "cache", "processed"),
-                "cache_processed_labels_path": os.path.join(base_output_path, base_image_name, "text_interpretation", "cache", "processed", "labels"),
-                "final_path": os.path.join(base_output_path, base_image_name, "text_interpretation", "final"),
-                "final_visual_path": os.path.join(base_output_path, base_image_name, "text_interpretation", "final", "visual"),
-                "final_original_path": os.path.join(base_output_path, base_image_name, "text_interpretation", "final", "original"),
-            },
-        }
     }
 
     # Create only the final directories for the outputs
     for process in ['text_detection', 'text_recognition', 'text_interpretation']:
         # for cache
-        os.makedirs(cfg['paths'][process]['cache_tiled_path'], exist_ok=True)
-        os.makedirs(cfg['paths'][process]['cache_processed_labels_path'], exist_ok=True)
+        os.makedirs(paths[process]['cache_tiled_path'], exist_ok=True)
+        os.makedirs(paths[process]['cache_processed_labels_path'], exist_ok=True)
 
         # for final
-        os.makedirs(cfg['paths'][process]['final_visual_path'], exist_ok=True)
-        os.makedirs(cfg['paths'][process]['final_original_path'], exist_ok=True)
+        os.makedirs(paths[process]['final_visual_path'], exist_ok=True)
+        os.makedirs(paths[process]['final_original_path'], exist_ok=True)
+
+    return paths
+
+
+# to generate the dynamic ymal file for running the ai models
+def prepare_cfg(project_id, image_name, ai_model_id, inference_profile=None, customer_id=None):
+    inference = get_inference_settings(ai_model_id, inference_profile, customer_id)
+    results_dir = get_results_dir(ai_model_id, get_params_hash(ai_model_id, inference))
+
+    # Define the configuration with dynamic paths
+    cfg = {
+        'input': {
+            'image': os.path.join(settings.MEDIA_ROOT, f'project_{project_id}', image_name),
+            'model': get_model_weights_path(ai_model_id)
+        },
+        'inference': inference,
+        'paths': get_output_paths(project_id, image_name, results_dir)
+    }
 
     # Write the configuration to a new yaml file within the output path
-    cfg_file_path = os.path.join(base_output_path, base_image_name, 'cfg.yaml')
+    cfg_file_path = os.path.join(cfg['paths']['general']['output_path'], 'cfg.yaml')
     with open(cfg_file_path, 'w') as cfg_file:
         yaml.safe_dump(cfg, cfg_file)
 
     return cfg_file_path
 
 
+# the dynamic yaml file for running the ai models on several images of a project at once: the tiles and snippets of
+# all images are processed in shared batches, every image keeps its own output dirs ("image_paths"), "paths" is only
+# used for the results.json files of the debug mode
+def prepare_project_cfg(project_id, image_names, ai_model_id, inference_profile=None, customer_id=None,
+                        batch_name="batch"):
+    inference = get_inference_settings(ai_model_id, inference_profile, customer_id)
+    results_dir = get_results_dir(ai_model_id, get_params_hash(ai_model_id, inference))
+    cfg = {
+        'input': {
+            'images': [os.path.join(settings.MEDIA_ROOT, f'project_{project_id}', image_name) for image_name in image_names],
+            'model': get_model_weights_path(ai_model_id)
+        },
+        'inference': inference,
+        'paths': get_output_paths(project_id, batch_name, results_dir),
+        'image_paths': {image_name: get_output_paths(project_id, image_name, results_dir) for image_name in image_names}
+    }
 
+    cfg_file_path = os.path.join(cfg['paths']['general']['output_path'], 'cfg.yaml')
+    with open(cfg_file_path, 'w') as cfg_file:
+        yaml.safe_dump(cfg, cfg_file)
 
+    return cfg_file_path
+
+
+
+
+
+# the stages of the ai pipeline by name, every stage runs on a pipeline state and the drawings (file paths) without a
+# checkpoint (see src/checkpoints.py), the models are only loaded when a stage actually runs
+def get_stage_runners(cfg):
+    from src.localizer import Localizer
+    from src.recognizer import Recognizer
+    from src.interpreter import Interpreter
+
+    # the localizer and the recognizer use the models resident in this process, or the ones of the inference server
+    # if the cfg has its address
+    return {
+        "text_detection": lambda state, filenames: Localizer(cfg).inference(filenames, state=state),
+        "text_recognition": lambda state, filenames: Recognizer(cfg).inference(state=state),
+        "text_interpretation": lambda state, filenames: Interpreter(cfg).inference(state=state),
+    }
+
+
+# runs a single stage (text_detection, text_recognition, text_interpretation) of the ai pipeline for the image(s) of
+# the cfg, on the state of the previous stage (PipelineState.to_dict, None for text_detection)
+# returns the state after the stage (PipelineState.to_dict) or None if it failed
+def run_ai_stage(stage, cfg_path, state_dict=None):
+    from src.checkpoints import StageCheckpoints
+    from src.cleaner import Cleaner
+    from src.pipeline_state import PipelineState
 
-def run_ai_model(cfg_path):
     try:
-        # Load the configuration
         with open(cfg_path, 'r') as cfg_file:
             cfg = yaml.safe_load(cfg_file)
+        filenames = cfg["input"].get("images") or [cfg["input"]["image"]]
+        stage_runners = get_stage_runners(cfg)
+        if stage not in stage_runners:
+            raise ValueError(f"unknown stage {stage}")
+
+        if state_dict is None:
+            state = PipelineState(debug=cfg.get("inference", {}).get("debug_outputs", False))
+            with state.timer("setup"):
+                cleaner = Cleaner(cfg)
+                cleaner.setup_dirs()
+                cleaner.clean_dirs()
+        else:
+            # the drawings are decoded again in the process of this stage, only if the stage runs (no checkpoint)
+            state = PipelineState.from_dict(state_dict, [])
+
+        with state.timer(stage):
+            StageCheckpoints.open(cfg, filenames).run(stage, state, stage_runners[stage])
+
+        return state.to_dict()
+    except Exception as e:
+        print(f"AI model stage {stage} failed: {e}")
+        return None
 
-        # Setup directories, clean up, etc.
-        cleaner = Cleaner(cfg)
-        cleaner.setup_dirs()
-        cleaner.clean_dirs()
-
-        # Load input image and run localizer
-        localizer = Localizer(cfg)
-        localizer.inference([cfg["input"]["image"]])
-
-        # Run recognizer
-        recognizer = Recognizer(cfg)
-        recognizer.inference(cfg["paths"]["text_detection"]["final_path"])
 
-        # Run interpreter
-        interpreter = Interpreter(cfg)
-        interpreter.inference(cfg["paths"]["text_recognition"]["final_path"])
+# runs the ai pipeline for the image of the cfg, the stages hand over their results in memory
+# every stage resumes from its checkpoints, only the drawings whose stage inputs or settings changed are processed
+# returns the results of the stages (text_detection, text_recognition, text_interpretation) or None if it failed
+# on_stage is called with the name of every stage before it starts (progress reporting)
+def run_ai_model(cfg_path, on_stage=None):
+    from src.checkpoints import STAGES, StageCheckpoints
+    from src.cleaner import Cleaner
+    from src.pipeline_state import PipelineState
 
-        # You might want to return some results or status from this function
-        return True
+    try:
+        # Load the configuration
+        with open(cfg_path, 'r') as cfg_file:
+            cfg = yaml.safe_load(cfg_file)
+        # a project cfg has several images, their tiles and snippets are processed in shared batches
+        filenames = cfg["input"].get("images") or [cfg["input"]["image"]]
+
+        # only in debug mode the stages write their results.json files and copies of the original image
+        state = PipelineState(debug=cfg.get("inference", {}).get("debug_outputs", False))
+
+        with state.timer("total"):
+            # Setup directories, clean up, etc.
+            with state.timer("setup"):
+                cleaner = Cleaner(cfg)
+                cleaner.setup_dirs()
+                cleaner.clean_dirs()
+                checkpoints = StageCheckpoints.open(cfg, filenames)
+                stage_runners = get_stage_runners(cfg)
+
+            # localizer -> recognizer (the parseq model is resident in this process) -> interpreter
+            for stage in STAGES:
+                if on_stage is not None:
+                    on_stage(stage)
+                with state.timer(stage):
+                    checkpoints.run(stage, state, stage_runners[stage])
+
+        # wall/cpu time and peak rss of the stages and their parts, stored with the result set
+        return dict(state.results, timings=state.timings)
     except Exception as e:
         print(f"AI model processing failed: {e}")
         # Log the error for debugging
-        return False
+        return None
 
 
 
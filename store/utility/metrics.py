@@ -0,0 +1,160 @@
+"""
+Metrics in the prometheus text format (prometheus_client).
+
+Every process (web process, celery worker process) has its own registry. The web processes serve theirs on /metrics
+(together with the depth of the celery queues), every celery worker process on its own small http listener (see
+start_metrics_server), prometheus scrapes all of them and sums up the series.
+"""
+import collections
+from contextlib import contextmanager
+
+from django.conf import settings
+from prometheus_client import (CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest,
+                               start_http_server)
+
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+# the metrics of this process, besides the default registry of prometheus_client (no process and platform metrics)
+REGISTRY = CollectorRegistry()
+
+
+def render():
+    """
+    :return: all metrics of this process in the prometheus text format
+    :rtype: bytes
+    """
+    return generate_latest(REGISTRY)
+
+
+# ---- WORKER ----
+PROCESS_IMAGE_DURATION = Histogram(
+    "ai_process_image_duration_seconds", "Duration of the process_image task by pipeline stage.", ["stage"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300), registry=REGISTRY
+)
+IMAGES_PROCESSED = Counter(
+    "ai_images_processed_total", "Images processed by process_image, by outcome.", ["outcome"], registry=REGISTRY
+)
+TILES_PROCESSED = Counter(
+    "ai_tiles_processed_total", "Tiles of the drawings, by how they were handled.", ["status"], registry=REGISTRY
+)
+SNIPPETS_PROCESSED = Counter(
+    "ai_snippets_processed_total", "Text snippets, by how their text was recognized.", ["status"], registry=REGISTRY
+)
+# the series of a project only exists while this process runs tasks of the project (see task_in_flight), so the
+# number of series stays bounded by the projects running at the same time
+TASKS_IN_FLIGHT = Gauge(
+    "ai_tasks_in_flight", "AI tasks currently running in this process, by project.", ["project_id"],
+    registry=REGISTRY
+)
+_tasks_in_flight = collections.Counter()
+
+# ---- WEB ----
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Latency of the api requests by view and action.",
+    ["view", "action", "method", "status"], registry=REGISTRY
+)
+REQUEST_DB_QUERIES = Histogram(
+    "http_request_db_queries", "Database queries per api request by view and action.", ["view", "action"],
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500), registry=REGISTRY
+)
+QUEUE_DEPTH = Gauge(
+    "celery_queue_depth", "Tasks waiting in the celery queue (read from the broker on every scrape).", ["queue"],
+    registry=REGISTRY
+)
+
+
+# the stages of the pipeline which get a duration series (see run_ai_model and the result cache lookup)
+DURATION_STAGES = ("total", "setup", "text_detection", "text_recognition", "text_interpretation", "result_cache")
+
+
+def record_process_image(result_data, timings, ai_results):
+    """
+    Records a finished process_image task: the duration of its stages, the outcome and the tiles and snippets of
+    the drawing.
+    """
+    for stage in DURATION_STAGES:
+        if stage in timings:
+            PROCESS_IMAGE_DURATION.labels(stage=stage).observe(timings[stage]["wall_seconds"])
+
+    if not result_data["success"]:
+        IMAGES_PROCESSED.labels(outcome="failed").inc()
+        return
+    IMAGES_PROCESSED.labels(outcome="result_cache" if result_data["result_cache"] == "hit" else "processed").inc()
+    if result_data["result_cache"] == "hit":
+        return
+
+    # stages restored from their checkpoints (see src/checkpoints.py) processed no tiles and snippets
+    for image in ai_results["text_detection"].values():
+        meta = image.get("meta", {})
+        if meta.get("checkpoint"):
+            continue
+        skipped, cached = meta.get("tiles_skipped", 0), meta.get("tiles_cached", 0)
+        TILES_PROCESSED.labels(status="detected").inc(meta.get("tiles", 0) - skipped - cached)
+        TILES_PROCESSED.labels(status="blank").inc(skipped)
+        TILES_PROCESSED.labels(status="tile_cache").inc(cached)
+
+    for image in ai_results["text_recognition"].values():
+        if image.get("meta", {}).get("checkpoint"):
+            continue
+        snippets = len(image.get("elements", []))
+        memo_hits = image.get("meta", {}).get("snippet_memo", {}).get("hits", 0)
+        SNIPPETS_PROCESSED.labels(status="recognized").inc(snippets - memo_hits)
+        SNIPPETS_PROCESSED.labels(status="snippet_memo").inc(memo_hits)
+
+
+@contextmanager
+def task_in_flight(project_id):
+    """
+    Counts a running task of the project in ai_tasks_in_flight.
+    """
+    project_id = str(project_id)
+    _tasks_in_flight[project_id] += 1
+    TASKS_IN_FLIGHT.labels(project_id=project_id).inc()
+    try:
+        yield
+    finally:
+        _tasks_in_flight[project_id] -= 1
+        if _tasks_in_flight[project_id] > 0:
+            TASKS_IN_FLIGHT.labels(project_id=project_id).dec()
+        else:
+            forget_project(project_id)
+
+
+def forget_project(project_id):
+    # removes the in-flight series of a project whose run is over
+    project_id = str(project_id)
+    _tasks_in_flight.pop(project_id, None)
+    try:
+        TASKS_IN_FLIGHT.remove(project_id)
+    except KeyError:
+        pass
+
+
+def update_queue_depths():
+    # the redis broker keeps every queue as a list with the name of the queue
+    try:
+        import redis
+        client = redis.Redis.from_url(settings.CELERY_BROKER_URL, socket_timeout=1)
+        for queue in settings.METRICS_CELERY_QUEUES:
+            QUEUE_DEPTH.labels(queue=queue).set(client.llen(queue))
+    except Exception as e:
+        print(f"reading the celery queue depths failed: {e}")
+
+
+def start_metrics_server(port, tries=16, address="127.0.0.1"):
+    """
+    Serves the registry of this process on the first free port of port, port + 1, ... (the prefork pool of a celery
+    worker has several processes on one node), in a daemon thread. Only on the loopback interface by default, the
+    listener has no authentication.
+
+    :return: the port, None if no port was free
+    :rtype: int or None
+    """
+    for candidate in range(port, port + tries):
+        try:
+            start_http_server(candidate, addr=address, registry=REGISTRY)
+        except OSError:
+            continue
+        return candidate
+    return None
@@ -0,0 +1,158 @@
+import time
+from contextlib import contextmanager
+
+from django.core.cache import cache
+
+
+# the progress of the running projects lives in the shared (redis) cache: one entry per run of a project and one per
+# image. The stages of an image may run in different worker processes, so the entry of an image is only ever
+# overwritten as a whole (never read, updated and written back), the start of its processing is kept in an entry of
+# its own which only the first write sets (cache.add). The entry of the run is updated under a lock (see run_lock).
+PROGRESS_TIMEOUT = 24 * 60 * 60
+# a lock of a run left by a crashed process expires after this many seconds
+LOCK_TIMEOUT = 10
+
+QUEUED = "queued"
+PROCESSING = "processing"
+DONE = "done"
+FAILED = "failed"
+
+# the eta is estimated from the throughput of the last finished images
+RECENT_IMAGES = 10
+
+
+def run_key(project_id):
+    return f"ai_progress:{project_id}"
+
+
+def image_key(project_id, image_id):
+    return f"ai_progress:{project_id}:image:{image_id}"
+
+
+def started_key(project_id, image_id):
+    return f"ai_progress:{project_id}:image:{image_id}:started_at"
+
+
+@contextmanager
+def run_lock(project_id):
+    # cache.add only sets a missing key (SET NX in redis), so one process at a time holds the lock
+    key = f"{run_key(project_id)}:lock"
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    while not cache.add(key, True, LOCK_TIMEOUT):
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"progress of project {project_id} is locked")
+        time.sleep(0.01)
+    try:
+        yield
+    finally:
+        cache.delete(key)
+
+
+def _queue_images(project_id, image_ids):
+    cache.set_many(
+        {image_key(project_id, image_id): {"status": QUEUED, "stage": None} for image_id in image_ids},
+        PROGRESS_TIMEOUT
+    )
+    cache.delete_many([started_key(project_id, image_id) for image_id in image_ids])
+
+
+def _start_run(project_id, image_ids):
+    image_ids = list(image_ids)
+    cache.set(run_key(project_id), {"image_ids": image_ids, "started_at": time.time()}, PROGRESS_TIMEOUT)
+    _queue_images(project_id, image_ids)
+
+
+def start_run(project_id, image_ids):
+    with run_lock(project_id):
+        _start_run(project_id, image_ids)
+
+
+def extend_run(project_id, image_ids):
+    # images added to the running run of the project (start_rest while the project is processing)
+    with run_lock(project_id):
+        run = cache.get(run_key(project_id))
+        if run is None:
+            return _start_run(project_id, image_ids)
+        new_image_ids = [image_id for image_id in image_ids if image_id not in run["image_ids"]]
+        run["image_ids"] = run["image_ids"] + new_image_ids
+        cache.set(run_key(project_id), run, PROGRESS_TIMEOUT)
+        _queue_images(project_id, new_image_ids)
+
+
+def cancel_run(project_id):
+    with run_lock(project_id):
+        run = cache.get(run_key(project_id))
+        if run is not None:
+            run["cancelled"] = True
+            cache.set(run_key(project_id), run, PROGRESS_TIMEOUT)
+
+
+def set_image_status(project_id, image_id, status, stage=None):
+    entry = {"status": status, "stage": stage}
+    now = time.time()
+    if status == PROCESSING:
+        cache.add(started_key(project_id, image_id), now, PROGRESS_TIMEOUT)
+    elif status in (DONE, FAILED):
+        entry["finished_at"] = now
+        started_at = cache.get(started_key(project_id, image_id))
+        if started_at is not None:
+            entry["seconds"] = now - started_at
+    cache.set(image_key(project_id, image_id), entry, PROGRESS_TIMEOUT)
+
+
+def estimate_eta(started_at, finished_at, remaining):
+    """
+    Seconds until the remaining images are done, from the throughput of the last finished images (the parallelism
+    of the workers is part of the throughput), None before the first image is done.
+
+    :rtype: float or None
+    """
+    if not remaining:
+        return 0.0
+    recent = sorted(finished_at)[-RECENT_IMAGES:]
+    if len(recent) >= 2 and recent[-1] > recent[0]:
+        images_per_second = (len(recent) - 1) / (recent[-1] - recent[0])
+    elif recent and recent[-1] > started_at:
+        images_per_second = len(finished_at) / (recent[-1] - started_at)
+    else:
+        return None
+    return remaining / images_per_second
+
+
+def get_progress(project_id):
+    """
+    :return: number of images per status, status and stage per image and the eta of the last run of the project,
+             None if the project was not started (or its progress expired)
+    :rtype: dict or None
+    """
+    run = cache.get(run_key(project_id))
+    if run is None:
+        return None
+
+    entries = cache.get_many([image_key(project_id, image_id) for image_id in run["image_ids"]])
+    images = []
+    counts = {QUEUED: 0, PROCESSING: 0, DONE: 0, FAILED: 0}
+    finished_at = []
+    seconds = []  # (finished at, seconds) of the finished images
+    for image_id in run["image_ids"]:
+        entry = entries.get(image_key(project_id, image_id), {"status": QUEUED, "stage": None})
+        counts[entry["status"]] += 1
+        images.append({"image_id": image_id, "status": entry["status"], "stage": entry["stage"]})
+        if "finished_at" in entry:
+            finished_at.append(entry["finished_at"])
+            if "seconds" in entry:
+                seconds.append((entry["finished_at"], entry["seconds"]))
+    recent_seconds = [image_seconds for _, image_seconds in sorted(seconds)[-RECENT_IMAGES:]]
+
+    remaining = counts[QUEUED] + counts[PROCESSING]
+    return {
+        "project_id": project_id,
+        "total": len(run["image_ids"]),
+        **counts,
+        "finished": remaining == 0 or run.get("cancelled", False),
+        "cancelled": run.get("cancelled", False),
+        "started_at": run["started_at"],
+        "seconds_per_image": sum(recent_seconds) / len(recent_seconds) if recent_seconds else None,
+        "eta_seconds": estimate_eta(run["started_at"], finished_at, remaining),
+        "images": images,
+    }
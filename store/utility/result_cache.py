@@ -0,0 +1,120 @@
+import hashlib
+import json
+import os
+import shutil
+
+from django.conf import settings
+from django.core.cache import cache
+
+from store.models import ResultSet
+
+
+# bump this, if a change of the pipeline code changes the results, so that no old result is reused
+RESULT_CACHE_VERSION = 2
+
+# these inference settings do not change the results
+IGNORED_INFERENCE_SETTINGS = {
+    "profile", "debug_tiles", "debug_outputs", "batch_size", "recognition_batch_size",
+    "tile_cache_path", "tile_cache_max_bytes",
+    "snippet_memo_path", "snippet_memo_max_bytes",
+    "checkpoint_path", "checkpoint_max_bytes", "inference_server",
+}
+
+HITS_KEY = "ai_result_cache:hits"
+MISSES_KEY = "ai_result_cache:misses"
+
+
+def get_params_hash(ai_model_id, inference):
+    """
+    Hash of everything besides the drawing itself which determines the result of the pipeline: the ai model (weights),
+    the inference settings and the version of the pipeline.
+
+    :rtype: str
+    """
+    params = {
+        "version": RESULT_CACHE_VERSION,
+        "ai_model_id": ai_model_id,
+        "inference": {key: value for key, value in inference.items() if key not in IGNORED_INFERENCE_SETTINGS},
+    }
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+
+def find_cached_result_set(image, ai_model_id, params_hash):
+    """
+    Finds a result of an image with the same content, processed with the same ai model and parameters, whose visual
+    results still exist. Results of the image itself are found as well.
+
+    :rtype: ResultSet or None
+    """
+    if not image.content_hash:
+        return None
+
+    candidates = ResultSet.objects.filter(
+        image__content_hash=image.content_hash, ai_model_id=ai_model_id, params_hash=params_hash
+    ).select_related("image").order_by("-updated_at")
+
+    for result_set in candidates:
+        visual_paths = [
+            result_set.text_detection_image_path,
+            result_set.text_recognition_image_path,
+            result_set.text_interpretation_image_path,
+        ]
+        if all(path and os.path.isfile(os.path.join(settings.MEDIA_ROOT, path)) for path in visual_paths):
+            return result_set
+    return None
+
+
+def rename_image_in_result(result, old_name, new_name):
+    """
+    The results are keyed by the image (file) name, the reused result gets the name of the new image.
+
+    :rtype: dict
+    """
+    result = {new_name if key == old_name else key: value for key, value in result.items()}
+    if isinstance(result.get(new_name), dict) and "visual_result_path" in result[new_name]:
+        result[new_name] = dict(result[new_name], visual_result_path="visual/" + new_name)
+    return result
+
+
+def link_file(source_relative_path, target_relative_path):
+    """
+    Hardlinks a file below MEDIA_ROOT (copies it, if the file system does not support hardlinks).
+    """
+    source = os.path.join(settings.MEDIA_ROOT, source_relative_path)
+    target = os.path.join(settings.MEDIA_ROOT, target_relative_path)
+    if os.path.abspath(source) == os.path.abspath(target):
+        return
+
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    if os.path.lexists(target):
+        os.remove(target)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+def record_lookup(hit):
+    # counters in the shared (redis) cache, so that the hit rate covers all worker processes
+    key = HITS_KEY if hit else MISSES_KEY
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # the key was evicted in between
+        cache.set(key, 1, timeout=None)
+
+
+def get_stats():
+    hits = cache.get(HITS_KEY, 0)
+    misses = cache.get(MISSES_KEY, 0)
+    lookups = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": hits / lookups if lookups else 0.0,
+    }
+
+
+def reset_stats():
+    cache.delete_many([HITS_KEY, MISSES_KEY])
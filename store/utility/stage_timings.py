@@ -0,0 +1,46 @@
+def aggregate_timings(timings_list):
+    """
+    Aggregates the timings of the result sets of a project per stage: number of images, total / mean / max wall
+    time, total / mean cpu time and the max peak rss.
+
+    :param timings_list: timings of the result sets (see ResultSet.timings)
+    :rtype: dict
+    """
+    stages = {}
+    for timings in timings_list:
+        for name, timing in (timings or {}).items():
+            stage = stages.setdefault(name, {
+                "images": 0,
+                "wall_seconds_total": 0.0,
+                "wall_seconds_max": 0.0,
+                "cpu_seconds_total": 0.0,
+                "peak_rss_mb_max": 0.0,
+            })
+            stage["images"] += 1
+            stage["wall_seconds_total"] += timing.get("wall_seconds", 0.0)
+            stage["wall_seconds_max"] = max(stage["wall_seconds_max"], timing.get("wall_seconds", 0.0))
+            stage["cpu_seconds_total"] += timing.get("cpu_seconds", 0.0)
+            stage["peak_rss_mb_max"] = max(stage["peak_rss_mb_max"], timing.get("peak_rss_mb", 0.0))
+
+    for stage in stages.values():
+        stage["wall_seconds_mean"] = stage["wall_seconds_total"] / stage["images"]
+        stage["cpu_seconds_mean"] = stage["cpu_seconds_total"] / stage["images"]
+    return stages
+
+
+def share_of_batch(timings, images):
+    """
+    The share of one image of the timings of a batch of images (wall and cpu time divided by the number of images),
+    so that the aggregated timings of a project stay comparable to the ones of single images.
+
+    :rtype: dict
+    """
+    return {
+        name: dict(
+            timing,
+            wall_seconds=timing["wall_seconds"] / images,
+            cpu_seconds=timing["cpu_seconds"] / images,
+            batch_images=images,
+        )
+        for name, timing in timings.items()
+    }
@@ -1,3 +1,4 @@
+import hashlib
 import os
 
 def project_image_directory_path(instance, filename):
@@ -11,6 +12,14 @@ def project_image_directory_path(instance, filename):
     return os.path.join(project_directory, f"{instance.name}")
 
 
+# sha256 of the content of a (django) file, read in chunks
+def file_sha256(file):
+    sha256 = hashlib.sha256()
+    for chunk in file.chunks():
+        sha256.update(chunk)
+    return sha256.hexdigest()
+
+
 # def project_result_image_directory_path(instance, filename):
 #     # Directory based on the project's ID
 #     project_directory = f'outputs/project_{instance.project.id}'
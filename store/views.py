@@ -1,26 +1,31 @@
 from uuid import uuid4
+import json
 import time
 import sys, os, shutil
-from celery import group, chord
+from celery import current_app, group, chord
 from django.db import transaction
 
 
 #django
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404
 from django.db.models.aggregates import Count
 from django_filters.rest_framework import DjangoFilterBackend
 from django.conf import settings
+from django.utils import timezone
 
 
 # rest_framework
 from rest_framework.response import Response
 from rest_framework import status
+from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet
 from rest_framework.filters import SearchFilter, OrderingFilter
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
 from rest_framework.parsers import MultiPartParser, FormParser
-from rest_framework.exceptions import PermissionDenied
+from rest_framework.exceptions import PermissionDenied, ValidationError
+from rest_framework.renderers import JSONRenderer, BrowsableAPIRenderer
 
 # for customize the Viewset(replacing the ModelViewSet)
 from rest_framework.mixins import (CreateModelMixin, ListModelMixin,
@@ -29,17 +34,30 @@ from rest_framework.mixins import (CreateModelMixin, ListModelMixin,
 from rest_framework.viewsets import GenericViewSet, ReadOnlyModelViewSet
 
 # inside
-from .models import Customer, AiModel, Project, Image, ResultSet
+from .models import Customer, AiModel, Project, ProjectRun, Image, ResultSet
 from .serilizers import (CustomerModelSerializer, PatchCustomerModelSerilizer,
                          AisModelSerilizer, ProjectsModelSerilizer,
                          CreateProjectsModelSerilizer, UpdateProjectsModelSerilizer,
                          ImageModelSerializer, ResultSetModelSerializer)
-from .permissions import IsAdminOrReadOnly
-from .utility.ai_utils import prepare_cfg, run_ai_model
-from .tasks import process_image, update_project_status
+from .permissions import IsAdminOrMetricsScraper, IsAdminOrReadOnly
+from .renderers import EventStreamRenderer
+from .utility import metrics as ai_metrics
+from .utility import progress, result_cache
+from .utility.stage_timings import aggregate_timings
+from .tasks import dispatch_processing, update_project_status
 
 
 
+# metrics of this web process in the prometheus text format: /metrics, for the admins and the prometheus server
+# the celery worker processes serve theirs on their own port (see METRICS_WORKER_PORT)
+class MetricsView(APIView):
+    permission_classes = [IsAdminOrMetricsScraper]
+
+    def get(self, request):
+        ai_metrics.update_queue_depths()
+        return HttpResponse(ai_metrics.render(), content_type=ai_metrics.CONTENT_TYPE)
+
+
 # ViewSet for Customer
 class BaseCustomerViewSet(CreateModelMixin, RetrieveModelMixin, UpdateModelMixin, ListModelMixin, DestroyModelMixin, GenericViewSet):
     pass
@@ -112,6 +130,11 @@ class AIsViewSet(CreateModelMixin, RetrieveModelMixin, ListModelMixin, GenericVi
             "request": self.request
         }
 
+    # hit rate of the result cache (identical drawings are not processed again): /store/ais/result-cache/
+    @action(detail=False, methods=["GET"], url_path='result-cache', permission_classes=[IsAdminUser])
+    def result_cache_stats(self, request):
+        return Response(result_cache.get_stats())
+
 # supports GET-List -> /store/projects
 # supports POST-List -> /store/projects
 # supports GET-Detail -> /store/projects/1
@@ -179,10 +202,18 @@ class ProjectsViewSet(ModelViewSet):
     def update(self, request, *args, **kwargs):
         partial = kwargs.pop('partial', False)
         instance = self.get_object()
+        old_ai_model_id = instance.ai_model_id
+        old_inference_profile = instance.inference_profile
         serializer = self.get_serializer(instance, data=request.data, partial=partial)
         serializer.is_valid(raise_exception=True)
         self.perform_update(serializer)
 
+        # switching the ai model or the inference profile: the images with stored results of the new ai model and
+        # inference settings are done at once, only the others are left for start_rest
+        if instance.ai_model_id != old_ai_model_id or instance.inference_profile != old_inference_profile:
+            instance.update_has_result()
+            instance.update_status_based_on_images()
+
         # Serialize the response with full details
         response_serializer = ProjectsModelSerilizer(instance)
         return Response(response_serializer.data)
@@ -255,6 +286,68 @@ class ProjectsViewSet(ModelViewSet):
             return Response({"message": f"image with id {image_id} is deleted"}, status=status.HTTP_204_NO_CONTENT)
 
 
+    # per stage timings of the processed images of the project, read only: /store/projects/1/timings/
+    @action(detail=True, methods=["GET"], url_path='timings')
+    def timings(self, request, pk=None):
+        project = self.get_object()
+        timings_list = ResultSet.latest_of_project(project).values_list("timings", flat=True)
+        return Response({
+            "project_id": project.id,
+            "images_nr": len(timings_list),
+            "stages": aggregate_timings(timings_list),
+        })
+
+    # the progress endpoints only check the access to the project, they neither serialize the images nor update the
+    # project status (unlike retrieve)
+    def get_progress_or_404(self, pk):
+        projects = Project.objects.filter(id=pk)
+        if not self.request.user.is_staff:
+            projects = projects.filter(customer__user=self.request.user)
+        if not projects.exists():
+            raise Http404
+        run_progress = progress.get_progress(int(pk))
+        if run_progress is None:
+            raise Http404("the project was not started")
+        return run_progress
+
+    # images queued / processing / done / failed, the stage of every image and the eta of the last run of the
+    # project, from the counters the workers update: /store/projects/1/progress/
+    @action(detail=True, methods=["GET"], url_path='progress')
+    def project_progress(self, request, pk=None):
+        return Response(self.get_progress_or_404(pk))
+
+    # the same as server-sent events, one "progress" event every AI_PROGRESS_STREAM_INTERVAL seconds and an "end"
+    # event when the run is finished: /store/projects/1/progress/stream/
+    # the stream holds a worker thread, so it is closed after AI_PROGRESS_STREAM_TIMEOUT seconds and the client
+    # reconnects after the "retry" delay (EventSource does so by itself)
+    @action(detail=True, methods=["GET"], url_path='progress/stream',
+            renderer_classes=[EventStreamRenderer, JSONRenderer, BrowsableAPIRenderer])
+    def project_progress_stream(self, request, pk=None):
+        run_progress = self.get_progress_or_404(pk)
+        project_id = int(pk)
+
+        def events(run_progress):
+            deadline = time.monotonic() + settings.AI_PROGRESS_STREAM_TIMEOUT
+            yield f"retry: {int(settings.AI_PROGRESS_STREAM_INTERVAL * 1000)}\n\n"
+            while True:
+                yield f"event: progress\ndata: {json.dumps(run_progress)}\n\n"
+                if run_progress["finished"]:
+                    break
+                if time.monotonic() + settings.AI_PROGRESS_STREAM_INTERVAL > deadline:
+                    # closed without an "end" event, the client reconnects
+                    return
+                time.sleep(settings.AI_PROGRESS_STREAM_INTERVAL)
+                run_progress = progress.get_progress(project_id)
+                if run_progress is None:
+                    break
+            yield "event: end\ndata: {}\n\n"
+
+        response = StreamingHttpResponse(events(run_progress), content_type="text/event-stream")
+        response["Cache-Control"] = "no-cache"
+        # no buffering by a reverse proxy (nginx)
+        response["X-Accel-Buffering"] = "no"
+        return response
+
     # this is a trigger endpoints while visiting "http://127.0.0.1:8001/store/projects/1/start"()
     # extract project_id  -->  get image_nr, model_id
     # for a single image, dynamic yaml file is created, and the call the run_ai_model() function
@@ -264,54 +357,96 @@ class ProjectsViewSet(ModelViewSet):
     def start(self, request, pk=None):
         project = self.get_object()
         project_id = project.id
-        project_name = project.name
         ai_model_id = project.ai_model.id
-        ai_model_name = project.ai_model.name
 
-        # the related output path
-        output_path = os.path.join(settings.MEDIA_ROOT, 'outputs', f'project_{project_id}')
+        # the old outputs are kept: every image overwrites its own outputs, and unchanged images reuse their results
+        # (and visual results) from the result cache instead of being processed again
+        image_ids = list(project.images.values_list("id", flat=True))
 
-        # for timeing reasons(retriggering will take more time), delete the old output
-        if os.path.exists(output_path):
-            shutil.rmtree(output_path)
+        # only one run per project: the project row is locked while checking for a running run, a second start is
+        # rejected (the workers of the first run are still writing the outputs)
+        with transaction.atomic():
+            project = Project.objects.select_for_update().get(id=project_id)
+            active_run = ProjectRun.get_active(project_id)
+            if active_run is not None:
+                return Response({"message": "THE PROJECT IS ALREADY PROCESSING", "run_id": active_run.id},
+                                status=status.HTTP_409_CONFLICT)
+            run = ProjectRun.objects.create(project_id=project_id, image_ids=image_ids)
 
-        # set the project status
-        project.status = Project.STATUS_CHOICES[1][0]  # 'PROCESSING'
-        project.save()
+            # set the project status
+            project.status = Project.STATUS_CHOICES[1][0]  # 'PROCESSING'
+            project.save()
 
-        task_ids = []
-        for image in project.images.all():
-            task = process_image.delay(project_id, image.id, ai_model_id)
-            task_ids.append(task.id)
+        # images are processed in chunks per task or one task per image (see AI_EXECUTION_MODE)
+        run.task_ids = dispatch_processing(project_id, image_ids, ai_model_id)
+        run.save(update_fields=["task_ids"])
 
-        return Response({"message": "GOT IT, START PROCESSING"}, status=status.HTTP_202_ACCEPTED)
+        return Response({"message": "GOT IT, START PROCESSING", "run_id": run.id}, status=status.HTTP_202_ACCEPTED)
 
     # Processing a single image by calling: http://127.0.0.1:8001/store/projects/4/start_rest
     @action(detail=True, methods=["POST"], url_path='start_rest')
     def start_rest(self, request, pk=None):
         project = self.get_object()  # Get the project instance
         project_id = project.id
-        project_name = project.name
         ai_model_id = project.ai_model.id
-        ai_model_name = project.ai_model.name
 
         # Filter images that have not been processed yet
-        unprocessed_images = project.images.filter(has_result=False)
+        unprocessed_image_ids = list(project.images.filter(has_result=False).values_list("id", flat=True))
 
         # If there are no unprocessed images, return a response
-        if not unprocessed_images:
+        if not unprocessed_image_ids:
             return Response({"message": "NO REST IMAGES TO PROCESS"}, status=status.HTTP_202_ACCEPTED)
 
-        # set the project status
-        project.status = Project.STATUS_CHOICES[1][0]  # 'PROCESSING'
-        project.save()
+        # while the project is processing, the images which are not part of the running run are merged into it
+        with transaction.atomic():
+            project = Project.objects.select_for_update().get(id=project_id)
+            run = ProjectRun.get_active(project_id)
+            new_run = run is None
+            if new_run:
+                run = ProjectRun.objects.create(project_id=project_id)
+            image_ids = [image_id for image_id in unprocessed_image_ids if image_id not in run.image_ids]
+            if not image_ids:
+                return Response({"message": "THE REST IMAGES ARE ALREADY PROCESSING", "run_id": run.id},
+                                status=status.HTTP_202_ACCEPTED)
+            run.image_ids = run.image_ids + image_ids
+            run.save(update_fields=["image_ids"])
+
+            # set the project status
+            project.status = Project.STATUS_CHOICES[1][0]  # 'PROCESSING'
+            project.save()
+
+        task_ids = dispatch_processing(project_id, image_ids, ai_model_id, new_run=new_run)
+        # the run row is locked, so that a concurrent start_rest does not lose task ids
+        with transaction.atomic():
+            run = ProjectRun.objects.select_for_update().get(id=run.id)
+            run.task_ids = run.task_ids + task_ids
+            run.save(update_fields=["task_ids"])
+
+        return Response({"message": "GOT IT, START PROCESSING", "run_id": run.id}, status=status.HTTP_202_ACCEPTED)
+
+    # cancels the running run of the project: /store/projects/4/cancel
+    # queued tasks are revoked, running tasks are terminated, so that the workers are free immediately
+    @action(detail=True, methods=["POST"], url_path='cancel')
+    def cancel(self, request, pk=None):
+        project = self.get_object()
+
+        with transaction.atomic():
+            project = Project.objects.select_for_update().get(id=project.id)
+            run = ProjectRun.get_active(project.id)
+            if run is None:
+                return Response({"message": "THE PROJECT IS NOT PROCESSING"}, status=status.HTTP_409_CONFLICT)
 
-        task_ids = []
-        for image in unprocessed_images:
-            task = process_image.delay(project_id, image.id, ai_model_id)
-            task_ids.append(task.id)
+            current_app.control.revoke(run.task_ids, terminate=True)
+            progress.cancel_run(project.id)
 
-        return Response({"message": "GOT IT, START PROCESSING"}, status=status.HTTP_202_ACCEPTED)
+            run.status = 'CANCELLED'
+            run.finished_at = timezone.now()
+            run.save(update_fields=["status", "finished_at"])
+            project.status = 'CANCELLED'
+            project.save()
+
+        return Response({"message": "PROCESSING CANCELLED", "run_id": run.id, "revoked_tasks": len(run.task_ids)},
+                        status=status.HTTP_200_OK)
 
 
 
@@ -333,24 +468,44 @@ class ProjectsViewSet(ModelViewSet):
 
 
 
+# the results of the current ai model of the project, the results of another ai model with ?ai_model=<id>:
+# /store/projects/1/results/?ai_model=2
 class ResultSetViewSet(ReadOnlyModelViewSet):
     serializer_class = ResultSetModelSerializer
     permission_classes = [IsAuthenticated]
 
+    def get_ai_model_id(self):
+        ai_model_id = self.request.query_params.get('ai_model')
+        if ai_model_id is None:
+            return None
+        try:
+            return int(ai_model_id)
+        except ValueError:
+            raise ValidationError({"ai_model": "must be the id of an ai model"})
+
+    # the current result set of every image of the project with the ai model (with the current inference settings of
+    # the project)
+    def get_result_sets(self, project_id):
+        project = Project.objects.filter(id=project_id).first()
+        if project is None:
+            return ResultSet.objects.none()
+        return ResultSet.latest_of_project(project, self.get_ai_model_id())
+
     def get_queryset(self):
 
         project_id = self.kwargs.get('project_pk')
         user = self.request.user
+        result_sets = self.get_result_sets(project_id)
 
         if user.is_staff:  # or user.is_superuser if you want to restrict to superusers
-            return ResultSet.objects.filter(project_id=project_id)
+            return result_sets
 
         # Check if the project belongs to the user
         if not Project.objects.filter(id=project_id, customer__user=user).exists():
             raise PermissionDenied("You do not have permission to access this project's results.")
 
         # Filter by the user's customer-related projects
-        return ResultSet.objects.filter(project_id=project_id, project__customer__user=user)
+        return result_sets.filter(project__customer__user=user)
 
     # DIY the retrieve response(means retrieve only one item), response according to the image id
     def retrieve(self, request, *args, **kwargs):
@@ -365,7 +520,7 @@ class ResultSetViewSet(ReadOnlyModelViewSet):
             raise PermissionDenied("You do not have permission to access this project's results.")
 
         # Hier wird angenommen, dass der 'pk' in der URL die Image-ID und nicht die ResultSet-ID ist.
-        queryset = ResultSet.objects.filter(project_id=project_id, image_id=image_id)
+        queryset = self.get_result_sets(project_id).filter(image_id=image_id)
         result_set = get_object_or_404(queryset)
         serializer = self.get_serializer(result_set)
         return Response(serializer.data)